@@ -1,5 +1,3 @@
-from collections import defaultdict
-
 import tornado
 import tornado.web
 import tornado.options
@@ -8,42 +6,111 @@ from tornado.web import url
 from api.handlers.ask import Ask
 from api.handlers.chat import Chat
 from api.handlers.feedback import Feedback
+from api.handlers.metrics import Metrics
 from api.handlers.proxy import Proxy
 from api.handlers.status import Status
 from api.handlers.cache import Cache
 from api.handlers.websocket import WebSocket
 from api.logic.ask import Ask as AskLogic
+from api.logic.feedback import FeedbackQueue
+from api.logic.health import Health
+from api.logic.websocket import WebSocket as WebSocketLogic
+from api.rate_limit import RateLimiter
+from api.bus import create_bus
+from api.connections import Connections, IdleReaper
 from api.handlers import FacebookUserHandler, UserFavoriteHandler, UserFavoritesHandler
+from api.settings import DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL, SUGGESTION_PAGES_CACHE_SIZE, \
+    SUGGESTION_PAGES_CACHE_TTL, CONTEXT_CACHE_SIZE, WEBSOCKET_PING_INTERVAL, WEBSOCKET_PING_TIMEOUT
+
+client_handlers = Connections()
+
+
+def create_caches() -> dict:
+    from api.cache import ProductDetailCache, UserInfoCache, FavoritesCache, DetectionCache, SuggestionPagesCache, \
+        ContextCache
+    return {
+        "product_cache": ProductDetailCache(4096),
+        "user_info_cache": UserInfoCache(1024),
+        "favorites_cache": FavoritesCache(1024),
+        "detection_cache": DetectionCache(DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL),
+        "suggestion_pages": SuggestionPagesCache(SUGGESTION_PAGES_CACHE_SIZE, SUGGESTION_PAGES_CACHE_TTL),
+        "context_cache": ContextCache(CONTEXT_CACHE_SIZE)
+    }
+
+
+def clear_caches(caches: dict):
+    """
+    what DELETE /cache clears, in a worker told to by the supervisor
+    """
+    for key in ["product_cache", "detection_cache", "suggestion_pages"]:
+        caches[key].clear()
 
-client_handlers = defaultdict(dict)
+
+def warm_caches(caches: dict, product_ids: list):
+    """
+    load what every worker needs before forking, so the workers share it instead of each fetching its own copy
+    """
+    for _id in product_ids:
+        caches["product_cache"].get(_id)
 
 
 class Application(tornado.web.Application):
-    def __init__(self):
-        from api.cache import ProductDetailCache, UserInfoCache, FavoritesCache
-        product_cache = ProductDetailCache(4096)
-        user_info_cache = UserInfoCache(1024)
-        favorites_cache = FavoritesCache(1024)
+    def __init__(self, caches: dict = None):
+        """
+        :param caches: from create_caches, made here when not given
+        """
+        caches = caches if caches is not None else create_caches()
+        product_cache = caches["product_cache"]
+        user_info_cache = caches["user_info_cache"]
+        favorites_cache = caches["favorites_cache"]
+        detection_cache = caches["detection_cache"]
+        suggestion_pages = caches["suggestion_pages"]
+        context_cache = caches["context_cache"]
 
-        ask_logic = AskLogic(product_cache)
-        # ws_logic = WebSocketLogic(product_cache)
+        ask_logic = AskLogic(product_cache, detection_cache)
+        health = Health()
+        health.start()
+        self.feedback_queue = FeedbackQueue()
+        self.feedback_queue.start()
+        # context broadcasts from other processes, to the sockets held here
+        self.bus = create_bus()
+        # shared by every websocket, what belongs to one connection is kept on its handler
+        websocket_logic = WebSocketLogic(
+            product_content=product_cache,
+            client_handlers=client_handlers,
+            user_info_cache=user_info_cache,
+            favorites_cache=favorites_cache,
+            detection_cache=detection_cache,
+            suggestion_pages=suggestion_pages,
+            context_cache=context_cache,
+            feedback_queue=self.feedback_queue,
+            bus=self.bus
+        )
+        self.context_messages = websocket_logic.sender.context_messages
+        self.bus.subscribe(websocket_logic.sender.on_bus_messages)
+        self.bus.start()
+        self.reaper = IdleReaper(client_handlers)
+        self.reaper.start()
 
         handlers = [
             url(
                 r"/websocket",
-                WebSocket, dict(
-                    product_content=product_cache,
-                    client_handlers=client_handlers,
-                    user_info_cache=user_info_cache,
-                    favorites_cache=favorites_cache
-                ),
+                WebSocket, dict(logic=websocket_logic, rate_limiter=RateLimiter()),
                 name="websocket"),
             url(r"/ask", Ask, dict(logic=ask_logic), name="ask"),
-            url(r"/cache", Cache, dict(product_cache=product_cache), name="cache"),
+            url(
+                r"/cache",
+                Cache, dict(
+                    product_cache=product_cache,
+                    detection_cache=detection_cache,
+                    suggestion_pages=suggestion_pages
+                ),
+                name="cache"),
             url(r"/chat", Chat, dict(logic=ask_logic), name="chat"),
-            url(r"/feedback", Feedback, name="feedback"),
+            url(r"/feedback", Feedback, dict(feedback_queue=self.feedback_queue), name="feedback"),
+            url(r"/metrics", Metrics, name="metrics"),
             url(r"/proxy.html", Proxy, name="proxy"),
-            url(r"/status", Status, name="status"),
+            url(r"/status", Status, dict(health=health), name="status"),
             # USER SERVICE
             url(r"/user/facebook", FacebookUserHandler, name="facebook_user"),
             url(r"/user/([0-9a-f]+)/favorite/([0-9a-f]+)", UserFavoriteHandler, name="favorite_user"),
@@ -53,5 +120,7 @@ class Application(tornado.web.Application):
 
         settings = dict(
             debug=tornado.options.options.debug,
+            websocket_ping_interval=WEBSOCKET_PING_INTERVAL,
+            websocket_ping_timeout=WEBSOCKET_PING_TIMEOUT,
         )
         tornado.web.Application.__init__(self, handlers, **settings)
@@ -0,0 +1,220 @@
+"""
+Publish/subscribe of context broadcasts between processes, so a message reaches the sockets of a context held by
+other workers or nodes. Messages published in the same IOLoop iteration go out as one batch, grouped by context,
+each message already encoded once by the sender.
+
+    python -m api.bus
+
+runs a standalone broker for SocketBus on BUS_BROKER.
+"""
+from collections import OrderedDict
+import logging
+import struct
+from uuid import uuid4
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamBufferFullError, StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.tcpserver import TCPServer
+
+from api import codec
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, BUS, BUS_BROKER, BUS_RECONNECT_DELAY, BUS_MAX_FRAME_SIZE, \
+    BUS_BROKER_MAX_BUFFER
+
+HEADER = struct.Struct("!I")
+
+
+def host_port(address: str) -> tuple:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class Bus:
+    """
+    A subscriber is called with a context_id and its messages, each a [body, message_type, suggest_id], for every
+    batch published by another bus
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self):
+        self.node_id = uuid4().hex
+        self.subscribers = []
+        self._pending = OrderedDict()
+        self._flush_scheduled = False
+
+    def start(self):
+        pass
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def peers(self) -> bool:
+        """
+        whether there may be another bus to deliver to, nothing is batched or encoded when there is not
+        """
+        return True
+
+    def publish(self, context_id: str, body: str, message_type: str = None, suggest_id: str = None):
+        if not self.peers():
+            return
+        self._pending.setdefault(context_id, []).append([body, message_type, suggest_id])
+        metrics.incr("bus.published")
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            IOLoop.current().add_callback(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, OrderedDict()
+        self.send(codec.dumps({"origin": self.node_id, "contexts": list(batch.items())}))
+
+    def send(self, payload: str):
+        raise NotImplementedError()
+
+    def deliver(self, payload: str):
+        batch = codec.loads(payload)
+        if batch["origin"] == self.node_id:
+            return
+        metrics.incr("bus.received")
+        for context_id, messages in batch["contexts"]:
+            for callback in self.subscribers:
+                try:
+                    callback(context_id, messages)
+                except:
+                    self.logger.exception("deliver,context_id=%s", context_id)
+
+
+class InMemoryBus(Bus):
+    """
+    Buses sharing a hub see each other's batches, on its own a bus has no one to deliver to
+    """
+    def __init__(self, hub: list = None):
+        super().__init__()
+        self.hub = hub if hub is not None else []
+        self.hub.append(self)
+
+    def peers(self) -> bool:
+        return len(self.hub) > 1
+
+    def send(self, payload: str):
+        for x in self.hub:
+            x.deliver(payload)
+
+
+class SocketBus(Bus):
+    """
+    Connected to a Broker, batches published while disconnected are dropped and the connection retried
+    """
+    def __init__(self, broker: str = BUS_BROKER, reconnect_delay: float = BUS_RECONNECT_DELAY):
+        super().__init__()
+        self.broker = broker
+        self.reconnect_delay = reconnect_delay
+        self.stream = None
+
+    def start(self):
+        self.connect()
+
+    @gen.coroutine
+    def connect(self):
+        try:
+            self.stream = yield TCPClient().connect(*host_port(self.broker))
+        except Exception as e:
+            self.logger.error("connect,broker=%s,error=%s", self.broker, e)
+            IOLoop.current().call_later(self.reconnect_delay, self.connect)
+            return
+        self.logger.info("connected,broker=%s", self.broker)
+        stream = self.stream
+        try:
+            while True:
+                payload = yield read_frame(stream)
+                try:
+                    self.deliver(payload.decode())
+                except:
+                    # a batch that cannot be read must not end the connection
+                    self.logger.exception("deliver,broker=%s", self.broker)
+                    metrics.incr("bus.failed")
+        except StreamClosedError:
+            self.logger.warning("disconnected,broker=%s", self.broker)
+        if self.stream is stream:
+            self.stream = None
+        IOLoop.current().call_later(self.reconnect_delay, self.connect)
+
+    def send(self, payload: str):
+        if self.stream is None or self.stream.closed():
+            metrics.incr("bus.dropped")
+            return
+        self.stream.write(frame(payload)).add_done_callback(lambda res: res.exception())
+
+
+def frame(payload: str) -> bytes:
+    data = payload.encode()
+    return HEADER.pack(len(data)) + data
+
+
+@gen.coroutine
+def read_frame(stream) -> bytes:
+    header = yield stream.read_bytes(HEADER.size)
+    size, = HEADER.unpack(header)
+    if size > BUS_MAX_FRAME_SIZE:
+        stream.close()
+        raise StreamClosedError()
+    payload = yield stream.read_bytes(size)
+    return payload
+
+
+class Broker(TCPServer):
+    """
+    Forwards every frame a bus sends to every other connected bus, without decoding it. A bus that falls more than
+    max_buffer bytes behind is disconnected.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, max_buffer: int = BUS_BROKER_MAX_BUFFER, **kwargs):
+        super().__init__(**kwargs)
+        self.max_buffer = max_buffer
+        self.streams = set()
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        stream.max_write_buffer_size = self.max_buffer
+        self.streams.add(stream)
+        self.logger.info("bus connected,address=%s,buses=%s", address, len(self.streams))
+        try:
+            while True:
+                payload = yield read_frame(stream)
+                data = HEADER.pack(len(payload)) + payload
+                for x in list(self.streams):
+                    if x is not stream:
+                        self.forward(x, data)
+        except StreamClosedError:
+            pass
+        self.streams.discard(stream)
+        self.logger.info("bus disconnected,address=%s,buses=%s", address, len(self.streams))
+
+    def forward(self, stream, data: bytes):
+        try:
+            stream.write(data).add_done_callback(lambda res: res.exception())
+        except StreamBufferFullError:
+            self.logger.warning("slow bus disconnected")
+            metrics.incr("bus.broker.disconnected")
+            self.streams.discard(stream)
+            stream.close()
+        except StreamClosedError:
+            self.streams.discard(stream)
+
+
+def create_bus() -> Bus:
+    return SocketBus() if BUS == "socket" else InMemoryBus()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s:%(levelname)s:%(name)s:%(funcName)s:%(message)s")
+    host, port = host_port(BUS_BROKER)
+    Broker().listen(port, host)
+    IOLoop.current().start()
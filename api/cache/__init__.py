@@ -1,4 +1,6 @@
 from .product_detail import ProductDetail as ProductDetailCache
 from .user_info import UserInfo as UserInfoCache
 from .favorites import Favorites as FavoritesCache
-
+from .detection import Detection as DetectionCache
+from .suggestion_pages import SuggestionPages as SuggestionPagesCache
+from .context import Context as ContextCache
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import logging
+
+from pylru import lrucache
+
+from api.deadline import Deadline
+from api.settings import LOGGING_LEVEL
+
+
+class Coalescing:
+    """
+    LRU cache for values fetched asynchronously, concurrent misses on the same key share a single fetch
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, cache_maxsize, ttl: int = None):
+        self.cache = lrucache(cache_maxsize)
+        self.ttl = timedelta(seconds=ttl) if ttl is not None else None
+        self._waiting = {}
+        self.initialize()
+
+    def initialize(self):
+        pass
+
+    def clear(self):
+        self.cache.clear()
+
+    def remove(self, key):
+        if key in self.cache:
+            del self.cache[key]
+
+    def peek(self, key, now: datetime = None):
+        now = datetime.now() if now is None else now
+        if key in self.cache:
+            data, created = self.cache[key]
+            if self.ttl is None or created > now - self.ttl:
+                return data
+            self.remove(key)
+        return None
+
+    def put(self, key, data, now: datetime = None):
+        self.cache[key] = (data, datetime.now() if now is None else now)
+
+    def get(self, key, fetch, callback, now: datetime = None, deadline: Deadline = None):
+        """
+        fetch is called with a callback taking the fetched value, None means the fetch failed and is not cached
+        :param deadline: the one fetch is made with, when it fails after its deadline is gone the fetch of the next
+        waiter with time left is made instead of failing every waiter
+        """
+        data = self.peek(key, now)
+        if data is not None:
+            callback(data)
+        elif key in self._waiting:
+            self._waiting[key].append((fetch, callback, deadline))
+        else:
+            self._waiting[key] = [(fetch, callback, deadline)]
+            self._fetch(key, fetch)
+
+    def _fetch(self, key, fetch):
+        try:
+            fetch(lambda res: self._fetch_callback(key, res))
+        except Exception:
+            # every waiter is told, as for a fetch that failed
+            self.logger.exception("fetch,key=%s", key)
+            self._fetch_callback(key, None)
+
+    @staticmethod
+    def _expired(deadline: Deadline) -> bool:
+        return deadline is not None and deadline.expired()
+
+    def _fetch_callback(self, key, data):
+        waiting = self._waiting.pop(key, [])
+        if data is not None:
+            self.put(key, data)
+        elif waiting and self._expired(waiting[0][2]):
+            failed = [waiting[0]] + [x for x in waiting[1:] if self._expired(x[2])]
+            live = [x for x in waiting[1:] if not self._expired(x[2])]
+            if live:
+                self._waiting[key] = live
+                self._fetch(key, live[0][0])
+            waiting = failed
+        for fetch, callback, deadline in waiting:
+            callback(data)
@@ -0,0 +1,16 @@
+from api.cache.coalescing import Coalescing
+
+
+class Context(Coalescing):
+    """
+    Context documents by (context_id, _rev), a revision never changes so entries are shared by every handler
+    on the context and must not be modified
+    """
+
+    @staticmethod
+    def key(context_id, rev) -> tuple:
+        return str(context_id), rev
+
+    def put(self, key, data, now=None):
+        # a fetch without _rev gets the latest revision, which is only known from the document
+        super().put((key[0], data["_rev"]), data, now)
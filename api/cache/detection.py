@@ -0,0 +1,7 @@
+from api.cache.coalescing import Coalescing
+
+
+class Detection(Coalescing):
+    @staticmethod
+    def key(locale: str, query: str, endpoint: str = "detect") -> tuple:
+        return endpoint, (locale or "").lower(), " ".join(query.casefold().split())
@@ -1,34 +1,62 @@
 from datetime import datetime, timedelta
 
 from pylru import FunctionCacheManager, lrucache
-from tornado.escape import json_decode
 from tornado.httpclient import HTTPClient
 from tornado.log import app_log
+from api import codec
 from api.cache.base import Base
 
-from api.settings import CONTENT_URL
+from api.upstream import content_upstream
 
 
 class ProductDetail(Base):
+    upstream = content_upstream
+
+    @staticmethod
+    def _path(_id):
+        return "/product_detail/%s.json" % _id
+
+    @staticmethod
+    def _parse(body):
+        data = codec.loads(body)
+        return {
+            "_id": data["_id"],
+            "sequence": data["sequence"] if "sequence" in data else None,
+            "title": data["title"],
+            "attributes": [x for x in data["attributes"] if
+                           "key" not in x["_id"] or x["_id"]["key"] not in ["small sizes", "large sizes"]],
+            "images": data["images"],
+            "brand": data["brand"],
+            "prices": data["prices"],
+            "updated": data["updated"] if "updated" in data else datetime(2015, 1, 1).isoformat()
+        }
+
     def _get_from_service(self, _id):
         try:
-            url = "%s/product_detail/%s.json" % (CONTENT_URL, _id)
+            url = self.upstream.url(self._path(_id))
             http_client = HTTPClient()
             response = http_client.fetch(url)
-            data = json_decode(response.body)
+            data = self._parse(response.body)
             http_client.close()
-            return {
-                "_id": data["_id"],
-                "sequence": data["sequence"] if "sequence" in data else None,
-                "title": data["title"],
-                "attributes": [x for x in data["attributes"] if
-                               "key" not in x["_id"] or x["_id"]["key"] not in ["small sizes", "large sizes"]],
-                "images": data["images"],
-                "brand": data["brand"],
-                "prices": data["prices"],
-                "updated": data["updated"] if "updated" in data else datetime(2015, 1, 1).isoformat()
-            }
+            return data
         except:
             app_log.error("get_from_service,_id=%s", _id)
             return None
             # raise
+
+    def prefetch(self, ids: list):
+        """
+        load the products not already cached without blocking, so a later get is served from memory
+        """
+        for _id in ids:
+            if _id not in self.cache:
+                self.upstream.fetch(self._path(_id), lambda res, _id=_id: self._prefetch_callback(res, _id))
+
+    def _prefetch_callback(self, response, _id):
+        if response.error is not None:
+            app_log.error("prefetch,_id=%s,error=%s", _id, response.error)
+            return
+        try:
+            self.cache[_id] = (self._parse(response.body), datetime.now())
+        except:
+            app_log.error("prefetch,_id=%s", _id)
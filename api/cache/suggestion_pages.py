@@ -0,0 +1,86 @@
+from pylru import lrucache
+
+from api.cache.coalescing import Coalescing
+
+
+class SuggestionPages(Coalescing):
+    """
+    Pages of suggestion items by suggest_id, offset and page_size, value is (suggestion_items_response, next_offset)
+
+    The pages cached for each suggest_id, and the suggest_ids with pages cached for each context, are recorded when a
+    page is put and forgotten when it is removed or evicted, so they never outgrow the cache.
+    """
+    _keys = None
+    _suggest_ids = None
+    _contexts = None
+    _tracked = None
+
+    def initialize(self):
+        self._keys = {}  # suggest_id: keys of its cached pages
+        self._suggest_ids = {}  # context_id: suggest_ids with cached pages
+        self._contexts = {}  # suggest_id: context_id, for the suggest_ids in _keys
+        # suggest_id: context_id, tracked before any page of it is cached
+        self._tracked = lrucache(self.cache.size())
+        self.cache.callback = lambda key, value: self._forget(key)
+
+    @staticmethod
+    def key(suggest_id, offset, page_size) -> tuple:
+        return str(suggest_id), int(offset), int(page_size)
+
+    def track(self, context_id, suggest_id):
+        if str(suggest_id) in self._keys:
+            self._own(str(context_id), str(suggest_id))
+        else:
+            self._tracked[str(suggest_id)] = str(context_id)
+
+    def _own(self, context_id: str, suggest_id: str):
+        if suggest_id not in self._contexts:
+            self._contexts[suggest_id] = context_id
+            self._suggest_ids.setdefault(context_id, set()).add(suggest_id)
+
+    def put(self, key, data, now=None):
+        super().put(key, data, now)
+        suggest_id = key[0]
+        if suggest_id not in self._keys:
+            self._keys[suggest_id] = set()
+            if suggest_id in self._tracked:
+                self._own(self._tracked[suggest_id], suggest_id)
+                del self._tracked[suggest_id]
+        self._keys[suggest_id].add(key)
+
+    def remove(self, key):
+        super().remove(key)
+        self._forget(key)
+
+    def _forget(self, key):
+        suggest_id = key[0]
+        keys = self._keys.get(suggest_id)
+        if keys is None:
+            return
+        keys.discard(key)
+        if keys:
+            return
+        del self._keys[suggest_id]
+        context_id = self._contexts.pop(suggest_id, None)
+        if context_id is not None:
+            suggest_ids = self._suggest_ids[context_id]
+            suggest_ids.discard(suggest_id)
+            if not suggest_ids:
+                del self._suggest_ids[context_id]
+
+    def remove_suggest(self, suggest_id):
+        if str(suggest_id) in self._tracked:
+            del self._tracked[str(suggest_id)]
+        for key in list(self._keys.get(str(suggest_id), [])):
+            self.remove(key)
+
+    def remove_context(self, context_id):
+        for suggest_id in list(self._suggest_ids.get(str(context_id), [])):
+            self.remove_suggest(suggest_id)
+
+    def clear(self):
+        super().clear()
+        self._keys.clear()
+        self._suggest_ids.clear()
+        self._contexts.clear()
+        self._tracked.clear()
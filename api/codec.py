@@ -0,0 +1,72 @@
+"""
+JSON and MongoDB extended JSON encode/decode for the hot paths
+
+orjson is used when it is installed, otherwise the standard library json. ObjectId is converted here, anything
+else in extended JSON ($date, $numberLong, $regex, ...) is handed to bson.json_util, so a $date is tz aware or naive
+as bson.json_util.DEFAULT_JSON_OPTIONS says for the installed pymongo and results match bson.json_util.loads.
+"""
+import calendar
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.json_util import object_hook as bson_object_hook
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _millis(value: datetime) -> int:
+    if value.utcoffset() is not None:
+        value = value - value.utcoffset()
+    return calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, datetime):
+        return {"$date": _millis(value)}
+    # bson.json_util.dumps handles the rarer bson types
+    from bson.json_util import default
+    return default(value)
+
+
+def _object_hook(dct: dict):
+    if len(dct) == 1:
+        if "$oid" in dct:
+            return ObjectId(dct["$oid"])
+    for key in dct:
+        if key[:1] == "$":
+            return bson_object_hook(dct)
+        break
+    return dct
+
+
+if orjson is not None:
+    def loads(body):
+        return orjson.loads(body)
+
+    def dumps(value) -> str:
+        return orjson.dumps(value).decode("utf-8")
+
+    def bson_dumps(value) -> str:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode("utf-8")
+else:
+    def loads(body):
+        return json.loads(body.decode("utf-8") if isinstance(body, bytes) else body)
+
+    def dumps(value) -> str:
+        return json.dumps(value)
+
+    def bson_dumps(value) -> str:
+        return json.dumps(value, default=_default)
+
+
+def bson_loads(body):
+    # object_hook runs inside the C scanner, cheaper than decoding first and walking the result
+    return json.loads(body.decode("utf-8") if isinstance(body, bytes) else body, object_hook=_object_hook)
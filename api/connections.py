@@ -0,0 +1,108 @@
+import logging
+import weakref
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, WEBSOCKET_IDLE_TIMEOUT, WEBSOCKET_REAP_INTERVAL
+
+
+class Connections:
+    """
+    Websocket handlers open in this process by context_id. Handlers are held weakly, a context goes as soon as its
+    last handler does, whether removed on close or collected without one.
+    """
+    def __init__(self):
+        self._contexts = {}
+        self.sockets = 0
+
+    def __contains__(self, context_id: str) -> bool:
+        return context_id in self._contexts
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def add(self, context_id: str, handler) -> bool:
+        """
+        :return: False when the handler was already there
+        """
+        handlers = self._contexts.get(context_id)
+        if handlers is None:
+            handlers = self._contexts[context_id] = {}
+        elif handler.id in handlers and handlers[handler.id]() is handler:
+            return False
+        handler_id = handler.id
+        # the callback must not hold the handler itself
+        handlers[handler_id] = weakref.ref(handler, lambda ref: self._discard(context_id, handler_id, ref))
+        self.sockets += 1
+        metrics.observe("websocket.sockets_per_context", len(handlers))
+        self.gauges()
+        return True
+
+    def remove(self, context_id: str, handler) -> bool:
+        """
+        :return: False when the handler was not there
+        """
+        handlers = self._contexts.get(context_id)
+        if handlers is None or handler.id not in handlers or handlers[handler.id]() is not handler:
+            return False
+        self._discard(context_id, handler.id, handlers[handler.id])
+        return True
+
+    def _discard(self, context_id: str, handler_id, ref):
+        handlers = self._contexts.get(context_id)
+        # the ref may be for a handler already replaced or removed
+        if handlers is None or handlers.get(handler_id) is not ref:
+            return
+        del handlers[handler_id]
+        if not handlers:
+            del self._contexts[context_id]
+        self.sockets -= 1
+        self.gauges()
+
+    def handlers(self, context_id: str) -> list:
+        handlers = self._contexts.get(context_id)
+        if handlers is None:
+            return []
+        return [x for x in (ref() for ref in handlers.values()) if x is not None]
+
+    def all(self) -> list:
+        return [x for handlers in list(self._contexts.values()) for x in (ref() for ref in handlers.values())
+                if x is not None]
+
+    def gauges(self):
+        metrics.gauge("websocket.sockets", self.sockets)
+        metrics.gauge("websocket.contexts", len(self._contexts))
+
+
+class IdleReaper:
+    """
+    Closes the websockets no message has come from for timeout seconds, pings only keep a connection open while
+    the client is there
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, connections: Connections, timeout: float = WEBSOCKET_IDLE_TIMEOUT,
+                 interval: float = WEBSOCKET_REAP_INTERVAL):
+        self.connections = connections
+        self.timeout = timeout
+        self.interval = interval
+        self._periodic_callback = None
+
+    def start(self):
+        if self.timeout > 0:
+            self._periodic_callback = PeriodicCallback(self.reap, self.interval * 1000)
+            self._periodic_callback.start()
+
+    def stop(self):
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+
+    def reap(self, now: float = None):
+        now = IOLoop.current().time() if now is None else now
+        for handler in self.connections.all():
+            if handler.last_message is not None and now - handler.last_message > self.timeout:
+                self.logger.info("reap idle,context_id=%s,handler_id=%s", str(handler.context_id), handler.id)
+                metrics.incr("websocket.reaped.idle")
+                handler.close(1001, "idle")
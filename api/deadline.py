@@ -0,0 +1,37 @@
+import time
+
+from api.settings import MESSAGE_BUDGET
+
+
+class Deadline:
+    """
+    Time budget of one incoming message, every upstream call made for it gets what is left as its timeout and in
+    the header so upstreams can give up too
+    """
+    header = "X-Deadline-Remaining-Ms"
+
+    def __init__(self, budget: float = MESSAGE_BUDGET, now: float = None):
+        self.budget = budget
+        self.expires = (time.monotonic() if now is None else now) + budget
+        # an upstream limiter turned one of the requests away, the message failed for being busy not for an error
+        self.rejected = False
+
+    def remaining(self, now: float = None) -> float:
+        return max(0.0, self.expires - (time.monotonic() if now is None else now))
+
+    def expired(self, now: float = None) -> bool:
+        return self.remaining(now) <= 0
+
+    def request_kwargs(self, kwargs: dict, now: float = None) -> dict:
+        """
+        HTTPRequest keyword arguments limited to the remaining time
+        """
+        remaining = self.remaining(now)
+        headers = dict(kwargs.get("headers") or {})
+        headers[self.header] = str(int(remaining * 1000))
+        return dict(
+            kwargs,
+            connect_timeout=min(kwargs.get("connect_timeout", remaining), remaining),
+            request_timeout=min(kwargs.get("request_timeout", remaining), remaining),
+            headers=headers
+        )
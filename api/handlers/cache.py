@@ -1,35 +1,86 @@
 import logging
 from tornado import gen
-import tornado
-from tornado.httpclient import HTTPClient, HTTPRequest
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 from tornado.web import RequestHandler, asynchronous
-from tornado.escape import json_encode
-from api.settings import DETECT_URL, SUGGEST_URL, CONTEXT_URL, LOGGING_LEVEL
-from api import __version__
+from api.settings import PEER_URLS, CACHE_CLEAR_TIMEOUT, LOGGING_LEVEL
+from api.upstream import detect_upstream, suggest_upstream
+from api.workers import Workers
 
 
 class Cache(RequestHandler):
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def initialize(self, product_cache):
+    def initialize(self, product_cache, detection_cache=None, suggestion_pages=None):
         self.product_cache = product_cache
+        self.detection_cache = detection_cache
+        self.suggestion_pages = suggestion_pages
 
     def on_finish(self):
         pass
 
-    def delete(self, *args, **kwargs):
+    def clear_local(self):
         self.product_cache.clear()
-        client = HTTPClient()
-        url_suggest_clear = "%s/cache" % SUGGEST_URL
-        self.logger.debug("clear suggest_cache,url=%s", url_suggest_clear)
-        suggest_request = HTTPRequest(url_suggest_clear, method="DELETE")
-        client.fetch(suggest_request)
-
-        url_detect_clear = "%s/refresh" % DETECT_URL
-        self.logger.debug("clear detect_cache,url=%s", url_detect_clear)
-        detect_request = HTTPRequest(url_detect_clear, method="GET")
-        client.fetch(detect_request)
-
-        self.logger.debug("clear cache completed")
-        self.finish()
+        if self.detection_cache is not None:
+            self.detection_cache.clear()
+        if self.suggestion_pages is not None:
+            self.suggestion_pages.clear()
+
+    def targets(self) -> list:
+        """
+        every replica of the shared services and every peer, peers are told not to propagate the clear any further
+        """
+        targets = []
+        for url in suggest_upstream.urls:
+            targets.append((
+                "suggest" if len(suggest_upstream.urls) == 1 else "suggest %s" % url,
+                HTTPRequest("%s/cache" % url, method="DELETE", request_timeout=CACHE_CLEAR_TIMEOUT)
+            ))
+        for url in detect_upstream.urls:
+            targets.append((
+                "detect" if len(detect_upstream.urls) == 1 else "detect %s" % url,
+                HTTPRequest("%s/refresh" % url, method="GET", request_timeout=CACHE_CLEAR_TIMEOUT)
+            ))
+        for peer_url in PEER_URLS:
+            targets.append((
+                peer_url,
+                HTTPRequest(
+                    "%s/cache?propagate=0" % peer_url, method="DELETE", request_timeout=CACHE_CLEAR_TIMEOUT
+                )
+            ))
+        return targets
+
+    @asynchronous
+    @gen.engine
+    def delete(self, *args, **kwargs):
+        self.clear_local()
+        # the other workers of this node hold caches of their own
+        Workers.clear_all_caches()
+        targets = self.targets() if self.get_argument("propagate", "1") != "0" else []
+
+        http_client = AsyncHTTPClient()
+        for key, request in targets:
+            self.logger.debug("clear cache,target=%s,url=%s", key, request.url)
+        responses = yield [gen.Task(http_client.fetch, request) for key, request in targets]
+
+        results = [self.target_result(key, response) for (key, request), response in zip(targets, responses)]
+        self.logger.debug("clear cache completed,targets=%s", len(results))
+        self.set_header('Content-Type', 'application/json')
+        self.set_status(200)
+        self.finish({
+            "targets": results,
+            "status": "OK" if not any(x for x in results if x["status"] != "OK") else "NOT_OK"
+        })
+
+    def target_result(self, key, response) -> dict:
+        result = {
+            "key": key,
+            "time": round(response.request_time, 3)
+        }
+        if response.error is None:
+            result["status"] = "OK"
+        else:
+            self.logger.error("clear cache,target=%s,error=%s", key, response.error)
+            result["status"] = "NOT_OK"
+            result["error"] = str(response.error)
+        return result
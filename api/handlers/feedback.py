@@ -1,16 +1,15 @@
-from tornado.escape import url_escape, json_decode, json_encode
-from tornado.httpclient import HTTPRequest, HTTPClient, AsyncHTTPClient
-from api.settings import CONTEXT_URL, ADD_CORS_HEADERS
+from tornado.escape import json_encode
+from api import codec
+from api.settings import ADD_CORS_HEADERS
 
 __author__ = 'robdefeo'
 
-from tornado import gen
-from tornado.web import RequestHandler, asynchronous
+from tornado.web import RequestHandler
 
 
 class Feedback(RequestHandler):
-    def initialize(self):
-        pass
+    def initialize(self, feedback_queue):
+        self.feedback_queue = feedback_queue
 
     def set_default_headers(self):
         if ADD_CORS_HEADERS:
@@ -25,8 +24,6 @@ class Feedback(RequestHandler):
     def options(self, *args, **kwargs):
         self.finish()
 
-    @asynchronous
-    @gen.engine
     def post(self, *args, **kwargs):
         self.set_header('Content-Type', 'application/json')
         user_id = self.get_argument("user_id", None)
@@ -35,7 +32,7 @@ class Feedback(RequestHandler):
         application_id = self.get_argument("application_id", None)
         product_id = self.get_argument("product_id", None)
         _type = self.get_argument("type", None)
-        body = json_decode(self.request.body)
+        body = codec.loads(self.request.body)
 
         if application_id is None:
             self.set_status(412)
@@ -68,43 +65,29 @@ class Feedback(RequestHandler):
                 )
             )
         else:
-            url = "%s/feedback?session_id=%s&application_id=%s&product_id=%s&type=%s" % (
-                CONTEXT_URL,
-                session_id,
-                application_id,
-                product_id,
-                _type
-            )
-
-            if user_id is not None:
-                url += "&user_id=%s" % user_id
-            if context_id is not None:
-                url += "&context_id=%s" % context_id
-            # http_client = HTTPClient()
-            #
-            # response = http_client.fetch(
-            #     HTTPRequest(
-            #         url=url,
-            #         body=json_encode(body),
-            #         method="POST"
-            #     )
-            # )
-            #
-            # http_client.close()
-            # self.set_status(response.status)
-            # self.finish(response.body)
-            http_client = AsyncHTTPClient()
-            http_client.fetch(
-                HTTPRequest(
-                    url=url,
-                    body=json_encode(body),
-                    method="POST"
-                ),
-                self.context_feedback_response_handler
+            queued = self.feedback_queue.put(
+                "/feedback",
+                {
+                    "session_id": session_id,
+                    "application_id": application_id,
+                    "product_id": product_id,
+                    "type": _type,
+                    "user_id": user_id,
+                    "context_id": context_id
+                },
+                body
             )
-            http_client.close()
-
-    def context_feedback_response_handler(self, response):
-        self.set_status(response.code)
-        self.finish(response.body)
-
+            if queued:
+                self.set_status(202)
+                self.finish(json_encode({"status": "queued"}))
+            else:
+                self.set_status(503)
+                self.set_header("Retry-After", "1")
+                self.finish(
+                    json_encode(
+                        {
+                            "status": "error",
+                            "message": "feedback queue full"
+                        }
+                    )
+                )
@@ -0,0 +1,11 @@
+from tornado.web import RequestHandler
+
+from api import codec
+from api.metrics import metrics
+
+
+class Metrics(RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.set_status(200)
+        self.finish(codec.dumps(metrics.snapshot()))
@@ -1,10 +1,10 @@
 from bson import ObjectId
 from tornado.gen import engine
 from tornado.web import RequestHandler, asynchronous, Finish
-from bson.json_util import dumps
 
 from user.data import FavoriteData
 from user import __version__
+from api import codec
 from api.settings import ADD_CORS_HEADERS
 
 
@@ -122,7 +122,7 @@ class Favorite(RequestHandler):
 
         self.set_status(201)
         self.finish(
-            dumps(
+            codec.bson_dumps(
                 {
                     "favorited": favorite_record is not None
                 }
@@ -154,7 +154,7 @@ class Favorites(RequestHandler):
         self.set_status(200)
         self.set_header("Content-Type", "application/json")
         self.finish(
-            dumps(
+            codec.bson_dumps(
                 {
                     "favorites": [
                         x["_id"]["product_id"]
@@ -1,15 +1,51 @@
 from uuid import uuid4
 
-from tornado.websocket import WebSocketHandler
-from tornado.escape import json_decode
+import tornado
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketHandler, WebSocketProtocol13
 
+from api import codec
 from api.handlers.extractors import ParamExtractor, WebSocketCookieExtractor
+from api.metrics import metrics
+from api.outbox import Outbox
+from api.settings import WEBSOCKET_COMPRESSION, WEBSOCKET_COMPRESSION_LEVEL, WEBSOCKET_COMPRESSION_MEM_LEVEL, \
+    WEBSOCKET_COMPRESSION_MIN_SIZE
+
+
+class SmallUncompressedProtocol(WebSocketProtocol13):
+    """
+    tornado compresses every message once deflate is negotiated, messages under min_size are written uncompressed,
+    the client only inflates frames flagged as compressed so its window stays in step
+    """
+    # the constructor and write_message this relies on are tornado 5's, tornado 6 builds its protocol differently
+    supported = tornado.version_info < (6, 0)
+
+    def __init__(self, handler, mask_outgoing=False, compression_options=None,
+                 min_size: int = WEBSOCKET_COMPRESSION_MIN_SIZE):
+        super().__init__(handler, mask_outgoing=mask_outgoing, compression_options=compression_options)
+        self.min_size = min_size
+
+    def write_message(self, message, binary=False):
+        if self._compressor is None or len(message) >= self.min_size:
+            return super().write_message(message, binary)
+        compressor, self._compressor = self._compressor, None
+        try:
+            return super().write_message(message, binary)
+        finally:
+            self._compressor = compressor
 
 
 class WebSocket(WebSocketHandler):
     _param_extractor = None
     _cookie_extractor = None
     _logic = None
+    _rate_limiter = None
+    outbox = None
+    # IOLoop times, for the idle reaper and to tell a close for a missing pong
+    last_message = None
+    last_pong = None
+    # this connection's api.rate_limit.TokenBucket by message type
+    rate_buckets = None
     user_id = None
     id = None
     application_id = None
@@ -23,20 +59,33 @@ class WebSocket(WebSocketHandler):
     offset = None
     page_size = None
 
-    def initialize(self, product_content, client_handlers, user_info_cache, favorites_cache):
-        from api.logic.websocket import WebSocket as WebSocketLogic
-        self._logic = WebSocketLogic(
-            product_content=product_content,
-            client_handlers=client_handlers,
-            user_info_cache=user_info_cache,
-            favorites_cache=favorites_cache
-        )
+    def initialize(self, logic, rate_limiter=None):
+        """
+        :param logic: api.logic.websocket.WebSocket, one for the application
+        :param rate_limiter: api.rate_limit.RateLimiter, one for the application
+        """
+        self._logic = logic
+        self._rate_limiter = rate_limiter
         self._param_extractor = ParamExtractor(self)
         self._cookie_extractor = WebSocketCookieExtractor(self)
 
     def check_origin(self, origin):
         return True
 
+    def get_compression_options(self):
+        if not WEBSOCKET_COMPRESSION:
+            return None
+        return {
+            "compression_level": WEBSOCKET_COMPRESSION_LEVEL,
+            "mem_level": WEBSOCKET_COMPRESSION_MEM_LEVEL
+        }
+
+    def get_websocket_protocol(self):
+        if SmallUncompressedProtocol.supported and \
+                self.request.headers.get("Sec-WebSocket-Version") in ("7", "8", "13"):
+            return SmallUncompressedProtocol(self, compression_options=self.get_compression_options())
+        return super().get_websocket_protocol()
+
     def open(self):
         self.id = uuid4()
         self.user_id = self._cookie_extractor.user_id()
@@ -46,13 +95,56 @@ class WebSocket(WebSocketHandler):
         self.suggest_id = self._param_extractor.suggest_id()
         self.locale = self._param_extractor.locale()
         self.page_size = 20
+        self.outbox = Outbox(self.write_now, self.close)
+        self.last_message = self.last_pong = IOLoop.current().time()
 
         self._logic.open(self)
 
+    def ping_timed_out(self, now: float = None) -> bool:
+        """
+        tornado closes a connection without a code when its pong is overdue
+        """
+        if not self.ping_interval or self.last_pong is None or self.close_code is not None:
+            return False
+        timeout = self.ping_timeout if self.ping_timeout is not None else max(3 * self.ping_interval, 30)
+        return (IOLoop.current().time() if now is None else now) - self.last_pong > timeout
+
+    def write_message(self, message, binary=False, message_type: str = None, suggest_id: str = None):
+        """
+        goes through the outbox once the connection is open, message_type and suggest_id let it coalesce
+        """
+        if self.outbox is None:
+            return super().write_message(message, binary)
+        if isinstance(message, dict):
+            message_type = message.get("type") if message_type is None else message_type
+            suggest_id = message.get("suggest_id") if suggest_id is None else suggest_id
+            message = codec.dumps(message)
+        self.outbox.put(message, binary, message_type, suggest_id)
+
+    def write_now(self, message, binary=False):
+        """
+        what the outbox writes with, straight to the connection
+        """
+        return super().write_message(message, binary)
+
     def on_message(self, message):
-        self._logic.on_message(self, json_decode(message))
+        self.last_message = IOLoop.current().time()
+        message = codec.loads(message)
+        wait = self._rate_limiter.take(self, message.get("type"), self.last_message) \
+            if self._rate_limiter is not None else 0
+        if wait > 0:
+            self._logic.sender.write_rate_limited_message(self, message.get("type"), wait)
+        else:
+            self._logic.on_message(self, message)
         if self.user_id is None:  # maybe they logged in
             self.user_id = self._cookie_extractor.user_id()
 
+    def on_pong(self, data):
+        self.last_pong = IOLoop.current().time()
+
     def on_close(self):
+        if self.ping_timed_out():
+            metrics.incr("websocket.reaped.ping")
+        if self.outbox is not None:
+            self.outbox.discard()
         self._logic.on_close(self)
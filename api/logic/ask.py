@@ -1,24 +1,50 @@
-from tornado.escape import url_escape, json_decode, json_encode
-from tornado.httpclient import HTTPRequest, HTTPClient
+from tornado.escape import url_escape
+from tornado.httpclient import HTTPRequest, HTTPClient, HTTPError
 from tornado.log import app_log
 
+from api import codec
+from api.cache import DetectionCache
 from api.logic.generic import Generic
-from api.settings import DETECT_URL, SUGGEST_URL, CONTEXT_URL
+from api.settings import DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL
+from api.upstream import body_request, detect_upstream, suggest_upstream, context_upstream
 
 
 class Ask(Generic):
-    def __init__(self, content):
+    def __init__(self, content, detection_cache: DetectionCache = None):
         self.content = content
+        self.detection_cache = detection_cache if detection_cache is not None else DetectionCache(
+            DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL
+        )
 
-    @staticmethod
-    def get_wit_detection(user_id, application_id, session_id, locale, query, context):
+    def get_wit_detection(self, user_id, application_id, session_id, locale, query, context):
+        # through the cache so identical queries share one fetch, the fetch blocks so the callback has been called
+        # by the time get returns
+        result = {}
+
+        def fetch(callback):
+            try:
+                result["detection"] = self.fetch_wit_detection(user_id, application_id, session_id, locale, query)
+            except HTTPError as e:
+                result["error"] = e
+            callback(result.get("detection"))
+
+        self.detection_cache.get(
+            self.detection_cache.key(locale, query, "wit"),
+            fetch,
+            lambda detection: result.update(detection=detection)
+        )
+        if "error" in result:
+            raise result["error"]
+        return result["detection"]
+
+    def fetch_wit_detection(self, user_id, application_id, session_id, locale, query):
         url = "%s/wit?application_id=%s&session_id=%s&locale=%s&q=%s" % (
-            DETECT_URL,
+            detect_upstream.url(),
             application_id,
             session_id,
             locale,
             url_escape(query)
-            # url_escape(json_encode(context))
+            # url_escape(codec.dumps(context))
         )
         if user_id is not None:
             url += "&user_id=%s" % user_id
@@ -27,7 +53,7 @@ class Ask(Generic):
             HTTPRequest(url=url)
         )
         http_client.close()
-        return json_decode(response.body)
+        return codec.loads(response.body)
 
     def get_detection_context(self, user_id, application_id, session_id, context_id, locale, query, skip_mongodb_log):
         context = self.get_context(user_id, application_id, session_id, locale, None, context_id, skip_mongodb_log)
@@ -47,7 +73,7 @@ class Ask(Generic):
             if detection_response is not None:
                 request_body["detection_response"] = detection_response
             url = "%s?session_id=%s&application_id=%s&locale=%s" % (
-                CONTEXT_URL, session_id, application_id, locale
+                context_upstream.url(), session_id, application_id, locale
             )
             if user_id is not None:
                 url += "&user_id=%s" % user_id
@@ -57,15 +83,15 @@ class Ask(Generic):
             response = http_client.fetch(
                 HTTPRequest(
                     url=url,
-                    body=json_encode(request_body),
+                    body=codec.dumps(request_body),
                     method="POST"
                 )
             )
             http_client.close()
-            return json_decode(response.body)
+            return codec.loads(response.body)
         else:
             http_client = HTTPClient()
-            url = "%s?context_id=%s&session_id=%s" % (CONTEXT_URL, context_id, session_id)
+            url = "%s?context_id=%s&session_id=%s" % (context_upstream.url(), context_id, session_id)
             if user_id is not None:
                 url += "&user_id=%s" % user_id
 
@@ -76,7 +102,7 @@ class Ask(Generic):
                 )
             )
             http_client.close()
-            return json_decode(context_response.body)
+            return codec.loads(context_response.body)
 
     def do(self, user_id, application_id, session_id, context_id, query, locale, offset, page_size, skip_mongodb_log):
         context, detection_response = self.get_detection_context(
@@ -193,38 +219,52 @@ class Ask(Generic):
         )
 
     def get_suggestion(self, user_id, application_id, session_id, locale, offset, page_size, context, skip_mongodb_log):
-        url = "%s?application_id=%s&session_id=%s&locale=%s&offset=%s&page_size=%s&context=%s" % (
-            SUGGEST_URL,
-            application_id,
-            session_id,
-            locale,
-            offset,
-            page_size,
-            url_escape(json_encode(context))
-        )
+        params = "application_id=%s&session_id=%s&locale=%s" % (application_id, session_id, locale)
         if user_id is not None:
-            url += "&user_id=%s" % user_id
+            params += "&user_id=%s" % user_id
         if skip_mongodb_log:
-            url += "&skip_mongodb_log"
+            params += "&skip_mongodb_log"
 
-        app_log.debug("get_suggestions,url=%s", url)
+        # the context goes in the body, it is far too big for the query string, the page of items comes back in
+        # the response when suggest returns the representation, as detect does, saving the items round trip
+        suggest_url = suggest_upstream.url()
+        page = "&offset=%s&page_size=%s" % (offset, page_size)
+        url = "%s?%s%s" % (suggest_url, params, page)
+        app_log.debug("post_suggest,url=%s", url)
         http_client = HTTPClient()
         suggest_response = http_client.fetch(
-            HTTPRequest(
-                url=url
-            )
+            body_request(url, codec.dumps({"context": context}), headers={"Prefer": "return=representation"})
         )
+        items = self.inline_items(suggest_response)
+        if items is None:
+            url = "%s/%s/items?%s%s" % (suggest_url, suggest_response.headers["_id"], params, page)
+            app_log.debug("get_suggestion_items,url=%s", url)
+            items = codec.bson_loads(http_client.fetch(HTTPRequest(url=url)).body)["items"]
         http_client.close()
-        return json_decode(suggest_response.body)
+        return {
+            "suggestions": [
+                dict(x, _id=str(x["_id"])) for x in items
+            ]
+        }
+
+    @staticmethod
+    def inline_items(response):
+        """
+        :return: the items of the page in the suggest POST response, None when it only has the Location
+        """
+        if not response.body:
+            return None
+        body = codec.bson_loads(response.body)
+        return body["items"] if isinstance(body, dict) and "items" in body else None
 
     def get_detection(self, user_id, application_id, session_id, locale, query, context):
         url = "%s?application_id=%s&session_id=%s&locale=%s&q=%s" % (
-            DETECT_URL,
+            detect_upstream.url(),
             application_id,
             session_id,
             locale,
             url_escape(query)
-            # url_escape(json_encode(context))
+            # url_escape(codec.dumps(context))
         )
         if user_id is not None:
             url += "&user_id=%s" % user_id
@@ -233,4 +273,4 @@ class Ask(Generic):
             HTTPRequest(url=url)
         )
         http_client.close()
-        return json_decode(response.body)
+        return codec.loads(response.body)
@@ -1,74 +1,85 @@
 from datetime import datetime
 import logging
 
-from tornado.escape import json_encode
-
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
 import dateutil.parser
+from api import codec
+from api.cache import ContextCache
+from api.deadline import Deadline
 from api.handlers.websocket import WebSocket as WebSocketHandler
-from api.settings import LOGGING_LEVEL, CONTEXT_URL
+from api.settings import LOGGING_LEVEL, CONTEXT_CACHE_SIZE
+from api.upstream import context_upstream
 
 
 class Context:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def get_context(self, handler: WebSocketHandler, callback):
-        try:
-            if handler.context is None or handler.context["_rev"] != handler.context_rev:
-                self.logger.debug(
-                    "get_context_from_service,context_id=%s,_rev=%s", str(handler.context_id), handler.context_rev)
-                url = "%s/%s" % (CONTEXT_URL, str(handler.context_id))
-                url += "?_rev=%s" % handler.context_rev if handler.context_rev is not None else ""
-                http_client = AsyncHTTPClient()
-                http_client.fetch(HTTPRequest(url=url, method="GET"), callback=callback)
-                http_client.close()
+    def __init__(self, context_cache: ContextCache = None):
+        self.context_cache = context_cache if context_cache is not None else ContextCache(CONTEXT_CACHE_SIZE)
+        self.upstream = context_upstream
 
-        except HTTPError as e:
-            self.logger.error("get_context,url=%s", url)
-            raise
+    def get_context(self, handler: WebSocketHandler, callback, deadline: Deadline = None):
+        """
+        callback receives the context shared with every other handler on it, so it must not be modified,
+        or None when the context service failed
+        """
+        if handler.context is not None and handler.context["_rev"] == handler.context_rev:
+            callback(handler.context)
+        else:
+            self.context_cache.get(
+                self.context_cache.key(handler.context_id, handler.context_rev),
+                lambda res: self.fetch_context(handler.context_id, handler.context_rev, res, deadline),
+                callback,
+                deadline=deadline
+            )
 
-    def get_context_messages(self, handler: WebSocketHandler, callback) -> dict:
-        try:
-            if handler.context is None or handler.context["_rev"] != handler.context_rev:
-                self.logger.debug(
-                    "get_context_from_service,context_id=%s,_rev=%s", str(handler.context_id), handler.context_rev)
-                http_client = AsyncHTTPClient()
-                url = "%s/%s/messages" % (CONTEXT_URL, str(handler.context_id))
-                http_client.fetch(HTTPRequest(url=url, method="GET"), callback=callback)
-                http_client.close()
+    def put_context(self, context_id: str, context: dict):
+        self.context_cache.put(self.context_cache.key(context_id, context["_rev"]), context)
 
-        except HTTPError as e:
-            self.logger.error("get_context,url=%s", url)
-            raise
+    def fetch_context(self, context_id: str, context_rev: str, callback, deadline: Deadline = None):
+        self.logger.debug("get_context_from_service,context_id=%s,_rev=%s", str(context_id), context_rev)
+        path = "/%s" % str(context_id)
+        path += "?_rev=%s" % context_rev if context_rev is not None else ""
+        self.upstream.fetch(
+            path, lambda res: self.fetch_context_callback(res, callback), method="GET", deadline=deadline
+        )
+
+    def fetch_context_callback(self, response, callback):
+        if response.error is not None:
+            self.logger.error("get_context,error=%s", response.error)
+            callback(None)
+        else:
+            callback(codec.loads(response.body))
+
+    def get_context_messages(self, handler: WebSocketHandler, callback) -> dict:
+        if handler.context is None or handler.context["_rev"] != handler.context_rev:
+            self.logger.debug(
+                "get_context_from_service,context_id=%s,_rev=%s", str(handler.context_id), handler.context_rev)
+            self.upstream.fetch("/%s/messages" % str(handler.context_id), callback, method="GET")
 
     def post_context_message(
-            self, context_id: str, direction: int, message_text: str, callback, detection: dict = None, now=None):
+            self, context_id: str, direction: int, message_text: str, callback, detection: dict = None, now=None,
+            return_context: bool = False, deadline: Deadline = None):
         """
         Direction is 1 user 0 jemboo
         :type direction: int
+        :param return_context: response body is the updated context, including its _rev
         """
         self.logger.debug(
             "context_id=%s,direction=%s,message_text=%s,detection=%s",
             context_id, direction, message_text, detection
         )
         now = datetime.now() if now is None else now
-        try:
-            request_body = {
-                "direction": direction,
-                "text": message_text,
-                "created": now.isoformat()
-            }
-            if detection is not None:
-                request_body["detection"] = detection
+        request_body = {
+            "direction": direction,
+            "text": message_text,
+            "created": now.isoformat()
+        }
+        if detection is not None:
+            request_body["detection"] = detection
 
-            url = "%s/%s/messages/" % (CONTEXT_URL, context_id)
-            http_client = AsyncHTTPClient()
-            http_client.fetch(
-                HTTPRequest(url=url, method="POST", body=json_encode(request_body)),
-                callback=callback
-            )
-            http_client.close()
-        except HTTPError as e:
-            self.logger.error("post_context_message,url=%s", url)
-            raise
+        headers = {"Prefer": "return=representation"} if return_context else None
+        self.upstream.fetch(
+            "/%s/messages/" % context_id, callback, body=codec.dumps(request_body), headers=headers,
+            deadline=deadline
+        )
@@ -0,0 +1,135 @@
+from collections import deque
+from datetime import datetime
+import logging
+
+from tornado.ioloop import IOLoop
+
+from api.logic.context import Context
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, CONTEXT_MESSAGE_QUEUE_SIZE, CONTEXT_MESSAGE_MAX_ATTEMPTS, \
+    CONTEXT_MESSAGE_RETRY_DELAY
+
+
+class ContextMessages:
+    """
+    Write behind queue storing messages in their context, the user's and the replies, one post in flight per context
+    so they are stored in the order they were put, a failed post is retried before anything after it
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, context: Context, max_size: int = CONTEXT_MESSAGE_QUEUE_SIZE,
+                 max_attempts: int = CONTEXT_MESSAGE_MAX_ATTEMPTS, retry_delay: float = CONTEXT_MESSAGE_RETRY_DELAY):
+        self.context = context
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queues = {}
+        # contexts waiting out a retry delay, context_id and the timeout
+        self._retries = {}
+        self._stopping = False
+        self._stopped_callbacks = []
+
+    def __len__(self):
+        return sum(len(x) for x in self._queues.values())
+
+    def stop(self, callback):
+        """
+        send everything pending without waiting out retry delays, a failure is no longer retried, callback is called
+        once every message is sent or dropped
+        """
+        self._stopping = True
+        io_loop = IOLoop.current()
+        for key, (context_id, timeout) in list(self._retries.items()):
+            io_loop.remove_timeout(timeout)
+            self.retry(context_id)
+        if self._queues:
+            self._stopped_callbacks.append(callback)
+        else:
+            callback()
+
+    def put(self, context_id, direction: int, message_text: str, detection: dict = None,
+            now: datetime = None, callback=None, return_context: bool = False) -> bool:
+        """
+        :param callback: called with the response once the message is stored, or dropped after its last attempt
+        :param return_context: the response body is the updated context
+        :return: False when the queue of the context is full and the message was dropped
+        """
+        key = str(context_id)
+        queue = self._queues.get(key)
+        if queue is not None and len(queue) >= self.max_size:
+            self.logger.error("context message queue full,context_id=%s", key)
+            metrics.incr("context_messages.dropped")
+            return False
+
+        message = {
+            "direction": direction,
+            "text": message_text,
+            "detection": detection,
+            "created": datetime.now() if now is None else now,
+            "attempts": 0,
+            "callback": callback,
+            "return_context": return_context
+        }
+        if queue is None:
+            self._queues[key] = deque([message])
+            metrics.gauge("context_messages.contexts", len(self._queues))
+            self.send(context_id)
+        else:
+            # the head is in flight, this one goes after it
+            queue.append(message)
+        return True
+
+    def send(self, context_id):
+        message = self._queues[str(context_id)][0]
+        self.context.post_context_message(
+            context_id,
+            message["direction"],
+            message["text"],
+            callback=lambda res: self.send_callback(res, context_id),
+            detection=message["detection"],
+            now=message["created"],
+            return_context=message["return_context"]
+        )
+
+    def send_callback(self, response, context_id):
+        key = str(context_id)
+        queue = self._queues[key]
+        message = queue[0]
+        if response.error is None:
+            queue.popleft()
+            metrics.incr("context_messages.sent")
+        else:
+            message["attempts"] += 1
+            if self._stopping or message["attempts"] >= self.max_attempts:
+                self.logger.error(
+                    "post_context_message dropped,context_id=%s,attempts=%s,error=%s",
+                    key, message["attempts"], response.error
+                )
+                queue.popleft()
+                metrics.incr("context_messages.dropped")
+            else:
+                self.logger.warning(
+                    "post_context_message retry,context_id=%s,attempts=%s,error=%s",
+                    key, message["attempts"], response.error
+                )
+                metrics.incr("context_messages.retried")
+                self._retries[key] = context_id, IOLoop.current().call_later(
+                    self.retry_delay * 2 ** (message["attempts"] - 1), self.retry, context_id
+                )
+                return
+
+        if queue:
+            self.send(context_id)
+        else:
+            del self._queues[key]
+            metrics.gauge("context_messages.contexts", len(self._queues))
+            if not self._queues:
+                while self._stopped_callbacks:
+                    self._stopped_callbacks.pop(0)()
+        if message["callback"] is not None:
+            message["callback"](response)
+
+    def retry(self, context_id):
+        del self._retries[str(context_id)]
+        self.send(context_id)
@@ -1,41 +1,87 @@
 import logging
 
-from tornado.escape import url_escape, json_encode
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+from tornado.escape import url_escape
 
+from api import codec
+from api.cache import DetectionCache
+from api.deadline import Deadline
 from api.handlers.websocket import WebSocket as WebSocketHandler
 from api.logic.responders import DetectResponder
 from api.logic.sender import Sender
-from api.settings import DETECT_URL, LOGGING_LEVEL
+from api.upstream import detect_upstream
+from api.settings import LOGGING_LEVEL, DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL, DETECT_INLINE_RESPONSE
 
 
 class Detect:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, sender: Sender):
+    def __init__(self, sender: Sender, detection_cache: DetectionCache = None):
         self.responder = DetectResponder(sender)
         self.sender = sender
+        self.detection_cache = detection_cache if detection_cache is not None else DetectionCache(
+            DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL
+        )
+        self.inline_response = DETECT_INLINE_RESPONSE
+        self.upstream = detect_upstream
+
+    def get_detection(self, user_id: str, application_id: str, session_id: str, locale: str, query: str, callback,
+                      deadline: Deadline = None):
+        """
+        callback receives the decoded detection, shared with other callers so it must not be modified,
+        or None when the detect service failed
+        """
+        self.detection_cache.get(
+            self.detection_cache.key(locale, query),
+            lambda res: self.fetch_detection(user_id, application_id, session_id, locale, query, res, deadline),
+            callback,
+            deadline=deadline
+        )
+
+    def fetch_detection(self, user_id: str, application_id: str, session_id: str, locale: str, query: str, callback,
+                        deadline: Deadline = None):
+        self.post_detect(
+            user_id, application_id, session_id, locale, query,
+            lambda res: self.post_detect_callback(res, callback, deadline),
+            deadline
+        )
 
-    def get_detect(self, location: str, callback) -> dict:
+    def post_detect_callback(self, response, callback, deadline: Deadline = None):
+        self.logger.debug("post_detect_callback")
+        if response.error is not None:
+            self.logger.error("post_detect,error=%s", response.error)
+            callback(None)
+        elif self.inline_response and response.body:
+            callback(codec.loads(response.body))
+        else:
+            # the replica that made the detection serves it
+            self.get_detect(
+                response.headers["Location"],
+                lambda res: self.get_detect_callback(res, callback),
+                self.upstream.replica(response.effective_url),
+                deadline
+            )
+
+    def get_detect_callback(self, response, callback):
+        self.logger.debug("get_detect_callback")
+        if response.error is not None:
+            self.logger.error("get_detect,error=%s", response.error)
+            callback(None)
+        else:
+            callback(codec.loads(response.body))
+
+    def get_detect(self, location: str, callback, replica=None, deadline: Deadline = None) -> dict:
         self.logger.debug("location=%s", location)
-        url = "%s%s" % (DETECT_URL, location)
-        try:
-            http_client = AsyncHTTPClient()
-            http_client.fetch(HTTPRequest(url=url, method="GET"), callback=callback)
-            http_client.close()
-        except HTTPError as e:
-            self.logger.error("get_detect,url=%s", url)
-            raise
+        self.upstream.fetch(location, callback, method="GET", replica=replica, deadline=deadline)
 
-    def post_detect(self, user_id: str, application_id: str, session_id: str, locale: str, query: str, callback) -> str:
+    def post_detect(self, user_id: str, application_id: str, session_id: str, locale: str, query: str, callback,
+                    deadline: Deadline = None) -> str:
         self.logger.debug(
             "user_id=%s,application_id=%s,session_id=%s,locale=%s,query=%s",
             user_id, application_id, session_id, locale, query
         )
 
-        url = "%s?application_id=%s&session_id=%s&locale=%s&q=%s" % (
-            DETECT_URL,
+        path = "?application_id=%s&session_id=%s&locale=%s&q=%s" % (
             application_id,
             session_id,
             locale,
@@ -43,13 +89,9 @@ class Detect:
             # url_escape(json_encode(context))
         )
         if user_id is not None:
-            url += "&user_id=%s" % user_id
-        http_client = AsyncHTTPClient()
-        http_client.fetch(
-            HTTPRequest(url=url, method="POST", body=json_encode({})),
-            callback=callback
-        )
-        http_client.close()
+            path += "&user_id=%s" % user_id
+        headers = {"Prefer": "return=representation"} if self.inline_response else None
+        self.upstream.fetch(path, callback, body=codec.dumps({}), headers=headers, deadline=deadline)
 
     def unknown_entities(self, outcomes: list) -> list:
         for outcome in outcomes:
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+import itertools
+import logging
+from urllib.parse import urlencode
+
+from tornado.ioloop import PeriodicCallback
+
+from api import codec
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, FEEDBACK_QUEUE_SIZE, FEEDBACK_BATCH_SIZE, \
+    FEEDBACK_FLUSH_INTERVAL, FEEDBACK_BULK, FEEDBACK_MAX_ATTEMPTS
+from api.upstream import context_upstream
+
+
+class FeedbackQueue:
+    """
+    Write behind queue for feedback events to the context service, flushed when full or every flush_interval. With
+    bulk, identical events waiting to be sent are coalesced into one with a count and sent in batches to the bulk
+    endpoint, otherwise each event is sent to its own feedback endpoint, one at a time.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, max_size: int = FEEDBACK_QUEUE_SIZE, batch_size: int = FEEDBACK_BATCH_SIZE,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL, bulk: bool = FEEDBACK_BULK,
+                 max_attempts: int = FEEDBACK_MAX_ATTEMPTS):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bulk = bulk
+        self.max_attempts = max_attempts
+        self._pending = OrderedDict()
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._stopping = False
+        self._stopped_callbacks = []
+        self._periodic_callback = None
+        self.upstream = context_upstream
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        self._periodic_callback = PeriodicCallback(self.flush, self.flush_interval * 1000)
+        self._periodic_callback.start()
+
+    def stop(self, callback):
+        """
+        flush everything pending, callback is called once no batch is in flight
+        """
+        self._stopping = True
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+        self.flush()
+        if self._in_flight == 0:
+            callback()
+        else:
+            self._stopped_callbacks.append(callback)
+
+    @staticmethod
+    def event(path: str, params: dict, body: dict = None, callback=None) -> dict:
+        return {
+            "path": path,
+            "params": {k: str(v) for k, v in params.items() if v is not None},
+            "body": body if body is not None else {},
+            "count": 1,
+            "attempts": 0,
+            "callbacks": [callback] if callback is not None else []
+        }
+
+    def put(self, path: str, params: dict, body: dict = None, callback=None) -> bool:
+        """
+        :param path: context service feedback path the event is for
+        :param callback: called with the response once the request the event went in is done, whether it was sent
+        or, after its last attempt, dropped
+        :return: False when the queue is full and the event was dropped
+        """
+        event = self.event(path, params, body, callback)
+        # identical events are only coalesced into a count for the bulk endpoint, each one is sent otherwise
+        key = (path, urlencode(sorted(event["params"].items())), codec.bson_dumps(event["body"])) if self.bulk \
+            else next(self._sequence)
+        if key in self._pending:
+            self._pending[key]["count"] += 1
+            self._pending[key]["callbacks"].extend(event["callbacks"])
+            metrics.incr("feedback.coalesced")
+            return True
+        if len(self._pending) >= self.max_size:
+            self.logger.warning("feedback queue full,path=%s", path)
+            metrics.incr("feedback.dropped")
+            return False
+
+        self._pending[key] = event
+        metrics.incr("feedback.queued")
+        metrics.gauge("feedback.pending", len(self._pending))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        bulk sends every batch pending, otherwise events go one at a time, the next once the one in flight is done
+        """
+        if self.bulk:
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    batch.append(self._pending.popitem(last=False))
+                self.send(batch)
+        elif self._pending and self._in_flight == 0:
+            self.send([self._pending.popitem(last=False)])
+        metrics.gauge("feedback.pending", len(self._pending))
+
+    def request(self, batch: list) -> tuple:
+        """
+        path and body of the context service request for a batch
+        """
+        if self.bulk:
+            return "/feedback/bulk", codec.bson_dumps({
+                "feedback": [
+                    {
+                        "path": event["path"],
+                        "params": event["params"],
+                        "body": event["body"],
+                        "count": event["count"]
+                    } for key, event in batch
+                ]
+            })
+        else:
+            key, event = batch[0]
+            return "%s?%s" % (event["path"], urlencode(sorted(event["params"].items()))), \
+                codec.bson_dumps(event["body"])
+
+    def send(self, batch: list):
+        self._in_flight += 1
+        path, body = self.request(batch)
+        self.upstream.fetch(path, lambda res: self.send_callback(res, batch), body=body)
+
+    def send_callback(self, response, batch: list):
+        self._in_flight -= 1
+        metrics.observe("feedback.flush", response.request_time)
+        done = []
+        if response.error is None:
+            metrics.incr("feedback.sent", sum(event["count"] for key, event in batch))
+            done = [event for key, event in batch]
+        else:
+            self.logger.error("send feedback,events=%s,error=%s", len(batch), response.error)
+            metrics.incr("feedback.failed")
+            for key, event in batch:
+                event["attempts"] += 1
+                if self._stopping or event["attempts"] >= self.max_attempts:
+                    metrics.incr("feedback.dropped", event["count"])
+                    done.append(event)
+                elif key in self._pending:
+                    self._pending[key]["count"] += event["count"]
+                    self._pending[key]["callbacks"].extend(event["callbacks"])
+                elif len(self._pending) >= self.max_size:
+                    metrics.incr("feedback.dropped", event["count"])
+                    done.append(event)
+                else:
+                    self._pending[key] = event
+        for event in done:
+            for callback in event["callbacks"]:
+                callback(response)
+        # after a failure the next one waits for the periodic flush
+        if not self.bulk and (response.error is None or self._stopping):
+            self.flush()
+        self.stopped()
+
+    def stopped(self):
+        if self._in_flight == 0:
+            while self._stopped_callbacks:
+                self._stopped_callbacks.pop(0)()
@@ -0,0 +1,93 @@
+from datetime import datetime
+import logging
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import PeriodicCallback
+
+from api import codec
+from api.settings import LOGGING_LEVEL, HEALTH_POLL_INTERVAL, HEALTH_CHECK_TIMEOUT
+from api.upstream import detect_upstream, suggest_upstream, context_upstream
+
+
+class Health:
+    """
+    Polls the /status of every dependency in the background, /status answers from the latest results
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, services: dict = None, interval: float = HEALTH_POLL_INTERVAL,
+                 timeout: float = HEALTH_CHECK_TIMEOUT):
+        self.services = services if services is not None else self.replica_services(
+            [detect_upstream, suggest_upstream, context_upstream]
+        )
+        self.interval = interval
+        self.timeout = timeout
+        self.checks = {name: {"key": name, "status": "UNKNOWN", "checked": None} for name in self.services}
+        self._polling = set()
+        self._periodic_callback = None
+
+    @staticmethod
+    def replica_services(upstreams: list) -> dict:
+        """
+        every replica is checked, keyed by the service name alone when there is only one
+        """
+        services = {}
+        for upstream in upstreams:
+            for url in upstream.urls:
+                services[upstream.name if len(upstream.urls) == 1 else "%s %s" % (upstream.name, url)] = url
+        return services
+
+    def start(self):
+        self.poll()
+        self._periodic_callback = PeriodicCallback(self.poll, self.interval * 1000)
+        self._periodic_callback.start()
+
+    def stop(self):
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+
+    def poll(self):
+        http_client = AsyncHTTPClient()
+        for name, url in self.services.items():
+            if name in self._polling:
+                continue
+            self._polling.add(name)
+            http_client.fetch(
+                HTTPRequest(url="%s/status" % url, connect_timeout=self.timeout, request_timeout=self.timeout),
+                callback=lambda res, name=name: self.poll_callback(res, name)
+            )
+
+    def poll_callback(self, response, name: str, now: datetime = None):
+        self._polling.discard(name)
+        check = {
+            "key": name,
+            "checked": datetime.now() if now is None else now,
+            "latency": response.request_time
+        }
+        if response.error is None:
+            check["status"] = codec.loads(response.body)["status"]
+        else:
+            self.logger.error("status,service=%s,error=%s", name, response.error)
+            check["status"] = response.reason if response.code != 599 else "TIMEOUT"
+            check["error"] = str(response.error)
+        self.checks[name] = check
+
+    def services_status(self, now: datetime = None) -> list:
+        now = datetime.now() if now is None else now
+        services = []
+        for check in self.checks.values():
+            service = {
+                "key": check["key"],
+                "status": check["status"]
+            }
+            if check["checked"] is not None:
+                service["age"] = round((now - check["checked"]).total_seconds(), 3)
+                service["latency"] = round(check["latency"], 3) if check["latency"] is not None else None
+                if service["age"] > 3 * self.interval + self.timeout:
+                    # the poller has stopped reporting for this service
+                    service["status"] = "STALE"
+            if "error" in check:
+                service["error"] = check["error"]
+            services.append(service)
+        return services
@@ -1,13 +1,57 @@
-from tornado.escape import json_decode
-from bson.json_util import loads
+from api import codec
+from api.deadline import Deadline
+from api.metrics import metrics
 
 
 class MessageHandler:
+    sender = None
+    suggest = None
+    next_page = None
+    push_first_page = False
+
     @staticmethod
     def json_decode(body):
-        return json_decode(body)
+        return codec.loads(body)
 
     @staticmethod
     def bson_json_decode_and_load(body):
-        return loads(body.decode("utf-8"))
+        return codec.bson_loads(body)
+
+    def expired(self, handler, message: dict, deadline: Deadline) -> bool:
+        """
+        once the message has used up its time the rest of its work is abandoned and the client told
+        """
+        if deadline is None or not deadline.expired():
+            return False
+        metrics.incr("websocket.timeouts")
+        self.sender.write_timeout_message(handler, message["type"] if "type" in message else None)
+        return True
+
+    def unavailable(self, handler, message: dict, deadline: Deadline, busy: bool = False):
+        """
+        the message could not be done, the client is told instead of being left thinking, busy when it was turned
+        away and can be sent again later, an error when an upstream failed
+        :param busy: turned away by a bounded queue rather than an upstream limiter
+        """
+        if self.expired(handler, message, deadline):
+            return
+        message_type = message["type"] if "type" in message else None
+        if busy or (deadline is not None and deadline.rejected):
+            metrics.incr("websocket.busy")
+            self.sender.write_busy_message(handler, message_type)
+        else:
+            metrics.incr("websocket.errors")
+            self.sender.write_error_message(handler, message_type)
 
+    def write_new_suggestion(self, handler, deadline: Deadline = None):
+        self.suggest.write_new_suggestion(handler, items_pushed=self.push_first_page)
+        if self.push_first_page:
+            self.next_page.on_next_page_message(
+                handler,
+                {
+                    "type": "next_page",
+                    "suggest_id": handler.suggest_id,
+                    "offset": 0
+                },
+                deadline
+            )
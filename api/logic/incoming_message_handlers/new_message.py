@@ -1,11 +1,11 @@
 import logging
 
-from tornado.escape import json_decode
-
+from api.deadline import Deadline
 from api.handlers.websocket import WebSocket as WebSocketHandler
 from api.logic import SenderLogic, DetectLogic, ContextLogic, SuggestLogic
 from api.logic.incoming_message_handlers.message_handler import MessageHandler
-from api.settings import LOGGING_LEVEL
+from api.logic.incoming_message_handlers.next_page import NextPage
+from api.settings import LOGGING_LEVEL, CONTEXT_MESSAGE_RETURN_CONTEXT, SUGGEST_PUSH_FIRST_PAGE
 from api.logic.responders import ContextResponder
 
 
@@ -13,71 +13,108 @@ class NewMessage:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, sender: SenderLogic, detect: DetectLogic, context: ContextLogic, suggest: SuggestLogic):
+    def __init__(self, sender: SenderLogic, detect: DetectLogic, context: ContextLogic, suggest: SuggestLogic,
+                 next_page: NextPage = None):
         self.sender = sender
-        self.new_message_text_handler = NewMessageText(self.sender, detect, context, suggest)
-        self.new_message_empty_handler = NewMessageEmpty(self.sender, context, suggest)
+        self.new_message_text_handler = NewMessageText(self.sender, detect, context, suggest, next_page)
+        self.new_message_empty_handler = NewMessageEmpty(self.sender, context, suggest, next_page)
 
-    def on_new_message(self, handler: WebSocketHandler, message: dict, new_conversation: bool = False):
+    def on_new_message(self, handler: WebSocketHandler, message: dict, new_conversation: bool = False,
+                       deadline: Deadline = None):
         self.sender.write_thinking_message(handler, "conversation")
         self.sender.write_thinking_message(handler, "suggestions")
         new_message_text = message["message_text"] if "message_text" in message else ""
         if len(new_message_text.strip()) > 0:
-            self.new_message_text_handler.on_new_message_text(handler, message, new_message_text)
+            self.new_message_text_handler.on_new_message_text(handler, message, new_message_text, deadline)
         else:
-            self.new_message_empty_handler.on_new_message_empty(handler, message)
+            self.new_message_empty_handler.on_new_message_empty(handler, message, deadline)
 
 
 class NewMessageText(MessageHandler):
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, sender: SenderLogic, detect: DetectLogic, context: ContextLogic, suggest: SuggestLogic):
+    def __init__(self, sender: SenderLogic, detect: DetectLogic, context: ContextLogic, suggest: SuggestLogic,
+                 next_page: NextPage = None):
         self.sender = sender
         self.detect = detect
         self.context = context
         self.suggest = suggest
+        self.next_page = next_page
+        self.push_first_page = SUGGEST_PUSH_FIRST_PAGE and next_page is not None
         self.context_responder = ContextResponder(sender)
+        self.return_context = CONTEXT_MESSAGE_RETURN_CONTEXT
 
-    def on_new_message_text(self, handler: WebSocketHandler, message: dict, new_message_text):
-        self.detect.post_detect(
+    def on_new_message_text(self, handler: WebSocketHandler, message: dict, new_message_text,
+                            deadline: Deadline = None):
+        self.detect.get_detection(
             handler.user_id, handler.application_id, handler.session_id, handler.locale, new_message_text,
-            lambda response: self.post_detect_callback(response, handler, message)
-        )
-
-    def post_detect_callback(self, response, handler: WebSocketHandler, message: dict):
-        self.logger.debug("post_detect_callback")
-        self.detect.get_detect(
-            response.headers["Location"],
-            lambda res: self.get_detect_callback(res, handler, message)
+            lambda detection_response: self.get_detection_callback(detection_response, handler, message, deadline),
+            deadline
         )
 
-    def get_detect_callback(self, response, handler_callback: WebSocketHandler, message: dict):
-        self.logger.debug("get_detect_callback")
-        detection_response = self.json_decode(response.body)
-
-        self.context.post_context_message(
+    def get_detection_callback(self, detection_response: dict, handler_callback: WebSocketHandler, message: dict,
+                               deadline: Deadline = None):
+        self.logger.debug("get_detection_callback")
+        if self.expired(handler_callback, message, deadline):
+            return
+        if detection_response is None:
+            self.logger.error("no detection,context_id=%s", str(handler_callback.context_id))
+            self.unavailable(handler_callback, message, deadline)
+            return
+
+        # in the same queue as the replies, so it is stored before the reply to it
+        if not self.sender.context_messages.put(
             handler_callback.context_id,
             1,
             message["message_text"] if "message_text" in message else "",
-            callback=lambda res: self.post_context_message_callback(res, handler_callback, message),
-            detection=detection_response
-        )
+            detection=detection_response,
+            callback=lambda res: self.post_context_message_callback(res, handler_callback, message, deadline),
+            return_context=self.return_context
+        ):
+            self.unavailable(handler_callback, message, deadline, busy=True)
+            return
 
         detection_chat_response = self.detect.respond_to_detection_response(handler_callback, detection_response)
         if detection_chat_response is not None:
             self.sender.write_jemboo_response_message(handler_callback, detection_chat_response)
 
-    def post_context_message_callback(self, response, handler_callback: WebSocketHandler, message: dict):
+    def post_context_message_callback(self, response, handler_callback: WebSocketHandler, message: dict,
+                                      deadline: Deadline = None):
         self.logger.debug("post_context_message_callback")
+        if self.expired(handler_callback, message, deadline):
+            return
+        if response.error is not None:
+            # the body is an error, not the context, what the context service has is fetched instead
+            self.logger.error(
+                "post_context_message,context_id=%s,error=%s", str(handler_callback.context_id), response.error
+            )
+        elif self.return_context and response.body:
+            # the context came back with the message, no need to fetch it
+            context = self.json_decode(response.body)
+            self.context.put_context(handler_callback.context_id, context)
+            self.get_context_callback(context, handler_callback, message, deadline)
+            return
+
+        # the message made a new revision, without the header the latest one is fetched
+        handler_callback.context_rev = response.headers.get("_rev") if response.error is None else None
         self.context.get_context(
             handler_callback,
-            lambda res: self.get_context_callback(res, handler_callback, message)
+            lambda context: self.get_context_callback(context, handler_callback, message, deadline),
+            deadline
         )
 
-    def get_context_callback(self, response, handler: WebSocketHandler, message: dict):
+    def get_context_callback(self, context: dict, handler: WebSocketHandler, message: dict,
+                             deadline: Deadline = None):
         self.logger.debug("get_context_callback")
-        handler.context = self.json_decode(response.body)
+        if self.expired(handler, message, deadline):
+            return
+        if context is None:
+            self.logger.error("no context,context_id=%s", str(handler.context_id))
+            self.unavailable(handler, message, deadline)
+            return
+
+        handler.context = context
         handler.context_rev = handler.context["_rev"]
 
         self.context_responder.unsupported_entities(handler, handler.context)
@@ -88,43 +125,71 @@ class NewMessageText(MessageHandler):
             handler.session_id,
             handler.locale,
             handler.context,
-            callback=lambda res: self.post_suggest_callback(res, handler, message)
+            callback=lambda res: self.post_suggest_callback(res, handler, message, deadline),
+            deadline=deadline
         )
 
-    def post_suggest_callback(self, response, handler: WebSocketHandler, message: dict):
+    def post_suggest_callback(self, response, handler: WebSocketHandler, message: dict, deadline: Deadline = None):
         self.logger.debug("post_suggest_callback")
+        if self.expired(handler, message, deadline):
+            return
+        if response.error is not None:
+            self.logger.error("post_suggest,context_id=%s,error=%s", str(handler.context_id), response.error)
+            self.unavailable(handler, message, deadline)
+            return
+        self.suggest.remove_pages(handler.suggest_id)
         handler.suggest_id = response.headers["_id"]
-        self.suggest.write_new_suggestion(handler)
+        self.write_new_suggestion(handler, deadline)
 
 
 class NewMessageEmpty(MessageHandler):
-    def __init__(self, sender: SenderLogic, context: ContextLogic, suggest: SuggestLogic):
+    def __init__(self, sender: SenderLogic, context: ContextLogic, suggest: SuggestLogic, next_page: NextPage = None):
         self.sender = sender
         self.context = context
         self.suggest = suggest
+        self.next_page = next_page
+        self.push_first_page = SUGGEST_PUSH_FIRST_PAGE and next_page is not None
 
-    def on_new_message_empty(self, handler: WebSocketHandler, message: dict):
+    def on_new_message_empty(self, handler: WebSocketHandler, message: dict, deadline: Deadline = None):
         self.context.get_context(
             handler,
-            callback=lambda res: self.get_context_callback(res, handler, message)
+            callback=lambda context: self.get_context_callback(context, handler, message, deadline),
+            deadline=deadline
         )
 
-    def get_context_callback(self, response, handler: WebSocketHandler, message: dict):
-        handler.context = self.json_decode(response.body)
+    def get_context_callback(self, context: dict, handler: WebSocketHandler, message: dict,
+                             deadline: Deadline = None):
+        if self.expired(handler, message, deadline):
+            return
+        if context is None:
+            self.logger.error("no context,context_id=%s", str(handler.context_id))
+            self.unavailable(handler, message, deadline)
+            return
+
+        handler.context = context
         handler.context_rev = handler.context["_rev"]
         if not any(x for x in handler.context["entities"] if x["source"] == "detection"):
-            handler.suggest_id = self.suggest.post_suggest(
+            # post_suggest_callback replaces handler.suggest_id and drops the pages of the one it replaces
+            self.suggest.post_suggest(
                 handler.user_id,
                 handler.application_id,
                 handler.session_id,
                 handler.locale,
                 handler.context,
-                callback=lambda res: self.post_suggest_callback(res, handler, message)
+                callback=lambda res: self.post_suggest_callback(res, handler, message, deadline),
+                deadline=deadline
             )
         else:
             # TODO No idea what to do here
             pass
 
-    def post_suggest_callback(self, response, handler: WebSocketHandler, message: dict):
+    def post_suggest_callback(self, response, handler: WebSocketHandler, message: dict, deadline: Deadline = None):
+        if self.expired(handler, message, deadline):
+            return
+        if response.error is not None:
+            self.logger.error("post_suggest,context_id=%s,error=%s", str(handler.context_id), response.error)
+            self.unavailable(handler, message, deadline)
+            return
+        self.suggest.remove_pages(handler.suggest_id)
         handler.suggest_id = response.headers["_id"]
-        self.suggest.write_new_suggestion(handler)
+        self.write_new_suggestion(handler, deadline)
@@ -1,28 +1,42 @@
+import logging
+
 from api.handlers.websocket import WebSocket as WebSocketHandler
 from api.logic.incoming_message_handlers.message_handler import MessageHandler
 from api.logic.responders.suggest import SuggestResponder
 from api.logic import SenderLogic
+from api.deadline import Deadline
+from api.settings import LOGGING_LEVEL
 
 
 class NextPage(MessageHandler):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
     def __init__(self, suggestions, sender: SenderLogic):
         self.suggestions = suggestions
+        self.sender = sender
         self.suggest_responder = SuggestResponder(sender)
 
-    def on_next_page_message(self, handler: WebSocketHandler, message: dict):
-        self.suggestions.get_suggestion_items(
-            handler.user_id,
-            handler.application_id,
-            handler.session_id,
-            handler.locale,
+    def on_next_page_message(self, handler: WebSocketHandler, message: dict, deadline: Deadline = None):
+        self.suggestions.get_page(
+            handler,
             message["suggest_id"],
-            handler.page_size,
             message["offset"],
-            callback=lambda res: self.get_suggestion_items_callback(res, handler, message)
+            callback=lambda suggestion_items_response, next_offset: self.get_page_callback(
+                suggestion_items_response, next_offset, handler, message, deadline
+            ),
+            deadline=deadline
         )
 
-    def get_suggestion_items_callback(self, response, handler: WebSocketHandler, message: dict):
-        suggestion_items_response = self.bson_json_decode_and_load(response.body)
-        next_offset = response.headers["next_offset"]
+    def get_page_callback(self, suggestion_items_response: dict, next_offset, handler: WebSocketHandler,
+                          message: dict, deadline: Deadline = None):
+        if self.expired(handler, message, deadline):
+            return
+        if suggestion_items_response is None:
+            self.logger.error("no suggestion items,suggest_id=%s,offset=%s", message["suggest_id"], message["offset"])
+            self.unavailable(handler, message, deadline)
+            return
+
         self.suggest_responder.suggestion_items(handler, message, suggestion_items_response)
         self.suggestions.write_suggestion_items(handler, suggestion_items_response, message["offset"], next_offset)
+        self.suggestions.prefetch_page(handler, message["suggest_id"], message["offset"], next_offset)
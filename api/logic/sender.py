@@ -1,6 +1,9 @@
 import logging
 
+from api import codec
+from api.connections import Connections
 from api.logic.context import Context
+from api.logic.context_messages import ContextMessages
 from api.settings import LOGGING_LEVEL
 from api.handlers.websocket import WebSocket as WebSocketHandler
 
@@ -9,9 +12,15 @@ class Sender:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, client_handlers):
+    def __init__(self, client_handlers: Connections, bus=None, context: Context = None):
+        """
+        :param bus: api.bus.Bus broadcasts are also published to, for the sockets of the context in other processes
+        :param context: shared with the message handlers, so there is one context cache
+        """
         self._client_handlers = client_handlers
-        self.context = Context()
+        self.bus = bus
+        self.context = context if context is not None else Context()
+        self.context_messages = ContextMessages(self.context)
 
     def write_thinking_message(self, handler: WebSocketHandler, thinking_mode: str, meta_data: dict = None):
         message = {
@@ -28,24 +37,76 @@ class Sender:
         message["type"] = "jemboo_chat_response"
         message["direction"] = 0  # jemboo
 
-        # TODO store this message in the context too
-        self.context.post_context_message(
-            handler.context_id,
-            message["direction"],
-            message["display_text"],
-            callback=lambda res: self.post_suggest_callback(res, handler, message)
+        self.write_to_context_handlers(handler, message)
+        self.context_messages.put(handler.context_id, message["direction"], message["display_text"])
+
+    def write_busy_message(self, handler: WebSocketHandler, message_type: str):
+        """
+        only to the handler the message came from, it can be sent again later
+        """
+        self.logger.warning("busy,context_id=%s,type=%s", str(handler.context_id), message_type)
+        handler.write_message(
+            {
+                "type": "busy",
+                "message_type": message_type
+            }
         )
 
-    def post_suggest_callback(self, response, handler: WebSocketHandler, message: dict):
-        self.write_to_context_handlers(handler, message)
+    def write_rate_limited_message(self, handler: WebSocketHandler, message_type: str, retry_after: float):
+        """
+        only to the handler the message came from, retry_after in seconds
+        """
+        self.logger.warning("rate limited,context_id=%s,type=%s", str(handler.context_id), message_type)
+        handler.write_message(
+            {
+                "type": "rate_limited",
+                "message_type": message_type,
+                "retry_after": round(retry_after, 3)
+            }
+        )
+
+    def write_error_message(self, handler: WebSocketHandler, message_type: str):
+        """
+        only to the handler the message came from, an upstream failed doing it
+        """
+        self.logger.warning("error,context_id=%s,type=%s", str(handler.context_id), message_type)
+        handler.write_message(
+            {
+                "type": "error",
+                "message_type": message_type
+            }
+        )
+
+    def write_timeout_message(self, handler: WebSocketHandler, message_type: str):
+        self.logger.warning("timeout,context_id=%s,type=%s", str(handler.context_id), message_type)
+        handler.write_message(
+            {
+                "type": "timeout",
+                "message_type": message_type
+            }
+        )
 
     def write_to_context_handlers(self, handler: WebSocketHandler, message: dict):
-        handlers = self._client_handlers[str(handler.context_id)].values()
+        # encoded once for every handler instead of by each write_message
+        body = codec.dumps(message)
+        self.write_to_handlers(str(handler.context_id), body, message["type"], message.get("suggest_id"))
+        if self.bus is not None:
+            self.bus.publish(str(handler.context_id), body, message["type"], message.get("suggest_id"))
+
+    def write_to_handlers(self, context_id: str, body: str, message_type: str, suggest_id: str = None):
+        handlers = self._client_handlers.handlers(context_id)
         self.logger.info(
             "write message context_id=%s,type=%s,handlers_length=%s",
-            str(handler.context_id), message["type"], len(handlers))
+            context_id, message_type, len(handlers))
         for x in handlers:
             self.logger.info("write message context_id=%s,type=%s,handler_id=%s",
-                             str(handler.context_id), message["type"],
+                             context_id, message_type,
                              x.id)
-            x.write_message(message)
+            x.write_message(body, message_type=message_type, suggest_id=suggest_id)
+
+    def on_bus_messages(self, context_id: str, messages: list):
+        """
+        broadcasts published by other processes, written to the sockets of the context held here
+        """
+        for body, message_type, suggest_id in messages:
+            self.write_to_handlers(context_id, body, message_type, suggest_id)
@@ -1,36 +1,44 @@
 import logging
 
-from bson.json_util import dumps
-
 from bson import ObjectId
 
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
-
-from api.settings import TILE_IMAGE_PATH, SUGGEST_URL, LOGGING_LEVEL
+from api import codec
+from api.settings import TILE_IMAGE_PATH, LOGGING_LEVEL, SUGGESTION_PAGES_CACHE_SIZE, \
+    SUGGESTION_PAGES_CACHE_TTL, SUGGEST_PREFETCH_NEXT_PAGE
 from api.handlers.websocket import WebSocket as WebSocketHandler
-from api.cache import FavoritesCache
+from api.cache import FavoritesCache, SuggestionPagesCache
+from api.deadline import Deadline
 from api.logic.sender import Sender as SenderLogic
+from api.upstream import suggest_upstream
 
 
 class Suggestions:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, product_content, favorites_cache: FavoritesCache, sender: SenderLogic):
+    def __init__(self, product_content, favorites_cache: FavoritesCache, sender: SenderLogic,
+                 suggestion_pages: SuggestionPagesCache = None):
         from prproc.url import create_product_url
         self.create_product_url = create_product_url
         self._product_content = product_content
         self._favorites_cache = favorites_cache
         self._sender = sender
-
-    def write_new_suggestion(self, handler: WebSocketHandler):
-        self._sender.write_to_context_handlers(
-            handler,
-            {
-                "type": "new_suggestion",
-                "suggest_id": str(handler.suggest_id)
-            }
+        self._pages = suggestion_pages if suggestion_pages is not None else SuggestionPagesCache(
+            SUGGESTION_PAGES_CACHE_SIZE, SUGGESTION_PAGES_CACHE_TTL
         )
+        self.prefetch_next_page = SUGGEST_PREFETCH_NEXT_PAGE
+        self.upstream = suggest_upstream
+
+    def write_new_suggestion(self, handler: WebSocketHandler, items_pushed: bool = False):
+        message = {
+            "type": "new_suggestion",
+            "suggest_id": str(handler.suggest_id)
+        }
+        if items_pushed:
+            # first page follows without a next_page from the client
+            message["items_pushed"] = True
+
+        self._sender.write_to_context_handlers(handler, message)
 
     def write_suggestion_items(self, handler: WebSocketHandler, suggestion_items_response: dict, offset: int,
                                next_offset: int):
@@ -46,52 +54,88 @@ class Suggestions:
         )
 
     def get_suggestion_items(self, user_id: str, application_id: str, session_id: str, locale: str, suggestion_id: str,
-                             page_size: int, offset: int, callback):
+                             page_size: int, offset: int, callback, deadline: Deadline = None):
         self.logger.debug(
             "user_id=%s,application_id=%s,session_id=%s,locale=%s,"
             "suggestion_id=%s,page_size=%s,offset=%s",
             user_id, application_id, session_id, locale, suggestion_id, page_size, offset
         )
-        url = "%s/%s/items?session_id=%s&application_id=%s&locale=%s&page_size=%s&offset=%s" % (
-            SUGGEST_URL, suggestion_id, session_id, application_id, locale, page_size, offset
+        path = "/%s/items?session_id=%s&application_id=%s&locale=%s&page_size=%s&offset=%s" % (
+            suggestion_id, session_id, application_id, locale, page_size, offset
+        )
+        path += "&user_id=%s" % user_id if user_id is not None else ""
+
+        self.upstream.fetch(path, callback, method="GET", deadline=deadline)
+
+    def get_page(self, handler: WebSocketHandler, suggest_id: str, offset: int, callback, deadline: Deadline = None):
+        """
+        callback receives the decoded suggestion_items_response and next_offset, both None when the fetch failed
+        """
+        self._pages.track(handler.context_id, suggest_id)
+        self._pages.get(
+            self._pages.key(suggest_id, offset, handler.page_size),
+            lambda res: self.fetch_page(handler, suggest_id, offset, res, deadline),
+            lambda page: callback(*(page if page is not None else (None, None))),
+            deadline=deadline
         )
-        url += "&user_id=%s" % user_id if user_id is not None else ""
 
-        try:
-            http_client = AsyncHTTPClient()
+    def fetch_page(self, handler: WebSocketHandler, suggest_id: str, offset: int, callback, deadline: Deadline = None):
+        self.get_suggestion_items(
+            handler.user_id,
+            handler.application_id,
+            handler.session_id,
+            handler.locale,
+            suggest_id,
+            handler.page_size,
+            offset,
+            callback=lambda res: self.fetch_page_callback(res, callback),
+            deadline=deadline
+        )
+
+    def fetch_page_callback(self, response, callback):
+        if response.error is not None:
+            self.logger.error("get_suggestion_items,error=%s", response.error)
+            callback(None)
+        else:
+            callback((codec.bson_loads(response.body), response.headers["next_offset"]))
+
+    def prefetch_page(self, handler: WebSocketHandler, suggest_id: str, offset: int, next_offset):
+        if not self.prefetch_next_page or next_offset is None or int(next_offset) <= int(offset):
+            return
+
+        self.get_page(
+            handler, suggest_id, next_offset,
+            lambda suggestion_items_response, _: self.prefetch_page_callback(suggestion_items_response)
+        )
+
+    def prefetch_page_callback(self, suggestion_items_response: dict):
+        if suggestion_items_response is not None:
+            self._product_content.prefetch([x["_id"] for x in suggestion_items_response["items"]])
 
-            http_client.fetch(HTTPRequest(url=url, method="GET"), callback=callback)
-            http_client.close()
+    def remove_pages(self, suggest_id: str):
+        if suggest_id is not None:
+            self._pages.remove_suggest(suggest_id)
 
-        except HTTPError:
-            self.logger.error("url=%s", url)
-            raise
+    def remove_context_pages(self, context_id: str):
+        self._pages.remove_context(context_id)
 
     def post_suggest(self, user_id: str, application_id: str, session_id: str, locale: str, context: dict,
-                     callback) -> str:
+                     callback, deadline: Deadline = None) -> str:
         self.logger.debug(
             "user_id=%s,application_id=%s,session_id=%s,locale=%s,"
             "context=%s",
             user_id, application_id, session_id, locale, context
         )
 
-        url = "%s?session_id=%s&application_id=%s&locale=%s" % (
-            SUGGEST_URL, session_id, application_id, locale
+        path = "?session_id=%s&application_id=%s&locale=%s" % (
+            session_id, application_id, locale
         )
-        url += "&user_id=%s" % user_id if user_id is not None else ""
-
-        try:
-            request_body = {
-                "context": context
-            }
-
-            http_client = AsyncHTTPClient()
-            http_client.fetch(HTTPRequest(url=url, body=dumps(request_body), method="POST"), callback=callback)
-            http_client.close()
+        path += "&user_id=%s" % user_id if user_id is not None else ""
 
-        except HTTPError:
-            self.logger.error("url=%s", url)
-            raise
+        request_body = {
+            "context": context
+        }
+        self.upstream.fetch(path, callback, body=codec.bson_dumps(request_body), deadline=deadline)
 
     def fill(self, suggestions, user_id: ObjectId):
         if user_id is None:
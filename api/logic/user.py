@@ -1,8 +1,8 @@
 from json import dumps
 import logging
 from bson import ObjectId
-from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
-from api.settings import LOGGING_LEVEL, CONTEXT_URL, USER_URL
+from api.settings import LOGGING_LEVEL
+from api.upstream import user_upstream
 from api.handlers.websocket import WebSocket as WebSocketHandler
 from api.cache import FavoritesCache
 
@@ -14,6 +14,7 @@ class User:
     def __init__(self, user_info_cache, favorites_cache: FavoritesCache):
         self.user_info = user_info_cache
         self.favorites_cache = favorites_cache
+        self.upstream = user_upstream
 
     def get_profile_picture(self, _id: ObjectId):
         user_info = self.user_info.get(_id)
@@ -31,19 +32,12 @@ class User:
             "user_id=%s,product_id=%s",
             user_id, product_id
         )
-        try:
-            url = "%s/%s/favorite/%s" % (USER_URL, user_id, product_id)
-
-            http_client = AsyncHTTPClient()
-            http_client.fetch(
-                HTTPRequest(url=url, body=dumps({}), method="PUT"),
-                callback=lambda res: put_favorite_callback(res, handler)
-            )
-            http_client.close()
-
-        except HTTPError as e:
-            self.logger.error("put_favorite,url=%s", url)
-            raise
+        self.upstream.fetch(
+            "/%s/favorite/%s" % (user_id, product_id),
+            lambda res: put_favorite_callback(res, handler),
+            body=dumps({}),
+            method="PUT"
+        )
 
     def delete_favorite(self, handler: WebSocketHandler, user_id: ObjectId, product_id: ObjectId):
         def delete_favorite_callback(response, handler):
@@ -54,19 +48,11 @@ class User:
             "user_id=%s,product_id=%s",
             user_id, product_id
         )
-        try:
-            url = "%s/%s/favorite/%s" % (USER_URL, user_id, product_id)
-
-            http_client = AsyncHTTPClient()
-            http_client.fetch(
-                HTTPRequest(url=url, method="DELETE"),
-                callback=lambda res: delete_favorite_callback(res, handler)
-            )
-            http_client.close()
-
-        except HTTPError as e:
-            self.logger.error("delete_favorite,url=%s", url)
-            raise
+        self.upstream.fetch(
+            "/%s/favorite/%s" % (user_id, product_id),
+            lambda res: delete_favorite_callback(res, handler),
+            method="DELETE"
+        )
 
     def get_favorites(self):
         # TODO its own seperate logic i think?????
@@ -1,17 +1,21 @@
 import logging
 
 from bson import ObjectId
-from bson.json_util import dumps, loads
-from tornado.escape import json_encode
 
 from tornado.httpclient import HTTPClient, HTTPRequest, HTTPError
 
-from api.cache import ProductDetailCache
+from api import codec
+from api.cache import ProductDetailCache, DetectionCache, SuggestionPagesCache, ContextCache
 from api.logic import DetectLogic, UserLogic, ContextLogic
 from api.handlers.websocket import WebSocket as WebSocketHandler
+from api.connections import Connections
+from api.logic.feedback import FeedbackQueue
 from api.logic.sender import Sender
 from api.logic.suggestions import Suggestions
-from api.settings import CONTEXT_URL, LOGGING_LEVEL
+from api.settings import LOGGING_LEVEL, MESSAGE_BUDGET
+from api.deadline import Deadline
+from api.metrics import metrics
+from api.upstream import context_upstream, detect_upstream, suggest_upstream
 from api.logic.incoming_message_handlers import NextPageMessageHandler, NewMessageHandler
 
 
@@ -19,18 +23,29 @@ class WebSocket:
     logger = logging.getLogger(__name__)
     logger.setLevel(LOGGING_LEVEL)
 
-    def __init__(self, product_content: ProductDetailCache, client_handlers, user_info_cache, favorites_cache):
-        self.sender = Sender(client_handlers)
-        self.context = ContextLogic()
-        self.detect = DetectLogic(self.sender)
+    def __init__(self, product_content: ProductDetailCache, client_handlers: Connections, user_info_cache, favorites_cache,
+                 detection_cache: DetectionCache = None, suggestion_pages: SuggestionPagesCache = None,
+                 context_cache: ContextCache = None, feedback_queue: FeedbackQueue = None, bus=None):
+        self.feedback_queue = feedback_queue if feedback_queue is not None else FeedbackQueue()
+        self.context = ContextLogic(context_cache)
+        self.sender = Sender(client_handlers, bus, self.context)
+        self.detect = DetectLogic(self.sender, detection_cache)
         self.suggestions = Suggestions(product_content=product_content, sender=self.sender,
-                                       favorites_cache=favorites_cache)
+                                       favorites_cache=favorites_cache, suggestion_pages=suggestion_pages)
         self.user = UserLogic(user_info_cache=user_info_cache, favorites_cache=favorites_cache)
 
         self.next_page_message_handler = NextPageMessageHandler(self.suggestions, self.sender)
-        self.new_message_handler = NewMessageHandler(self.sender, self.detect, self.context, self.suggestions)
+        self.new_message_handler = NewMessageHandler(
+            self.sender, self.detect, self.context, self.suggestions, self.next_page_message_handler
+        )
 
         self._client_handlers = client_handlers
+        # upstreams a message type starts work on, it is turned away while any of them is busy
+        self.message_upstreams = {
+            "home_page_message": [detect_upstream, suggest_upstream],
+            "new_message": [detect_upstream, suggest_upstream],
+            "next_page": [suggest_upstream]
+        }
 
     def open(self, handler: WebSocketHandler):
         self.logger.debug(
@@ -46,12 +61,8 @@ class WebSocket:
         else:
             new_context = False
 
-        if str(handler.context_id) not in self._client_handlers:
-            self._client_handlers[str(handler.context_id)] = {}
-
-        if handler.id not in self._client_handlers[str(handler.context_id)]:
+        if self._client_handlers.add(str(handler.context_id), handler):
             self.logger.debug("add handler, context_id=%s,handler_id=%s", str(handler.context_id), handler.id)
-            self._client_handlers[str(handler.context_id)][handler.id] = handler
 
         self.sender.write_to_context_handlers(
             handler,
@@ -62,24 +73,17 @@ class WebSocket:
         )
 
         if new_context:
-            def post_context_callback(response, handler):
-                self.logger.debug("post_context_message")
-
-            self.context.post_context_message(
-                handler.context_id,
-                0,
-                "Hi, how can I help you?",
-                callback=lambda res: post_context_callback(res, handler)
-            )
+            self.sender.context_messages.put(handler.context_id, 0, "Hi, how can I help you?")
 
     def on_close(self, handler: WebSocketHandler):
-        handler_id_in_client_handlers = str(handler.context_id) in self._client_handlers
-        if handler_id_in_client_handlers and handler.id in self._client_handlers[str(handler.context_id)]:
+        context_id = str(handler.context_id)
+        if self._client_handlers.remove(context_id, handler):
             self.logger.debug(
                 "remove_handler,close_code=%s,context_id=%s,context_rev=%s,handler_id=%s",
-                handler.close_code, str(handler.context_id), str(handler.context_rev), handler.id
+                handler.close_code, context_id, str(handler.context_rev), handler.id
             )
-            self._client_handlers[str(handler.context_id)].pop(handler.id, None)
+            if context_id not in self._client_handlers:
+                self.suggestions.remove_context_pages(handler.context_id)
 
     def write_jemboo_response_message(self, handler: WebSocketHandler, message: dict):
         message["type"] = "jemboo_chat_response"
@@ -111,7 +115,7 @@ class WebSocket:
                 {
                     "direction": x["direction"],
                     "display_text": x["text"]
-                } for x in loads(response.body.decode("utf-8"))["messages"]
+                } for x in codec.bson_loads(response.body)["messages"]
                 ]
             if profile_picture_url is not None:
                 for x in messages:
@@ -133,28 +137,42 @@ class WebSocket:
         self.user.put_favorite(handler, ObjectId(message["user_id"]), ObjectId(message["product_id"]))
 
     def on_view_product_details_message(self, handler: WebSocketHandler, message: dict):
-        handler.context_rev = self.post_context_feedback(
+        self.post_context_feedback(
             handler.context_id,
             handler.user_id,
             handler.application_id,
             handler.session_id,
             message["product_id"],
             message["feedback_type"],
-            message["meta_data"] if "meta_data" in message else None
+            message["meta_data"] if "meta_data" in message else None,
+            lambda res: self.post_context_feedback_callback(handler, res)
         )
 
+    def post_context_feedback_callback(self, handler: WebSocketHandler, response):
+        # the feedback moves the context on once it is flushed, reads are then pinned to the revision that has it,
+        # the latest one when the response does not say
+        if response.error is None:
+            handler.context_rev = response.headers.get("_rev")
+
     def on_message(self, handler: WebSocketHandler, message: dict):
         if "type" not in message:
             raise Exception("missing message type,message=%s", message)
 
         self.logger.debug("message_type=%s,message=%s", message["type"], message)
 
-        if message["type"] == "home_page_message":
-            self.new_message_handler.on_new_message(handler, message, new_conversation=True)
+        if any(x.busy() for x in self.message_upstreams.get(message["type"], [])):
+            metrics.incr("websocket.busy")
+            self.sender.write_busy_message(handler, message["type"])
+        elif message["type"] == "home_page_message":
+            self.new_message_handler.on_new_message(
+                handler, message, new_conversation=True, deadline=self.deadline()
+            )
         elif message["type"] == "new_message":
-            self.new_message_handler.on_new_message(handler, message, new_conversation=False)
+            self.new_message_handler.on_new_message(
+                handler, message, new_conversation=False, deadline=self.deadline()
+            )
         elif message["type"] == "next_page":
-            self.next_page_message_handler.on_next_page_message(handler, message)
+            self.next_page_message_handler.on_next_page_message(handler, message, self.deadline())
         elif message["type"] == "view_product_details":
             self.on_view_product_details_message(handler, message)
         elif message["type"] == "load_conversation_messages":
@@ -167,6 +185,10 @@ class WebSocket:
             raise Exception("unknown message_type, type=%s,message=%s", message["type"], message)
         pass
 
+    @staticmethod
+    def deadline() -> Deadline:
+        return Deadline(MESSAGE_BUDGET) if MESSAGE_BUDGET > 0 else None
+
     def post_context(self, user_id: str, application_id: str, session_id: str, locale: str) -> dict:
         self.logger.debug(
             "user_id=%s,application_id=%s,session_id=%s,locale=%s",
@@ -177,14 +199,14 @@ class WebSocket:
             #     # this now goes at message level
             #     # if detection_response is not None:
             #     #     request_body["detection_response"] = detection_response
-            url = "%s?session_id=%s&application_id=%s&locale=%s" % (
-                CONTEXT_URL, session_id, application_id, locale
-            )
+            url = context_upstream.url("?session_id=%s&application_id=%s&locale=%s" % (
+                session_id, application_id, locale
+            ))
 
             url += "&user_id=%s" % user_id if user_id is not None else ""
 
             http_client = HTTPClient()
-            response = http_client.fetch(HTTPRequest(url=url, body=json_encode(request_body), method="POST"))
+            response = http_client.fetch(HTTPRequest(url=url, body=codec.dumps(request_body), method="POST"))
             http_client.close()
 
             return response.headers["_id"], response.headers["_rev"]
@@ -192,31 +214,29 @@ class WebSocket:
             raise
 
     def post_context_feedback(self, context_id: str, user_id: str, application_id: str, session_id: str,
-                              product_id: str, _type: str, meta_data: dict = None):
+                              product_id: str, _type: str, meta_data: dict = None, callback=None) -> bool:
         self.logger.debug(
             "context_id=%s,user_id=%s,application_id=%s,session_id=%s,product_id=%s,"
             "_type=%s,meta_data=%s",
             context_id, user_id, application_id, session_id, product_id, _type, meta_data
         )
-        try:
-            url = "%s/%s/feedback/?application_id=%s&session_id=%s&product_id=%s&type=%s" % (
-                CONTEXT_URL, context_id, application_id, session_id, product_id, _type
-            )
-            url += "&user_id=%s" if user_id is not None else ""
-
-            request_body = {
-            }
-            if meta_data is not None:
-                request_body["meta_data"] = meta_data
-
-            http_client = HTTPClient()
-            response = http_client.fetch(HTTPRequest(url=url, body=dumps(request_body), method="POST"))
-            http_client.close()
-            return response.headers["_rev"]
-        except HTTPError:
-            self.logger.error("post_context_feedback,url=%s", url)
-            raise
+        request_body = {
+        }
+        if meta_data is not None:
+            request_body["meta_data"] = meta_data
 
+        return self.feedback_queue.put(
+            "/%s/feedback/" % context_id,
+            {
+                "application_id": application_id,
+                "session_id": session_id,
+                "product_id": product_id,
+                "type": _type,
+                "user_id": user_id
+            },
+            request_body,
+            callback
+        )
 
             # def post_suggest(self, user_id: str, application_id: str, session_id: str, locale: str, context: dict,
             #                  callback) -> str:
@@ -238,7 +258,7 @@ class WebSocket:
             #         url += "&user_id=%s" % user_id if user_id is not None else ""
             #
             #         http_client = AsyncHTTPClient()
-            #         http_client.fetch(HTTPRequest(url=url, body=dumps(request_body), method="POST"), callback=callback)
+            #         http_client.fetch(HTTPRequest(url=url, body=codec.bson_dumps(request_body), method="POST"), callback=callback)
             #         http_client.close()
             #
             #     except HTTPError as e:
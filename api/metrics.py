@@ -0,0 +1,42 @@
+"""
+In process counters, gauges and observations, served as a snapshot from /metrics
+"""
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.observations = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        if name not in self.observations:
+            self.observations[name] = {"count": 0, "sum": 0.0, "max": value}
+        observation = self.observations[name]
+        observation["count"] += 1
+        observation["sum"] += value
+        observation["max"] = max(observation["max"], value)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "observations": {
+                name: dict(x, mean=x["sum"] / x["count"]) for name, x in self.observations.items()
+            }
+        }
+
+    def clear(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.observations.clear()
+
+
+metrics = Metrics()
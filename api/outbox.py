@@ -0,0 +1,124 @@
+from collections import deque
+import logging
+
+from tornado.websocket import WebSocketClosedError
+
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, WEBSOCKET_OUTBOX_MAX_BYTES
+
+
+class Outbox:
+    """
+    Outbound queue of one websocket. A message is written straight away while nothing earlier is still waiting to
+    be flushed, otherwise it is queued until the connection drains. Queued messages a newer one supersedes are
+    dropped: repeated start_thinking and suggestion_items of an older suggest_id. When the unflushed and queued
+    bytes pass max_bytes the queued suggestion_items are dropped, and if that is not enough the connection is
+    closed.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    total_bytes = 0
+
+    def __init__(self, write, close, max_bytes: int = WEBSOCKET_OUTBOX_MAX_BYTES):
+        """
+        :param write: writes a message to the connection, returns a future resolved once it is flushed
+        :param close: closes the connection with a code and reason
+        """
+        self.write = write
+        self.close = close
+        self.max_bytes = max_bytes
+        self.unflushed_bytes = 0
+        self.queued_bytes = 0
+        self.closed = False
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, message, binary: bool = False, message_type: str = None, suggest_id: str = None):
+        if self.closed:
+            return
+        entry = {
+            "message": message,
+            "binary": binary,
+            "type": message_type,
+            "suggest_id": suggest_id,
+            "size": len(message)
+        }
+        if self.unflushed_bytes == 0 and not self._queue:
+            self.send(entry)
+            return
+
+        if self.coalesce(entry):
+            return
+        self._queue.append(entry)
+        self.queued(entry["size"])
+        metrics.observe("websocket.outbox.depth", len(self._queue))
+        if self.unflushed_bytes + self.queued_bytes > self.max_bytes:
+            self.slow_consumer()
+
+    def coalesce(self, entry: dict) -> bool:
+        """
+        :return: True when the entry itself is superseded by one already queued
+        """
+        if entry["type"] == "start_thinking" and any(
+                x["type"] == "start_thinking" and x["message"] == entry["message"] for x in self._queue):
+            metrics.incr("websocket.outbox.coalesced")
+            return True
+        if entry["type"] in ("new_suggestion", "suggestion_items") and entry["suggest_id"] is not None:
+            self.remove(
+                lambda x: x["type"] == "suggestion_items" and x["suggest_id"] != entry["suggest_id"],
+                "websocket.outbox.coalesced"
+            )
+        return False
+
+    def remove(self, superseded, metric: str):
+        kept = deque()
+        for x in self._queue:
+            if superseded(x):
+                self.queued(-x["size"])
+                metrics.incr(metric)
+            else:
+                kept.append(x)
+        self._queue = kept
+
+    def slow_consumer(self):
+        self.remove(lambda x: x["type"] == "suggestion_items", "websocket.outbox.dropped")
+        if self.unflushed_bytes + self.queued_bytes > self.max_bytes:
+            self.logger.warning(
+                "slow consumer,unflushed_bytes=%s,queued_bytes=%s", self.unflushed_bytes, self.queued_bytes
+            )
+            metrics.incr("websocket.outbox.closed")
+            self.discard()
+            self.close(1013, "slow consumer")
+
+    def send(self, entry: dict):
+        try:
+            future = self.write(entry["message"], entry["binary"])
+        except WebSocketClosedError:
+            self.discard()
+            return
+        self.unflushed_bytes += entry["size"]
+        future.add_done_callback(lambda res: self.flushed(entry["size"]))
+
+    def flushed(self, size: int):
+        self.unflushed_bytes -= size
+        if self.unflushed_bytes == 0 and not self.closed:
+            queue, self._queue = self._queue, deque()
+            self.queued(-self.queued_bytes)
+            for x in queue:
+                self.send(x)
+
+    def queued(self, size: int):
+        self.queued_bytes += size
+        Outbox.total_bytes += size
+        metrics.gauge("websocket.outbox.queued_bytes", Outbox.total_bytes)
+
+    def discard(self):
+        """
+        the connection is gone, nothing more is written
+        """
+        self.closed = True
+        self._queue.clear()
+        self.queued(-self.queued_bytes)
@@ -0,0 +1,80 @@
+from pylru import lrucache
+from tornado.ioloop import IOLoop
+
+from api.metrics import metrics
+from api.settings import WEBSOCKET_RATE_LIMITS, WEBSOCKET_SESSION_RATE_LIMITS, WEBSOCKET_RATE_LIMIT_SESSIONS
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self) -> float:
+        """
+        :return: seconds until a token is there, 0 when there is one now
+        """
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets per message type, one set per connection kept on its handler and one per session_id shared by
+    the connections of the session. A message is let through only when both have a token, and only then are the
+    tokens taken.
+    """
+    def __init__(self, limits: dict = WEBSOCKET_RATE_LIMITS, session_limits: dict = WEBSOCKET_SESSION_RATE_LIMITS,
+                 max_sessions: int = WEBSOCKET_RATE_LIMIT_SESSIONS):
+        """
+        :param limits: message_type: (rate, burst) per connection
+        :param session_limits: message_type: (rate, burst) per session_id
+        """
+        self.limits = limits
+        self.session_limits = session_limits
+        self.sessions = lrucache(max_sessions)
+
+    @staticmethod
+    def bucket(buckets: dict, message_type: str, limit: tuple, now: float) -> TokenBucket:
+        if message_type not in buckets:
+            buckets[message_type] = TokenBucket(limit[0], limit[1], now)
+        bucket = buckets[message_type]
+        bucket.refill(now)
+        return bucket
+
+    def take(self, handler, message_type: str, now: float = None) -> float:
+        """
+        :return: 0 when the message may go on, otherwise the seconds to wait before sending it again
+        """
+        limit = self.limits.get(message_type)
+        session_limit = self.session_limits.get(message_type) if handler.session_id is not None else None
+        if limit is None and session_limit is None:
+            return 0.0
+        now = IOLoop.current().time() if now is None else now
+
+        buckets = []
+        if limit is not None:
+            if handler.rate_buckets is None:
+                handler.rate_buckets = {}
+            buckets.append(self.bucket(handler.rate_buckets, message_type, limit, now))
+        if session_limit is not None:
+            key = str(handler.session_id)
+            if key not in self.sessions:
+                self.sessions[key] = {}
+            buckets.append(self.bucket(self.sessions[key], message_type, session_limit, now))
+
+        wait = max(x.wait() for x in buckets)
+        if wait > 0:
+            metrics.incr("websocket.rate_limited")
+            metrics.incr("websocket.rate_limited.%s" % message_type)
+            return wait
+        for x in buckets:
+            x.tokens -= 1
+        return 0.0
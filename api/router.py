@@ -0,0 +1,214 @@
+"""
+Routes connections to workers by context, so the sockets of a context, its client_handlers entry and its cached
+context and suggestion pages stay in one process. The request head is read for the context_id, or the session_id
+cookie when there is no context yet, so the context made on the connection is in the worker of the session. The
+X-Forwarded-For and X-Real-Ip the client sent are replaced by its address, the workers trust them. Every connection
+carries one request: the worker is told to close it after the response, unless it is a websocket upgrade, whose frames
+are passed through untouched, so the next request comes on a new connection and has its head read here too.
+
+The router does not terminate TLS, it belongs in front of it, and copies every byte it passes. Several routers can
+share the port, each in a process of its own, they all send a context to the same worker.
+"""
+import hashlib
+import itertools
+import logging
+from urllib.parse import parse_qs, urlsplit
+
+from tornado import gen
+from tornado.httputil import HTTPHeaders, parse_cookie
+from tornado.iostream import StreamClosedError, UnsatisfiableReadError
+from tornado.tcpclient import TCPClient
+from tornado.tcpserver import TCPServer
+
+from api.metrics import metrics
+from api.settings import LOGGING_LEVEL, ROUTER_CONNECT_TIMEOUT
+
+
+class HashRing:
+    """
+    Rendezvous (highest random weight) hashing: a key goes to the node scoring highest for it, adding or removing a
+    node only moves the keys that node wins or won
+    """
+    def __init__(self, nodes: list = None):
+        self.nodes = list(nodes) if nodes is not None else []
+
+    def add(self, node):
+        if node not in self.nodes:
+            self.nodes.append(node)
+
+    def remove(self, node):
+        if node in self.nodes:
+            self.nodes.remove(node)
+
+    @staticmethod
+    def score(node, key: str) -> int:
+        return int.from_bytes(hashlib.md5(("%s %s" % (node, key)).encode()).digest()[:8], "big")
+
+    def ranked(self, key: str) -> list:
+        """
+        every node, the one the key belongs to first and the ones to fall back to after it
+        """
+        return sorted(self.nodes, key=lambda x: self.score(x, key), reverse=True)
+
+    def node(self, key: str):
+        return max(self.nodes, key=lambda x: self.score(x, key)) if self.nodes else None
+
+
+def context_id(request_line: bytes) -> str:
+    """
+    :return: the context_id query parameter of an HTTP request line, None when there is none
+    """
+    try:
+        target = request_line.decode("latin1").split(" ")[1]
+    except IndexError:
+        return None
+    values = parse_qs(urlsplit(target).query).get("context_id")
+    return values[0] if values else None
+
+
+def headers(head: bytes) -> HTTPHeaders:
+    """
+    :return: the headers of an HTTP request head, empty when they cannot be parsed
+    """
+    try:
+        return HTTPHeaders.parse(head.decode("latin1").partition("\r\n")[2])
+    except Exception:
+        return HTTPHeaders()
+
+
+def session_id(head: bytes) -> str:
+    """
+    :return: the session_id cookie of an HTTP request head, None when there is none
+    """
+    return parse_cookie(headers(head).get("Cookie", "")).get("session_id") or None
+
+
+def upgrade(head: bytes) -> bool:
+    """
+    :return: the HTTP request head asks for the connection to be upgraded, to a websocket
+    """
+    return bool(headers(head).get("Upgrade"))
+
+
+def forwarded(head: bytes, address: str) -> bytes:
+    """
+    :return: the head with address as its X-Forwarded-For and X-Real-Ip, whatever the client sent as them dropped, and
+    Connection: close unless it is an upgrade
+    """
+    upgrading = upgrade(head)
+    dropped = {b"x-forwarded-for", b"x-real-ip"} if upgrading else {b"x-forwarded-for", b"x-real-ip", b"connection"}
+    lines = head[:-4].split(b"\r\n")
+    lines = lines[:1] + [x for x in lines[1:] if x.partition(b":")[0].strip().lower() not in dropped]
+    lines.append(b"X-Forwarded-For: " + address.encode())
+    lines.append(b"X-Real-Ip: " + address.encode())
+    if not upgrading:
+        lines.append(b"Connection: close")
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def status(head: bytes) -> int:
+    """
+    :return: the status code of an HTTP response head, None when it cannot be parsed
+    """
+    try:
+        return int(head.split(b" ", 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class Router(TCPServer):
+    """
+    Connections with a context_id go to the worker of the context, whichever device they come from. Without one the
+    session_id cookie picks the worker, the context made on the connection is in that worker too. Either way it is the
+    next one in the ranking while that worker cannot be reached. Connections with neither go round the workers in turn.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    max_head = 65536
+
+    def __init__(self, workers: list, connect_timeout: float = ROUTER_CONNECT_TIMEOUT, **kwargs):
+        """
+        :param workers: "host:port" of every worker
+        """
+        super().__init__(**kwargs)
+        self.ring = HashRing(workers)
+        self.connect_timeout = connect_timeout
+        self._next = itertools.cycle(workers)
+        self._workers = list(workers)
+
+    def candidates(self, head: bytes) -> list:
+        key = context_id(head.split(b"\r\n", 1)[0])
+        if key is not None:
+            metrics.incr("router.context")
+            return self.ring.ranked(key)
+        key = session_id(head)
+        if key is not None:
+            metrics.incr("router.session")
+            return self.ring.ranked(key)
+        first = next(self._next)
+        return [first] + [x for x in self._workers if x != first]
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        try:
+            head = yield stream.read_until(b"\r\n\r\n", max_bytes=self.max_head)
+        except (StreamClosedError, UnsatisfiableReadError):
+            stream.close()
+            return
+        upstream = yield self.connect(self.candidates(head))
+        if upstream is None:
+            metrics.incr("router.unavailable")
+            stream.close()
+            return
+        yield upstream.write(forwarded(head, address[0] if isinstance(address, tuple) else str(address)))
+        if upgrade(head):
+            upgraded = yield self.upgraded(stream, upstream)
+            if not upgraded:
+                stream.close()
+                upstream.close()
+                return
+        yield [self.pipe(stream, upstream), self.pipe(upstream, stream)]
+
+    @gen.coroutine
+    def upgraded(self, stream, upstream):
+        """
+        passes on the response to an upgrade, when the worker refuses it the connection is not used for anything else
+        :return: the connection was upgraded
+        """
+        try:
+            head = yield upstream.read_until(b"\r\n\r\n", max_bytes=self.max_head)
+            yield stream.write(head)
+            if status(head) == 101:
+                return True
+            length = int(headers(head).get("Content-Length", 0))
+            if length > 0:
+                body = yield upstream.read_bytes(length)
+                yield stream.write(body)
+        except (StreamClosedError, UnsatisfiableReadError, ValueError):
+            pass
+        metrics.incr("router.upgrade_refused")
+        return False
+
+    @gen.coroutine
+    def connect(self, workers: list):
+        for worker in workers:
+            host, port = worker.rsplit(":", 1)
+            try:
+                upstream = yield TCPClient().connect(host, int(port), timeout=self.connect_timeout)
+                return upstream
+            except Exception as e:
+                self.logger.warning("connect,worker=%s,error=%s", worker, e)
+                metrics.incr("router.connect_failed")
+        return None
+
+    @gen.coroutine
+    def pipe(self, source, destination):
+        try:
+            while True:
+                data = yield source.read_bytes(65536, partial=True)
+                yield destination.write(data)
+        except StreamClosedError:
+            pass
+        source.close()
+        destination.close()
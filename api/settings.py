@@ -10,20 +10,145 @@ def get_env_setting(env_variable_name, default):
         return default
 
 
+def get_env_urls(env_variable_name, default) -> list:
+    """
+    comma separated base urls of the replicas of a service
+    """
+    return [x.strip().rstrip("/") for x in get_env_setting(env_variable_name, default).split(",") if x.strip()]
+
+
+def get_env_rates(env_variable_name, default) -> dict:
+    """
+    comma separated message_type:rate:burst, rate in messages per second
+    """
+    rates = {}
+    for x in get_env_setting(env_variable_name, default).split(","):
+        if x.strip():
+            message_type, rate, burst = x.strip().split(":")
+            rates[message_type] = (float(rate), float(burst))
+    return rates
+
+
 PORT = int(get_env_setting("API_PORT", 9999))
+# processes serving PORT, 0 one per cpu, more than 1 forks them from a parent that supervises them
+WORKERS = int(get_env_setting("API_WORKERS", 1))
+# with several workers, a router on PORT sends each connection to a worker by its context, worker N listening on
+# 127.0.0.1:ROUTER_WORKER_PORT+N, without it the workers share PORT and the kernel spreads the connections
+# the router does not terminate tls, it goes in front of the router
+ROUTER = bool(int(get_env_setting("API_ROUTER", 0)))
+# router processes sharing PORT, each one is a single core
+ROUTER_PROCESSES = int(get_env_setting("API_ROUTER_PROCESSES", 1))
+ROUTER_WORKER_PORT = int(get_env_setting("API_ROUTER_WORKER_PORT", 10000))
+ROUTER_CONNECT_TIMEOUT = float(get_env_setting("API_ROUTER_CONNECT_TIMEOUT", 1))  # seconds
+# file of product ids, one per line, loaded into the product cache before the workers are forked
+WARM_PRODUCT_IDS = get_env_setting("API_WARM_PRODUCT_IDS", "")
 
 ADD_DEV_SSL = bool(int(get_env_setting("ADD_DEV_SSL", 0)))
 
 ADD_CORS_HEADERS = bool(int(get_env_setting("ADD_CORS_HEADERS", 0)))
 
-DETECT_URL = get_env_setting("API_DETECT_URL", "http://0.0.0.0:18999")
-SUGGEST_URL = get_env_setting("API_SUGGEST_URL", "http://0.0.0.0:14999")
-CONTEXT_URL = get_env_setting("API_CONTEXT_URL", "http://0.0.0.0:17999")
-USER_URL = get_env_setting("API_USER_URL", "http://0.0.0.0:9999/user")
-CONTENT_URL = get_env_setting("API_CONTENT_URL", "http://content.jemboo.com")
+# each service is a comma separated list of replicas, the *_URL settings are the first of them
+DETECT_URLS = get_env_urls("API_DETECT_URL", "http://0.0.0.0:18999")
+SUGGEST_URLS = get_env_urls("API_SUGGEST_URL", "http://0.0.0.0:14999")
+CONTEXT_URLS = get_env_urls("API_CONTEXT_URL", "http://0.0.0.0:17999")
+USER_URLS = get_env_urls("API_USER_URL", "http://0.0.0.0:9999/user")
+CONTENT_URLS = get_env_urls("API_CONTENT_URL", "http://content.jemboo.com")
+DETECT_URL = DETECT_URLS[0]
+SUGGEST_URL = SUGGEST_URLS[0]
+CONTEXT_URL = CONTEXT_URLS[0]
+USER_URL = USER_URLS[0]
+CONTENT_URL = CONTENT_URLS[0]
+# other api nodes, comma separated, DELETE /cache is forwarded to them
+PEER_URLS = get_env_urls("API_PEER_URLS", "")
+
+# consecutive failures (connection errors, timeouts and 5xx) before a replica is taken out of rotation
+UPSTREAM_EJECT_FAILURES = int(get_env_setting("API_UPSTREAM_EJECT_FAILURES", 5))
+UPSTREAM_EJECT_TIME = float(get_env_setting("API_UPSTREAM_EJECT_TIME", 30))  # seconds
+# adaptive (AIMD) limit on requests in flight to detect and suggest, work past it waits in a bounded queue
+UPSTREAM_LIMIT = bool(int(get_env_setting("API_UPSTREAM_LIMIT", 1)))
+UPSTREAM_LIMIT_INITIAL = int(get_env_setting("API_UPSTREAM_LIMIT_INITIAL", 20))
+UPSTREAM_LIMIT_MIN = int(get_env_setting("API_UPSTREAM_LIMIT_MIN", 2))
+UPSTREAM_LIMIT_MAX = int(get_env_setting("API_UPSTREAM_LIMIT_MAX", 200))
+# responses slower than this shrink the limit like failures do
+UPSTREAM_LIMIT_LATENCY = float(get_env_setting("API_UPSTREAM_LIMIT_LATENCY", 1))  # seconds
+UPSTREAM_QUEUE_SIZE = int(get_env_setting("API_UPSTREAM_QUEUE_SIZE", 100))
+UPSTREAM_QUEUE_TIMEOUT = float(get_env_setting("API_UPSTREAM_QUEUE_TIMEOUT", 2))  # seconds
+# time budget for the upstream work of one websocket message, 0 unbounded
+MESSAGE_BUDGET = float(get_env_setting("API_MESSAGE_BUDGET", 8))  # seconds
+# context broadcasts to the sockets of other processes, "memory" keeps them in process, "socket" goes through the
+# broker at BUS_BROKER (python -m api.bus, or started by run.py next to its workers with BUS_BROKER_START)
+BUS = get_env_setting("API_BUS", "memory")
+BUS_BROKER = get_env_setting("API_BUS_BROKER", "127.0.0.1:9998")
+BUS_BROKER_START = bool(int(get_env_setting("API_BUS_BROKER_START", 0)))
+BUS_RECONNECT_DELAY = float(get_env_setting("API_BUS_RECONNECT_DELAY", 1))  # seconds
+BUS_MAX_FRAME_SIZE = int(get_env_setting("API_BUS_MAX_FRAME_SIZE", 16777216))  # bytes
+# a bus the broker holds this many unsent bytes for is disconnected
+BUS_BROKER_MAX_BUFFER = int(get_env_setting("API_BUS_BROKER_MAX_BUFFER", 67108864))  # bytes
+# keepalive pings, a connection with no pong for WEBSOCKET_PING_TIMEOUT is closed
+WEBSOCKET_PING_INTERVAL = float(get_env_setting("API_WEBSOCKET_PING_INTERVAL", 25))  # seconds, 0 no pings
+WEBSOCKET_PING_TIMEOUT = float(get_env_setting("API_WEBSOCKET_PING_TIMEOUT", 60))  # seconds
+# a connection no message has come from for this long is closed, 0 never
+WEBSOCKET_IDLE_TIMEOUT = float(get_env_setting("API_WEBSOCKET_IDLE_TIMEOUT", 1800))  # seconds
+WEBSOCKET_REAP_INTERVAL = float(get_env_setting("API_WEBSOCKET_REAP_INTERVAL", 60))  # seconds
+# token buckets on the websocket message types that start upstream work, per connection and per session_id
+WEBSOCKET_RATE_LIMITS = get_env_rates(
+    "API_WEBSOCKET_RATE_LIMITS", "home_page_message:0.5:5,new_message:0.5:5,next_page:2:10"
+)
+WEBSOCKET_SESSION_RATE_LIMITS = get_env_rates(
+    "API_WEBSOCKET_SESSION_RATE_LIMITS", "home_page_message:1:10,new_message:1:10,next_page:4:20"
+)
+WEBSOCKET_RATE_LIMIT_SESSIONS = int(get_env_setting("API_WEBSOCKET_RATE_LIMIT_SESSIONS", 10000))  # most recent kept
+# bytes written to a websocket but not yet flushed plus queued behind them, past it the client is too slow
+WEBSOCKET_OUTBOX_MAX_BYTES = int(get_env_setting("API_WEBSOCKET_OUTBOX_MAX_BYTES", 1048576))
+# permessage-deflate on /websocket, level 3 and mem_level 4 get suggestion_items to ~4.5% of its size for a
+# third of the cpu of level 6 and a sixteenth of its deflate memory per connection (python -m benchmarks.compression)
+WEBSOCKET_COMPRESSION = bool(int(get_env_setting("API_WEBSOCKET_COMPRESSION", 1)))
+WEBSOCKET_COMPRESSION_LEVEL = int(get_env_setting("API_WEBSOCKET_COMPRESSION_LEVEL", 3))
+WEBSOCKET_COMPRESSION_MEM_LEVEL = int(get_env_setting("API_WEBSOCKET_COMPRESSION_MEM_LEVEL", 4))
+# smaller messages are sent uncompressed
+WEBSOCKET_COMPRESSION_MIN_SIZE = int(get_env_setting("API_WEBSOCKET_COMPRESSION_MIN_SIZE", 256))  # bytes
+# gzip upstream request bodies of at least this many bytes, 0 never
+UPSTREAM_GZIP_MIN_SIZE = int(get_env_setting("API_UPSTREAM_GZIP_MIN_SIZE", 0))
 
 CONTENT_CACHE_SIZE = int(get_env_setting("API_CONTENT_CACHE_SIZE", 4096))
 
+DETECTION_CACHE_SIZE = int(get_env_setting("API_DETECTION_CACHE_SIZE", 4096))
+DETECTION_CACHE_TTL = int(get_env_setting("API_DETECTION_CACHE_TTL", 3600))  # seconds
+# ask detect to return the detection in the POST response instead of only its Location
+DETECT_INLINE_RESPONSE = bool(int(get_env_setting("API_DETECT_INLINE_RESPONSE", 0)))
+# ask context to return the updated context when a user message is posted instead of fetching it again
+CONTEXT_MESSAGE_RETURN_CONTEXT = bool(int(get_env_setting("API_CONTEXT_MESSAGE_RETURN_CONTEXT", 0)))
+# send the first page of items straight after new_suggestion instead of waiting for the client to ask
+SUGGEST_PUSH_FIRST_PAGE = bool(int(get_env_setting("API_SUGGEST_PUSH_FIRST_PAGE", 0)))
+
+CONTEXT_CACHE_SIZE = int(get_env_setting("API_CONTEXT_CACHE_SIZE", 2048))
+
+SUGGESTION_PAGES_CACHE_SIZE = int(get_env_setting("API_SUGGESTION_PAGES_CACHE_SIZE", 2048))
+SUGGESTION_PAGES_CACHE_TTL = int(get_env_setting("API_SUGGESTION_PAGES_CACHE_TTL", 900))  # seconds
+# fetch page N+1 and its products in the background after serving page N
+SUGGEST_PREFETCH_NEXT_PAGE = bool(int(get_env_setting("API_SUGGEST_PREFETCH_NEXT_PAGE", 1)))
+
+HEALTH_POLL_INTERVAL = float(get_env_setting("API_HEALTH_POLL_INTERVAL", 5))  # seconds
+HEALTH_CHECK_TIMEOUT = float(get_env_setting("API_HEALTH_CHECK_TIMEOUT", 2))  # seconds
+
+CACHE_CLEAR_TIMEOUT = float(get_env_setting("API_CACHE_CLEAR_TIMEOUT", 10))  # seconds
+
+# distinct feedback events held for the context service, new events are refused past this
+FEEDBACK_QUEUE_SIZE = int(get_env_setting("API_FEEDBACK_QUEUE_SIZE", 10000))
+FEEDBACK_BATCH_SIZE = int(get_env_setting("API_FEEDBACK_BATCH_SIZE", 100))
+FEEDBACK_FLUSH_INTERVAL = float(get_env_setting("API_FEEDBACK_FLUSH_INTERVAL", 1))  # seconds
+# post batches to the context service bulk endpoint, 0 posts each event to its own feedback endpoint
+# off until the context service has /feedback/bulk
+FEEDBACK_BULK = bool(int(get_env_setting("API_FEEDBACK_BULK", 0)))
+FEEDBACK_MAX_ATTEMPTS = int(get_env_setting("API_FEEDBACK_MAX_ATTEMPTS", 3))
+# replies are written to clients straight away and stored in the context behind them, in order per context
+CONTEXT_MESSAGE_QUEUE_SIZE = int(get_env_setting("API_CONTEXT_MESSAGE_QUEUE_SIZE", 100))  # per context
+CONTEXT_MESSAGE_MAX_ATTEMPTS = int(get_env_setting("API_CONTEXT_MESSAGE_MAX_ATTEMPTS", 5))
+CONTEXT_MESSAGE_RETRY_DELAY = float(get_env_setting("API_CONTEXT_MESSAGE_RETRY_DELAY", 0.5))  # seconds, doubled per retry
+SHUTDOWN_TIMEOUT = float(get_env_setting("API_SHUTDOWN_TIMEOUT", 10))  # seconds
+# how often a stopping server looks for websockets still open
+SHUTDOWN_DRAIN_INTERVAL = float(get_env_setting("API_SHUTDOWN_DRAIN_INTERVAL", 0.1))  # seconds
+
 TILE_IMAGE_PATH = get_env_setting("API_TILE_IMAGE_PATH", "https://d2xtl1bsv2jbx1.cloudfront.net/")
 
 LOGGING_LEVEL = logging.DEBUG
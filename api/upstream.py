@@ -0,0 +1,259 @@
+from collections import deque
+from datetime import datetime, timedelta
+import gzip
+import logging
+import random
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse, HTTPError
+from tornado.ioloop import IOLoop
+
+from api.deadline import Deadline
+from api.metrics import metrics
+from api.settings import UPSTREAM_GZIP_MIN_SIZE, UPSTREAM_EJECT_FAILURES, UPSTREAM_EJECT_TIME, LOGGING_LEVEL, \
+    DETECT_URLS, SUGGEST_URLS, CONTEXT_URLS, USER_URLS, CONTENT_URLS, UPSTREAM_LIMIT, UPSTREAM_LIMIT_INITIAL, \
+    UPSTREAM_LIMIT_MIN, UPSTREAM_LIMIT_MAX, UPSTREAM_LIMIT_LATENCY, UPSTREAM_QUEUE_SIZE, UPSTREAM_QUEUE_TIMEOUT
+
+
+def body_request(url: str, body, method: str = "POST", headers: dict = None, **kwargs) -> HTTPRequest:
+    """
+    request with a body, gzipped when it is at least UPSTREAM_GZIP_MIN_SIZE bytes
+    """
+    body = body.encode("utf-8") if isinstance(body, str) else body
+    headers = dict(headers) if headers is not None else {}
+    headers["Content-Type"] = "application/json"
+    if 0 < UPSTREAM_GZIP_MIN_SIZE <= len(body):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+
+    return HTTPRequest(url=url, method=method, body=body, headers=headers, **kwargs)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = None
+
+    def available(self, now: datetime) -> bool:
+        return self.ejected_until is None or self.ejected_until <= now
+
+
+class Limiter:
+    """
+    Adaptive limit on requests in flight, additive increase while it is being used and successful, multiplicative
+    decrease on failures and slow responses. Requests past the limit wait in a bounded queue for at most
+    queue_timeout.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    backoff = 0.9
+
+    def __init__(self, name: str, initial: int = UPSTREAM_LIMIT_INITIAL, minimum: int = UPSTREAM_LIMIT_MIN,
+                 maximum: int = UPSTREAM_LIMIT_MAX, latency: float = UPSTREAM_LIMIT_LATENCY,
+                 queue_size: int = UPSTREAM_QUEUE_SIZE, queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency = latency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._queue = deque()
+
+    def full(self) -> bool:
+        """
+        nothing more can start or wait
+        """
+        return self.in_flight >= int(self.limit) and len(self._queue) >= self.queue_size
+
+    def acquire(self, start, reject, timeout: float = None) -> bool:
+        """
+        start is called once there is room, reject when the queue is full or the wait times out
+        :param timeout: shorter wait than queue_timeout
+        """
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.gauges()
+            start()
+            return True
+        if len(self._queue) >= self.queue_size:
+            metrics.incr("upstream.%s.rejected" % self.name)
+            reject()
+            return False
+
+        io_loop = IOLoop.current()
+        waiting = {"start": start, "reject": reject, "queued": io_loop.time()}
+        waiting["timeout"] = io_loop.call_later(
+            min(self.queue_timeout, timeout) if timeout is not None else self.queue_timeout, self.expire, waiting
+        )
+        self._queue.append(waiting)
+        self.gauges()
+        return True
+
+    def expire(self, waiting: dict):
+        self._queue.remove(waiting)
+        self.logger.warning("queue timeout,upstream=%s", self.name)
+        metrics.incr("upstream.%s.queue_timeouts" % self.name)
+        self.gauges()
+        waiting["reject"]()
+
+    def release(self, latency: float, ok: bool):
+        saturated = self.in_flight >= self.limit / 2
+        self.in_flight -= 1
+        if not ok or latency > self.latency:
+            self.limit = max(float(self.minimum), self.limit * self.backoff)
+        elif saturated:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        self.start_waiting()
+
+    def cancel(self):
+        """
+        give back a slot that was not used or whose request says nothing about the upstream, the limit is left as it is
+        """
+        self.in_flight -= 1
+        self.start_waiting()
+
+    def start_waiting(self):
+        io_loop = IOLoop.current()
+        while self._queue and self.in_flight < int(self.limit):
+            waiting = self._queue.popleft()
+            io_loop.remove_timeout(waiting["timeout"])
+            metrics.observe("upstream.%s.queue_wait" % self.name, io_loop.time() - waiting["queued"])
+            self.in_flight += 1
+            waiting["start"]()
+        self.gauges()
+
+    def gauges(self):
+        metrics.gauge("upstream.%s.limit" % self.name, int(self.limit))
+        metrics.gauge("upstream.%s.in_flight" % self.name, self.in_flight)
+        metrics.gauge("upstream.%s.queue_depth" % self.name, len(self._queue))
+
+
+class Upstream:
+    """
+    Replicas of one service, each request goes to the replica with the fewest requests outstanding. A replica
+    failing eject_failures times in a row is left out for eject_time, unless every replica is out.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    def __init__(self, name: str, urls: list, eject_failures: int = UPSTREAM_EJECT_FAILURES,
+                 eject_time: float = UPSTREAM_EJECT_TIME, limiter: Limiter = None):
+        self.name = name
+        self.replicas = [Replica(x) for x in urls]
+        self.eject_failures = eject_failures
+        self.eject_time = timedelta(seconds=eject_time)
+        self.limiter = limiter
+
+    def busy(self) -> bool:
+        return self.limiter is not None and self.limiter.full()
+
+    @property
+    def urls(self) -> list:
+        return [x.url for x in self.replicas]
+
+    def choose(self, now: datetime = None) -> Replica:
+        now = datetime.now() if now is None else now
+        replicas = [x for x in self.replicas if x.available(now)] or self.replicas
+        least = min(x.outstanding for x in replicas)
+        return random.choice([x for x in replicas if x.outstanding == least])
+
+    def replica(self, url: str) -> Replica:
+        """
+        the replica a url was served by, so a follow up request can go back to it
+        """
+        for x in self.replicas:
+            if url.startswith(x.url):
+                return x
+        return None
+
+    def url(self, path: str = "") -> str:
+        """
+        url on a replica, for blocking calls, which are not counted as outstanding
+        """
+        return self.choose().url + path
+
+    def fetch(self, path: str, callback, body=None, replica: Replica = None, deadline: Deadline = None, **kwargs):
+        """
+        :param path: appended to the base url of the replica, including the query string
+        :param body: sent with body_request when not None
+        :param replica: send to this replica rather than choosing one
+        :param deadline: the request gets the time left as its timeouts, nothing is sent once it is gone, it is
+        marked rejected when the limiter turns the request away
+        callback receives a 599 response with no request sent when the limiter turns it away or the deadline is gone
+        """
+        def send():
+            if deadline is not None and deadline.expired():
+                if self.limiter is not None:
+                    self.limiter.cancel()
+                callback(self.error_response(path, "deadline exceeded"))
+                return
+
+            chosen = replica if replica is not None else self.choose()
+            url = chosen.url + path
+            request_kwargs = deadline.request_kwargs(kwargs) if deadline is not None else kwargs
+            if body is not None:
+                request = body_request(url, body, **request_kwargs)
+            else:
+                request = HTTPRequest(url=url, **request_kwargs)
+
+            chosen.outstanding += 1
+            http_client = AsyncHTTPClient()
+            http_client.fetch(
+                request, callback=lambda res: self.fetch_callback(res, chosen, callback, deadline=deadline)
+            )
+            http_client.close()
+
+        def reject():
+            if deadline is not None:
+                deadline.rejected = True
+            callback(self.error_response(path, "%s busy" % self.name))
+
+        if deadline is not None and deadline.expired():
+            callback(self.error_response(path, "deadline exceeded"))
+        elif self.limiter is None:
+            send()
+        else:
+            self.limiter.acquire(send, reject, deadline.remaining() if deadline is not None else None)
+
+    def error_response(self, path: str, message: str) -> HTTPResponse:
+        return HTTPResponse(HTTPRequest(url=self.replicas[0].url + path), 599, error=HTTPError(599, message))
+
+    def fetch_callback(self, response, replica: Replica, callback, now: datetime = None, deadline: Deadline = None):
+        replica.outstanding -= 1
+        if response.code == 599 and deadline is not None and deadline.expired():
+            # timed out on the time the message had left, not held against the replica or the limit
+            metrics.incr("upstream.%s.deadline_timeouts" % self.name)
+            if self.limiter is not None:
+                self.limiter.cancel()
+            callback(response)
+            return
+        failed = response.code == 599 or response.code >= 500
+        if failed:
+            self.failure(replica, now)
+        else:
+            replica.failures = 0
+        if self.limiter is not None:
+            self.limiter.release(response.request_time, not failed)
+        callback(response)
+
+    def failure(self, replica: Replica, now: datetime = None):
+        replica.failures += 1
+        if replica.failures >= self.eject_failures:
+            now = datetime.now() if now is None else now
+            self.logger.error(
+                "eject replica,upstream=%s,url=%s,failures=%s", self.name, replica.url, replica.failures
+            )
+            metrics.incr("upstream.%s.ejected" % self.name)
+            replica.ejected_until = now + self.eject_time
+            replica.failures = 0
+
+
+detect_upstream = Upstream("detect", DETECT_URLS, limiter=Limiter("detect") if UPSTREAM_LIMIT else None)
+suggest_upstream = Upstream("suggest", SUGGEST_URLS, limiter=Limiter("suggest") if UPSTREAM_LIMIT else None)
+context_upstream = Upstream("context", CONTEXT_URLS)
+user_upstream = Upstream("user", USER_URLS)
+content_upstream = Upstream("content", CONTENT_URLS)
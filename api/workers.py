@@ -0,0 +1,117 @@
+import logging
+import os
+import signal
+import time
+from multiprocessing import cpu_count
+
+from api.settings import LOGGING_LEVEL
+
+# sent by a worker to the supervisor, which relays it to every worker, for each to clear its local caches
+CLEAR_CACHES = signal.SIGUSR1
+
+
+class Workers:
+    """
+    Pre-fork supervisor. Everything loaded before start is shared copy-on-write with the workers, each worker binds
+    its own SO_REUSEPORT socket so the kernel spreads connections over them. A worker that dies is replaced, SIGHUP
+    replaces every worker with a fresh one before telling the old one to drain, SIGTERM and SIGINT drain them all.
+    Every socket a worker listens on has SO_REUSEPORT, so the fresh worker can bind it while the old one drains.
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOGGING_LEVEL)
+
+    # a worker dying sooner than this after it was started is replaced after the same delay, not straight away
+    crash_delay = 1  # seconds
+    # in a worker, the pid of the supervisor it was forked by
+    supervisor = None
+
+    def __init__(self, count: int, run):
+        """
+        :param count: number of workers, 0 one per cpu
+        :param run: called in each worker with its number, serves until the worker should exit
+        """
+        self.count = count if count > 0 else cpu_count()
+        self.run = run
+        self.children = {}  # pid: (number, started)
+        self.retiring = set()
+        self.stopping = False
+
+    def start(self):
+        """
+        blocks until every worker has exited
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.restart)
+        signal.signal(CLEAR_CACHES, self.clear_caches)
+        for number in range(self.count):
+            self.spawn(number)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.exited(pid, status)
+
+    def exited(self, pid: int, status: int, now: float = None):
+        if pid not in self.children:
+            return
+        number, started = self.children.pop(pid)
+        if pid in self.retiring:
+            self.retiring.discard(pid)
+            self.logger.info("worker retired,number=%s,pid=%s", number, pid)
+            return
+        if self.stopping:
+            return
+        self.logger.warning("worker exited,number=%s,pid=%s,status=%s", number, pid, status)
+        if (time.monotonic() if now is None else now) - started < self.crash_delay:
+            time.sleep(self.crash_delay)
+        self.spawn(number)
+
+    def spawn(self, number: int):
+        supervisor = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            Workers.supervisor = supervisor
+            for x in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
+                signal.signal(x, signal.SIG_DFL)
+            # it would kill a worker that has no handler for it
+            signal.signal(CLEAR_CACHES, signal.SIG_IGN)
+            code = 0
+            try:
+                self.run(number)
+            except:
+                self.logger.exception("worker failed,number=%s", number)
+                code = 1
+            os._exit(code)
+        self.logger.info("worker started,number=%s,pid=%s", number, pid)
+        self.children[pid] = (number, time.monotonic())
+
+    def restart(self, signum=None, frame=None):
+        for pid, (number, started) in list(self.children.items()):
+            if pid in self.retiring:
+                continue
+            self.retiring.add(pid)
+            self.spawn(number)
+            os.kill(pid, signal.SIGTERM)
+
+    def clear_caches(self, signum=None, frame=None):
+        for pid in self.children:
+            os.kill(pid, CLEAR_CACHES)
+
+    @classmethod
+    def clear_all_caches(cls) -> bool:
+        """
+        from a worker, has every worker of the supervisor clear its local caches, this one included
+        :return: False when not running in a worker
+        """
+        if cls.supervisor is None:
+            return False
+        os.kill(cls.supervisor, CLEAR_CACHES)
+        return True
+
+    def stop(self, signum=None, frame=None):
+        self.logger.info("stop,workers=%s", len(self.children))
+        self.stopping = True
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
@@ -0,0 +1,48 @@
+"""
+cost of writing one message to every handler on a context, encoded by each write_message or once by Sender, both
+with codec.dumps so only the number of encodes differs
+
+    python -m benchmarks.broadcast
+"""
+from timeit import repeat
+
+from tornado.escape import utf8
+
+from api import codec
+from benchmarks.payloads import suggestion_items_message
+
+
+class Handler:
+    """
+    stands in for WebSocketHandler.write_message up to the frame being written, dicts are encoded the way it does
+    """
+    def write_message(self, message):
+        if isinstance(message, dict):
+            message = codec.dumps(message)
+        return utf8(message)
+
+
+def best(function, number: int) -> float:
+    return min(repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def per_handler(handlers: list, message: dict):
+    for x in handlers:
+        x.write_message(message)
+
+
+def once(handlers: list, message: dict):
+    body = codec.dumps(message)
+    for x in handlers:
+        x.write_message(body)
+
+
+if __name__ == "__main__":
+    message = suggestion_items_message()
+    print("backend=%s,message_bytes=%s" % (codec.BACKEND, len(codec.dumps(message))))
+    print("%-10s %12s %12s %7s" % ("handlers", "per handler", "once", ""))
+    for n in [1, 2, 4, 8, 16]:
+        handlers = [Handler() for _ in range(n)]
+        current_us = best(lambda: per_handler(handlers, message), 200)
+        once_us = best(lambda: once(handlers, message), 200)
+        print("%-10s %10.1fus %10.1fus %6.1fx" % (n, current_us, once_us, current_us / once_us))
@@ -0,0 +1,57 @@
+"""
+compare api.codec with the functions it replaces
+
+    python -m benchmarks.codec
+"""
+from timeit import repeat
+
+from bson import json_util
+from tornado.escape import json_decode, json_encode
+
+from api import codec
+from benchmarks.payloads import suggest_items, suggestion_items_message
+
+
+def best(function, number: int) -> float:
+    return min(repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def compare(name: str, current, replacement, number: int = 2000):
+    current_us = best(current, number)
+    replacement_us = best(replacement, number)
+    print("%-40s %10.1fus %10.1fus %6.1fx" % (name, current_us, replacement_us, current_us / replacement_us))
+
+
+if __name__ == "__main__":
+    items = suggest_items()
+    items_body = json_util.dumps(items).encode("utf-8")
+    message = suggestion_items_message()
+    message_body = json_encode(message).encode("utf-8")
+
+    assert codec.bson_loads(items_body) == json_util.loads(items_body.decode("utf-8"))
+    assert codec.loads(message_body) == json_decode(message_body)
+
+    print("backend=%s" % codec.BACKEND)
+    print("%-40s %12s %12s %7s" % ("", "current", "codec", ""))
+    compare(
+        "items page decode (json_util.loads)",
+        lambda: json_util.loads(items_body.decode("utf-8")),
+        lambda: codec.bson_loads(items_body)
+    )
+    compare(
+        "items page encode (json_util.dumps)",
+        lambda: json_util.dumps(items),
+        lambda: codec.bson_dumps(items)
+    )
+    compare(
+        "suggestion_items decode (json_decode)",
+        lambda: json_decode(message_body),
+        lambda: codec.loads(message_body),
+        number=500
+    )
+    compare(
+        "suggestion_items encode (json_encode)",
+        lambda: json_encode(message),
+        lambda: codec.dumps(message),
+        number=500
+    )
@@ -0,0 +1,54 @@
+"""
+permessage-deflate cost and savings per websocket message by compression level and memory level, with the
+compressor kept across messages (context takeover) as tornado does by default
+
+    python -m benchmarks.compression
+"""
+import zlib
+from timeit import repeat
+
+from tornado.escape import utf8
+
+from api import codec
+from benchmarks.payloads import suggestion_items_message
+
+
+def messages() -> dict:
+    return {
+        "start_thinking": {"type": "start_thinking", "thinking_mode": "detect"},
+        "jemboo_chat_response": {
+            "type": "jemboo_chat_response",
+            "direction": 0,
+            "display_text": "Here are some black leather ankle boots, what do you think?"
+        },
+        "suggestion_items": suggestion_items_message()
+    }
+
+
+def compressor(level: int, mem_level: int):
+    return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, mem_level)
+
+
+def compress(compressor, data: bytes) -> bytes:
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def best(function, number: int) -> float:
+    return min(repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    print("%-22s %6s %5s %5s %9s %9s %7s" % ("message", "bytes", "level", "mem", "deflated", "time", "ratio"))
+    previous, current = messages(), messages()
+    for name, message in current.items():
+        data = utf8(codec.dumps(message))
+        for level in [1, 3, 6, 9]:
+            for mem_level in [4, 8, 9]:
+                c = compressor(level, mem_level)
+                # an earlier message of the same type fills the window, as on a connection that has been open a while
+                compress(c, utf8(codec.dumps(previous[name])))
+                size = len(compress(c, data))
+                us = best(lambda: compress(c, data), 200)
+                print("%-22s %6s %5s %5s %9s %7.1fus %6.1f%%" % (
+                    name, len(data), level, mem_level, size, us, 100.0 * size / len(data)
+                ))
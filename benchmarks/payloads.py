@@ -0,0 +1,72 @@
+"""
+payloads shaped like the suggest items response and the filled suggestion_items websocket message
+"""
+import random
+from datetime import datetime
+
+from bson import ObjectId
+
+
+def suggest_items(page_size: int = 20) -> dict:
+    return {
+        "items": [
+            {
+                "_id": ObjectId(),
+                "index": index,
+                "score": random.random() * 100,
+                "reasons": [
+                    {"type": random.choice(["color", "style", "material"]), "key": "black", "score": 4.5},
+                    {"type": "popular", "score": 1.2}
+                ]
+            } for index in range(page_size)
+        ],
+        "created": datetime.now()
+    }
+
+
+def product(_id: ObjectId) -> dict:
+    return {
+        "_id": str(_id),
+        "sequence": random.randint(0, 100000),
+        "title": "Leather ankle boots with block heel",
+        "attributes": [
+            {
+                "_id": {"type": attribute_type, "key": key},
+                "source": "content",
+                "weighting": 10
+            } for attribute_type, key in [
+                ("color", "black"), ("material", "leather"), ("style", "ankle boots"), ("theme", "casual"),
+                ("heel", "block heel"), ("brand", "acme"), ("size", "38"), ("size", "39"), ("size", "40")
+            ]
+        ],
+        "images": [
+            {
+                "path": "products/%s/%s.jpg" % (_id, index),
+                "width": 1200,
+                "height": 1600,
+                "tiles": [
+                    {"w": w, "h": h, "path": "tiles/%s/%s_%s_%s.jpg" % (_id, index, w, h)}
+                    for w in ["w-sm", "w-md", "w-lg"] for h in ["h-sm", "h-md", "h-lg"]
+                ]
+            } for index in range(4)
+        ],
+        "brand": {"name": "Acme", "slug": "acme"},
+        "prices": [{"currency": "GBP", "value": 129.0, "original": 159.0}],
+        "updated": "2015-10-01T10:00:00",
+        "tile": {"image_scale": "height", "colspan": 1, "rowspan": 2, "image_url": "https://cdn/tiles/x.jpg"},
+        "score": random.random() * 100,
+        "reasons": [{"type": "color", "key": "black", "score": 4.5}],
+        "position": 0,
+        "url": "/shoes/acme/leather-ankle-boots/%s" % _id,
+        "favorited": False
+    }
+
+
+def suggestion_items_message(page_size: int = 20) -> dict:
+    return {
+        "type": "suggestion_items",
+        "next_offset": page_size,
+        "offset": 0,
+        "suggest_id": str(ObjectId()),
+        "items": [product(ObjectId()) for _ in range(page_size)]
+    }
@@ -1,13 +1,21 @@
+import gc
 import logging
+import signal
 from tornado.httpserver import HTTPServer
+from multiprocessing import cpu_count
+from tornado.netutil import bind_sockets
 import tornado
 import tornado.options
 from tornado.ioloop import IOLoop
-from api.application import Application
+from api.application import Application, client_handlers, clear_caches, create_caches, warm_caches
+from api.bus import Broker, host_port
+from api.router import Router
+from api.workers import Workers, CLEAR_CACHES
 
 __author__ = 'robdefeo'
 
-from api.settings import PORT, ADD_DEV_SSL, LOGGING_LEVEL
+from api.settings import PORT, ADD_DEV_SSL, LOGGING_LEVEL, SHUTDOWN_TIMEOUT, SHUTDOWN_DRAIN_INTERVAL, WORKERS, WARM_PRODUCT_IDS, \
+    BUS, BUS_BROKER, BUS_BROKER_START, ROUTER, ROUTER_PROCESSES, ROUTER_WORKER_PORT
 tornado.options.define('port', type=int, default=PORT, help='server port number (default: 9999)')
 tornado.options.define('debug', type=bool, default=False, help='run in debug mode with autoreload (default: False)')
 
@@ -15,6 +23,89 @@ logging.basicConfig(format="%(asctime)s:%(levelname)s:%(name)s:%(funcName)s:%(me
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGING_LEVEL)
 
+
+def start_broker():
+    host, port = host_port(BUS_BROKER)
+    broker = Broker()
+    # the broker replacing this one binds while it drains
+    broker.add_sockets(bind_sockets(port, host, reuse_port=True))
+    return broker
+
+
+def start_router(workers: int):
+    router = Router(["127.0.0.1:%s" % (ROUTER_WORKER_PORT + x) for x in range(workers)])
+    router.add_sockets(bind_sockets(tornado.options.options.port, reuse_port=True))
+    return router
+
+
+def run_service(start):
+    """
+    a worker of its own running the broker or the router, it outlives the restart of any server worker
+    """
+    def shutdown():
+        # new connections go to its replacement, the servers are draining and may still use this one
+        server.stop()
+        io_loop = IOLoop.instance()
+        io_loop.call_later(SHUTDOWN_TIMEOUT, io_loop.stop)
+
+    def on_signal(signum, frame):
+        IOLoop.instance().add_callback_from_signal(shutdown)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    server = start()
+    IOLoop.instance().start()
+
+
+def serve(caches: dict, ssl_options: dict, port: int, address: str = "", reuse_port: bool = False,
+          xheaders: bool = False):
+    """
+    runs one server until SIGTERM or SIGINT, after which it stops accepting, waits up to SHUTDOWN_TIMEOUT for its
+    websockets to close and then for the feedback and context messages queued to be sent
+    """
+    # the application starts periodic callbacks on the IOLoop, in a worker it is made after the fork
+    application = Application(caches)
+    http_server = tornado.httpserver.HTTPServer(application, ssl_options=ssl_options, xheaders=xheaders)
+    http_server.add_sockets(bind_sockets(port, address, reuse_port=reuse_port))
+
+    def shutdown():
+        logger.info("shutdown,timeout=%s,contexts=%s", SHUTDOWN_TIMEOUT, len(client_handlers))
+        http_server.stop()
+        io_loop = IOLoop.instance()
+        drain(io_loop, io_loop.time() + SHUTDOWN_TIMEOUT)
+
+    def drain(io_loop: IOLoop, deadline: float):
+        # clients get until the deadline to leave, the ones still there are told the server is going away
+        if len(client_handlers) and io_loop.time() < deadline:
+            io_loop.call_later(SHUTDOWN_DRAIN_INTERVAL, drain, io_loop, deadline)
+            return
+        for x in client_handlers.all():
+            x.close(1001, "shutdown")
+
+        # queued feedback and context messages are lost otherwise, the loop stops once both are sent
+        io_loop.call_later(SHUTDOWN_TIMEOUT, io_loop.stop)
+        queues = [application.feedback_queue, application.context_messages]
+
+        def stopped(queue):
+            queues.remove(queue)
+            if not queues:
+                io_loop.stop()
+
+        for x in list(queues):
+            x.stop(lambda x=x: stopped(x))
+
+    def on_signal(signum, frame):
+        IOLoop.instance().add_callback_from_signal(shutdown)
+
+    def on_clear_caches(signum, frame):
+        IOLoop.instance().add_callback_from_signal(clear_caches, caches)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(CLEAR_CACHES, on_clear_caches)
+    IOLoop.instance().start()
+
+
 if __name__ == "__main__":
     tornado.options.parse_command_line()
     # http_server = HTTPServer(Application())
@@ -25,6 +116,37 @@ if __name__ == "__main__":
             "keyfile": "/Users/robdefeo/development/api/dev_cert/58327134-jemboo.com.key",
         }
 
-    http_server = tornado.httpserver.HTTPServer(Application(), ssl_options=ssl_options)
-    http_server.listen(tornado.options.options.port)
-    IOLoop.instance().start()
\ No newline at end of file
+    caches = create_caches()
+    if WARM_PRODUCT_IDS:
+        with open(WARM_PRODUCT_IDS) as f:
+            warm_caches(caches, [x.strip() for x in f if x.strip()])
+
+    broker = BUS == "socket" and BUS_BROKER_START
+    # autoreload restarts the process it runs in, it cannot be a worker
+    if WORKERS == 1 or tornado.options.options.debug:
+        if broker:
+            start_broker()
+        serve(caches, ssl_options, tornado.options.options.port)
+    else:
+        # keeps what was loaded out of the collector, it would otherwise write to every shared page it walks
+        gc.freeze()
+        workers = WORKERS if WORKERS > 0 else cpu_count()
+        # workers after the servers: the broker, then the routers
+        services = []
+        if broker:
+            services.append(start_broker)
+        if ROUTER:
+            if ssl_options is not None:
+                logger.warning("the router does not terminate tls, it goes in front of the router")
+            services.extend([lambda: start_router(workers)] * ROUTER_PROCESSES)
+
+        def work(number: int):
+            if number >= workers:
+                run_service(services[number - workers])
+            elif ROUTER:
+                # only the router reaches it, the client address comes in X-Forwarded-For
+                serve(caches, None, ROUTER_WORKER_PORT + number, "127.0.0.1", reuse_port=True, xheaders=True)
+            else:
+                serve(caches, ssl_options, tornado.options.options.port, reuse_port=True)
+
+        Workers(workers + len(services), work).start()
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from mock import Mock
+
+from api.cache.detection import Detection as Target
+
+
+class key(TestCase):
+    def test_normalized(self):
+        self.assertEqual(
+            Target.key("en_GB", "  Black   BOOTS "),
+            Target.key("en_gb", "black boots")
+        )
+
+    def test_endpoint(self):
+        self.assertNotEqual(
+            Target.key("en_GB", "black boots", "wit"),
+            Target.key("en_GB", "black boots")
+        )
+
+
+class get(TestCase):
+    def test_miss_then_hit(self):
+        target = Target(10, 60)
+        fetch = Mock(side_effect=lambda callback: callback({"outcomes": []}))
+        callback = Mock()
+
+        target.get("key_value", fetch, callback)
+        target.get("key_value", fetch, callback)
+
+        self.assertEqual(1, fetch.call_count)
+        self.assertEqual(2, callback.call_count)
+        callback.assert_called_with({"outcomes": []})
+
+    def test_single_flight(self):
+        target = Target(10, 60)
+        fetch = Mock()
+        callback_1 = Mock()
+        callback_2 = Mock()
+
+        target.get("key_value", fetch, callback_1)
+        target.get("key_value", fetch, callback_2)
+        self.assertEqual(1, fetch.call_count)
+        callback_1.assert_not_called()
+
+        fetch.call_args_list[0][0][0]("detection_value")
+
+        callback_1.assert_called_once_with("detection_value")
+        callback_2.assert_called_once_with("detection_value")
+        self.assertEqual("detection_value", target.peek("key_value"))
+
+    def test_failed_fetch_not_cached(self):
+        target = Target(10, 60)
+        fetch = Mock(side_effect=lambda callback: callback(None))
+        callback = Mock()
+
+        target.get("key_value", fetch, callback)
+        target.get("key_value", fetch, callback)
+
+        self.assertEqual(2, fetch.call_count)
+        callback.assert_called_with(None)
+
+    def test_fetch_raises(self):
+        target = Target(10, 60)
+        fetch = Mock(side_effect=Exception())
+        callback = Mock()
+
+        target.get("key_value", fetch, callback)
+
+        callback.assert_called_once_with(None)
+        self.assertDictEqual({}, target._waiting)
+
+    def test_refetch_for_live_deadline(self):
+        target = Target(10, 60)
+        fetch_1 = Mock()
+        fetch_2 = Mock()
+        fetch_3 = Mock()
+        callback_1 = Mock()
+        callback_2 = Mock()
+        callback_3 = Mock()
+
+        target.get("key_value", fetch_1, callback_1, deadline=Mock(expired=Mock(return_value=True)))
+        target.get("key_value", fetch_2, callback_2, deadline=Mock(expired=Mock(return_value=True)))
+        target.get("key_value", fetch_3, callback_3, deadline=Mock(expired=Mock(return_value=False)))
+        fetch_1.call_args[0][0](None)
+
+        callback_1.assert_called_once_with(None)
+        callback_2.assert_called_once_with(None)
+        callback_3.assert_not_called()
+        fetch_2.assert_not_called()
+        self.assertEqual(1, fetch_3.call_count)
+
+        fetch_3.call_args[0][0]("detection_value")
+        callback_3.assert_called_once_with("detection_value")
+
+    def test_failed_with_live_deadline(self):
+        target = Target(10, 60)
+        fetch_1 = Mock()
+        fetch_2 = Mock()
+        callback_1 = Mock()
+        callback_2 = Mock()
+
+        target.get("key_value", fetch_1, callback_1, deadline=Mock(expired=Mock(return_value=False)))
+        target.get("key_value", fetch_2, callback_2)
+        fetch_1.call_args[0][0](None)
+
+        callback_1.assert_called_once_with(None)
+        callback_2.assert_called_once_with(None)
+        fetch_2.assert_not_called()
+
+    def test_expired(self):
+        target = Target(10, 60)
+        now = datetime(2015, 1, 1)
+        target.put("key_value", "detection_value", now=now)
+
+        self.assertEqual("detection_value", target.peek("key_value", now=now + timedelta(seconds=59)))
+        self.assertIsNone(target.peek("key_value", now=now + timedelta(seconds=61)))
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from api.cache.suggestion_pages import SuggestionPages as Target
+
+
+class key(TestCase):
+    def test_not_recorded(self):
+        target = Target(10, 60)
+
+        for x in range(100):
+            target.key("suggest_id", x, 20)
+
+        self.assertDictEqual({}, target._keys)
+
+
+class remove_context(TestCase):
+    def test(self):
+        target = Target(10, 60)
+        target.track("context_id", "suggest_id")
+        target.put(target.key("suggest_id", 0, 20), "page")
+        target.put(target.key("suggest_id", 20, 20), "page")
+        target.track("other_context_id", "other_suggest_id")
+        target.put(target.key("other_suggest_id", 0, 20), "page")
+
+        target.remove_context("context_id")
+
+        self.assertIsNone(target.peek(target.key("suggest_id", 0, 20)))
+        self.assertEqual("page", target.peek(target.key("other_suggest_id", 0, 20)))
+        self.assertListEqual(["other_context_id"], list(target._suggest_ids))
+        self.assertListEqual(["other_suggest_id"], list(target._keys))
+
+
+class put(TestCase):
+    def test_evicted_forgotten(self):
+        target = Target(2, 60)
+        for x in range(100):
+            target.track("context_%s" % x, "suggest_%s" % x)
+            target.put(target.key("suggest_%s" % x, 0, 20), "page")
+
+        self.assertEqual(2, len(target._keys))
+        self.assertEqual(2, len(target._suggest_ids))
+        self.assertEqual(2, len(target._contexts))
+
+    def test_tracked_after_put(self):
+        target = Target(10, 60)
+        target.put(target.key("suggest_id", 0, 20), "page")
+        target.track("context_id", "suggest_id")
+
+        target.remove_context("context_id")
+
+        self.assertDictEqual({}, target._keys)
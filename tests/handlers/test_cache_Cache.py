@@ -0,0 +1,69 @@
+import json
+
+from mock import Mock, patch
+from tornado import testing
+from tornado.web import Application, RequestHandler
+
+from api.handlers.cache import Cache as Target
+from api.upstream import Upstream
+
+
+class StandInService(RequestHandler):
+    def initialize(self, calls, status):
+        self.calls = calls
+        self.status = status
+
+    def get(self):
+        self.calls.append(("GET", self.request.path))
+        self.set_status(self.status)
+
+    def delete(self):
+        self.calls.append(("DELETE", self.request.path))
+        self.set_status(self.status)
+
+
+class delete(testing.AsyncHTTPTestCase):
+    def get_app(self):
+        self.calls = []
+        self.product_cache = Mock()
+        self.detection_cache = Mock()
+        self.suggestion_pages = Mock()
+        return Application([
+            (r"/cache", Target, dict(
+                product_cache=self.product_cache,
+                detection_cache=self.detection_cache,
+                suggestion_pages=self.suggestion_pages
+            )),
+            (r"/suggest/cache", StandInService, dict(calls=self.calls, status=200)),
+            (r"/detect/refresh", StandInService, dict(calls=self.calls, status=500))
+        ])
+
+    def delete(self, path, peer_urls):
+        with patch("api.handlers.cache.suggest_upstream", Upstream("suggest", [self.get_url("/suggest")])), \
+                patch("api.handlers.cache.detect_upstream", Upstream("detect", [self.get_url("/detect")])), \
+                patch("api.handlers.cache.PEER_URLS", peer_urls):
+            response = self.fetch(path, method="DELETE")
+        return json.loads(response.body.decode("utf-8"))
+
+    def test_broadcast(self):
+        actual = self.delete("/cache", [self.get_url("")])
+
+        self.assertEqual("NOT_OK", actual["status"])
+        self.assertListEqual(
+            [("suggest", "OK"), ("detect", "NOT_OK"), (self.get_url(""), "OK")],
+            [(x["key"], x["status"]) for x in actual["targets"]]
+        )
+        self.assertIn("time", actual["targets"][0])
+        self.assertIn("error", actual["targets"][1])
+        self.assertListEqual([("DELETE", "/suggest/cache"), ("GET", "/detect/refresh")], self.calls)
+        # once for the request and once for the forwarded peer request
+        self.assertEqual(2, self.product_cache.clear.call_count)
+        self.assertEqual(2, self.detection_cache.clear.call_count)
+        self.assertEqual(2, self.suggestion_pages.clear.call_count)
+
+    def test_no_propagate(self):
+        actual = self.delete("/cache?propagate=0", [self.get_url("")])
+
+        self.assertDictEqual({"status": "OK", "targets": []}, actual)
+        self.assertListEqual([], self.calls)
+        self.product_cache.clear.assert_called_once_with()
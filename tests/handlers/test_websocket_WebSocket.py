@@ -0,0 +1,139 @@
+from unittest import TestCase, skipUnless
+
+from mock import Mock, patch
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+from tornado.websocket import WebSocketProtocol13, websocket_connect
+
+from api.handlers.websocket import WebSocket as Target, SmallUncompressedProtocol as Protocol
+
+
+class SmallUncompressedProtocol_write_message(TestCase):
+    def setUp(self):
+        self.target = Protocol.__new__(Protocol)
+        self.target.min_size = 256
+        self.target._compressor = "compressor"
+        self.compressors = []
+
+    def write_message(self, message, binary=False):
+        self.compressors.append(self.target._compressor)
+
+    def test_small_uncompressed(self):
+        with patch.object(WebSocketProtocol13, "write_message", lambda target, *args: self.write_message(*args)):
+            self.target.write_message("{}")
+
+        self.assertListEqual([None], self.compressors)
+        self.assertEqual("compressor", self.target._compressor)
+
+    def test_large_compressed(self):
+        with patch.object(WebSocketProtocol13, "write_message", lambda target, *args: self.write_message(*args)):
+            self.target.write_message("x" * 1024)
+
+        self.assertListEqual(["compressor"], self.compressors)
+
+
+class Echo(Target):
+    def initialize(self):
+        pass
+
+    def open(self):
+        pass
+
+    def on_message(self, message):
+        self.write_now(message)
+
+    def on_close(self):
+        pass
+
+
+class compression(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r"/", Echo)])
+
+    messages = ["{}", "x" * 4096, '{"type": "busy"}', "y" * 300, "z" * 100000]
+
+    @gen_test
+    def round_trip(self):
+        connection = yield websocket_connect("ws://127.0.0.1:%s/" % self.get_http_port(), compression_options={})
+        self.assertIn("permessage-deflate", connection.headers.get("Sec-WebSocket-Extensions", ""))
+        for message in self.messages:
+            connection.write_message(message)
+            actual = yield connection.read_message()
+            self.assertEqual(message, actual)
+        connection.close()
+
+    def test_round_trip(self):
+        self.round_trip()
+
+    @skipUnless(Protocol.supported, "tornado writes every message compressed")
+    def test_small_uncompressed(self):
+        # whether each text frame the server wrote was flagged compressed
+        compressed = []
+        write_frame = Protocol._write_frame
+
+        def record(target, fin, opcode, data, flags=0):
+            if opcode == 0x1:
+                compressed.append(bool(flags & Protocol.RSV1))
+            return write_frame(target, fin, opcode, data, flags)
+
+        with patch.object(Protocol, "_write_frame", record):
+            self.round_trip()
+
+        self.assertListEqual([False, True, False, True, True], compressed)
+
+
+class get_compression_options(TestCase):
+    def test(self):
+        self.assertDictEqual(
+            {"compression_level": 3, "mem_level": 4},
+            Target.__new__(Target).get_compression_options()
+        )
+
+
+class ping_timed_out(TestCase):
+    def target(self, settings: dict) -> Target:
+        target = Target.__new__(Target)
+        target.application = Mock(settings=settings)
+        target.close_code = None
+        target.last_pong = 100.0
+        return target
+
+    def test(self):
+        target = self.target({"websocket_ping_interval": 25, "websocket_ping_timeout": 60})
+
+        self.assertTrue(target.ping_timed_out(now=161.0))
+        self.assertFalse(target.ping_timed_out(now=159.0))
+
+    def test_closed_by_client(self):
+        target = self.target({"websocket_ping_interval": 25, "websocket_ping_timeout": 60})
+        target.close_code = 1000
+
+        self.assertFalse(target.ping_timed_out(now=161.0))
+
+    def test_no_pings(self):
+        target = self.target({})
+
+        self.assertFalse(target.ping_timed_out(now=1000.0))
+
+
+class on_message(TestCase):
+    def target(self, wait: float) -> Target:
+        target = Target.__new__(Target)
+        target.initialize(Mock(), Mock(take=Mock(return_value=wait)))
+        target.user_id = "user_id_value"
+        return target
+
+    def test(self):
+        target = self.target(0)
+
+        target.on_message('{"type": "new_message"}')
+
+        target._logic.on_message.assert_called_once_with(target, {"type": "new_message"})
+
+    def test_rate_limited(self):
+        target = self.target(1.5)
+
+        target.on_message('{"type": "new_message"}')
+
+        self.assertEqual(0, target._logic.on_message.call_count)
+        target._logic.sender.write_rate_limited_message.assert_called_once_with(target, "new_message", 1.5)
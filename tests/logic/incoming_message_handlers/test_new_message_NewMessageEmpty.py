@@ -31,27 +31,26 @@ class get_context_callback(TestCase):
         suggest = Mock()
         target = Target(sender, context, suggest)
 
-        target.json_decode = MagicMock(
-            return_value={
+        handler = MagicMock()
+        handler.user_id = "user_id_value"
+        handler.application_id = "application_id_value"
+        handler.session_id = "session_id_value"
+        handler.locale = "locale_value"
+        handler.suggest_id = "previous_suggest_id"
+
+        target.get_context_callback(
+            {
                 "entities": [
                     {
                         "source": "non_detection"
                     }
                 ],
                 "_rev": "_context_rev_value"
-            }
+            },
+            handler,
+            "message_value"
         )
 
-        handler = MagicMock()
-        handler.user_id = "user_id_value"
-        handler.application_id = "application_id_value"
-        handler.session_id = "session_id_value"
-        handler.locale = "locale_value"
-
-        response = MagicMock()
-        response.body = "response_value"
-        target.get_context_callback(response, handler, "message_value")
-
         self.assertEqual(1, suggest.post_suggest.call_count)
         self.assertEqual("user_id_value", suggest.post_suggest.call_args_list[0][0][0])
         self.assertEqual("application_id_value", suggest.post_suggest.call_args_list[0][0][1])
@@ -60,10 +59,10 @@ class get_context_callback(TestCase):
         self.assertDictEqual({'_rev': '_context_rev_value', 'entities': [{'source': 'non_detection'}]},
                              suggest.post_suggest.call_args_list[0][0][4])
 
-        target.json_decode.assert_called_once_with('response_value')
-
         self.assertDictEqual({'_rev': '_context_rev_value', 'entities': [{'source': 'non_detection'}]}, handler.context)
         self.assertEqual("_context_rev_value", handler.context_rev)
+        # left for post_suggest_callback to drop its pages
+        self.assertEqual("previous_suggest_id", handler.suggest_id)
 
 
 class post_suggest_callback(TestCase):
@@ -74,10 +73,30 @@ class post_suggest_callback(TestCase):
         target = Target(sender, context, suggest)
         target.json_decode = MagicMock(return_value={"_rev": "context_revision_value"})
 
-        response = Mock()
+        response = Mock(error=None)
         response.headers = {"_id": "suggest_id_value"}
         handler = MagicMock()
         target.post_suggest_callback(response, handler, "message_value")
 
-        suggest.write_new_suggestion.assert_called_once_with(handler)
+        suggest.write_new_suggestion.assert_called_once_with(handler, items_pushed=False)
         self.assertEqual("suggest_id_value", handler.suggest_id)
+
+    def test_push_first_page(self):
+        sender = MagicMock()
+        context = MagicMock()
+        suggest = MagicMock()
+        next_page = MagicMock()
+        target = Target(sender, context, suggest, next_page)
+        target.push_first_page = True
+
+        response = Mock(error=None)
+        response.headers = {"_id": "suggest_id_value"}
+        handler = MagicMock()
+        target.post_suggest_callback(response, handler, "message_value")
+
+        suggest.write_new_suggestion.assert_called_once_with(handler, items_pushed=True)
+        next_page.on_next_page_message.assert_called_once_with(
+            handler,
+            {"type": "next_page", "suggest_id": "suggest_id_value", "offset": 0},
+            None
+        )
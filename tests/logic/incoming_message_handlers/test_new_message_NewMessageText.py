@@ -2,6 +2,7 @@ from unittest import TestCase
 
 from mock import Mock, MagicMock
 
+from api.deadline import Deadline
 from api.logic.incoming_message_handlers import NewMessageTextHandler as Target
 
 
@@ -21,61 +22,56 @@ class on_new_message(TestCase):
 
         target.on_new_message_text(handler, "message_value", "message_text_value")
 
-        self.assertEqual(1, detect.post_detect.call_count)
-        self.assertEqual("user_id_value", detect.post_detect.call_args_list[0][0][0])
-        self.assertEqual("application_id_value", detect.post_detect.call_args_list[0][0][1])
-        self.assertEqual("session_id_value", detect.post_detect.call_args_list[0][0][2])
-        self.assertEqual("locale_value", detect.post_detect.call_args_list[0][0][3])
-        self.assertEqual("message_text_value", detect.post_detect.call_args_list[0][0][4])
+        self.assertEqual(1, detect.get_detection.call_count)
+        self.assertEqual("user_id_value", detect.get_detection.call_args_list[0][0][0])
+        self.assertEqual("application_id_value", detect.get_detection.call_args_list[0][0][1])
+        self.assertEqual("session_id_value", detect.get_detection.call_args_list[0][0][2])
+        self.assertEqual("locale_value", detect.get_detection.call_args_list[0][0][3])
+        self.assertEqual("message_text_value", detect.get_detection.call_args_list[0][0][4])
 
 
-class post_detect_callback(TestCase):
-    def test_post_detect_callback(self):
-        sender = Mock()
-        detect = Mock()
-        context = Mock()
-        suggest = Mock()
-        target = Target(sender, detect, context, suggest)
-
-        response = Mock()
-        response.headers = {"Location": "location_value"}
-        target.post_detect_callback(response, "handler", "message_value")
-
-        self.assertEqual(1, target.detect.get_detect.call_count)
-        self.assertEqual("location_value", target.detect.get_detect.call_args_list[0][0][0])
-
-
-class get_detect_callback(TestCase):
+class get_detection_callback(TestCase):
     def test_no_respond_to_detection_response(self):
         sender = MagicMock()
         detect = MagicMock()
         context = MagicMock()
         suggest = Mock()
         target = Target(sender, detect, context, suggest)
-        target.json_decode = MagicMock(return_value="decode_detection_response")
-
-        response = Mock()
-        response.body = "response_body"
 
         handler = Mock()
         handler.context_id = "context_id_value"
 
-        target.get_detect_callback(response, handler, "message_value")
-
-        target.json_decode.assert_called_once_with("response_body")
+        target.get_detection_callback("decode_detection_response", handler, "message_value")
 
         # context.post_context_message.assert_called_once_with("context_id_value", 1, "", dection="decode_detection_response")
 
-        self.assertEqual(1, context.post_context_message.call_count)
-        self.assertEqual("context_id_value", context.post_context_message.call_args_list[0][0][0])
-        self.assertEqual(1, context.post_context_message.call_args_list[0][0][1])
-        self.assertEqual("", context.post_context_message.call_args_list[0][0][2])
-        self.assertEqual("decode_detection_response", context.post_context_message.call_args_list[0][1]["detection"])
+        put = sender.context_messages.put
+        self.assertEqual(1, put.call_count)
+        self.assertEqual("context_id_value", put.call_args_list[0][0][0])
+        self.assertEqual(1, put.call_args_list[0][0][1])
+        self.assertEqual("", put.call_args_list[0][0][2])
+        self.assertEqual("decode_detection_response", put.call_args_list[0][1]["detection"])
+        context.post_context_message.assert_not_called()
 
         detect.respond_to_detection_response.assert_called_once_with(handler, "decode_detection_response")
 
         sender.write_jemboo_response_message.assert_not_called()
 
+    def test_deadline_expired(self):
+        sender = Mock()
+        detect = Mock()
+        context = Mock()
+        target = Target(sender, detect, context, Mock())
+        handler = Mock()
+
+        target.get_detection_callback(
+            "decode_detection_response", handler, {"type": "new_message"}, Deadline(1.0, now=0.0)
+        )
+
+        sender.context_messages.put.assert_not_called()
+        detect.respond_to_detection_response.assert_not_called()
+        sender.write_timeout_message.assert_called_once_with(handler, "new_message")
+
     def test_respond_to_detection_response(self):
         sender = MagicMock()
         detect = MagicMock()
@@ -83,30 +79,67 @@ class get_detect_callback(TestCase):
         context = MagicMock()
         suggest = Mock()
         target = Target(sender, detect, context, suggest)
-        target.json_decode = MagicMock(return_value="decode_detection_response")
-
-        response = Mock()
-        response.body = "response_body"
 
         handler = Mock()
         handler.context_id = "context_id_value"
 
-        target.get_detect_callback(response, handler, "message_value")
-
-        target.json_decode.assert_called_once_with("response_body")
+        target.get_detection_callback("decode_detection_response", handler, "message_value")
 
         # context.post_context_message.assert_called_once_with("context_id_value", 1, "", dection="decode_detection_response")
 
-        self.assertEqual(1, context.post_context_message.call_count)
-        self.assertEqual("context_id_value", context.post_context_message.call_args_list[0][0][0])
-        self.assertEqual(1, context.post_context_message.call_args_list[0][0][1])
-        self.assertEqual("", context.post_context_message.call_args_list[0][0][2])
-        self.assertEqual("decode_detection_response", context.post_context_message.call_args_list[0][1]["detection"])
+        put = sender.context_messages.put
+        self.assertEqual(1, put.call_count)
+        self.assertEqual("context_id_value", put.call_args_list[0][0][0])
+        self.assertEqual(1, put.call_args_list[0][0][1])
+        self.assertEqual("", put.call_args_list[0][0][2])
+        self.assertEqual("decode_detection_response", put.call_args_list[0][1]["detection"])
+        context.post_context_message.assert_not_called()
 
         detect.respond_to_detection_response.assert_called_once_with(handler, "decode_detection_response")
 
         sender.write_jemboo_response_message.assert_called_once_with(handler, "something_to_send")
 
+    def test_no_detection(self):
+        sender = MagicMock()
+        detect = MagicMock()
+        context = MagicMock()
+        suggest = Mock()
+        target = Target(sender, detect, context, suggest)
+
+        handler = Mock()
+        handler.context_id = "context_id_value"
+
+        target.get_detection_callback(None, handler, {"type": "new_message"})
+
+        sender.context_messages.put.assert_not_called()
+        detect.respond_to_detection_response.assert_not_called()
+        sender.write_busy_message.assert_not_called()
+        sender.write_error_message.assert_called_once_with(handler, "new_message")
+
+    def test_rejected(self):
+        sender = MagicMock()
+        target = Target(sender, MagicMock(), MagicMock(), Mock())
+        handler = Mock()
+        deadline = Deadline(5)
+        deadline.rejected = True
+
+        target.get_detection_callback(None, handler, {"type": "new_message"}, deadline)
+
+        sender.write_error_message.assert_not_called()
+        sender.write_busy_message.assert_called_once_with(handler, "new_message")
+
+    def test_queue_full(self):
+        sender = MagicMock()
+        sender.context_messages.put.return_value = False
+        detect = MagicMock()
+        target = Target(sender, detect, MagicMock(), Mock())
+        handler = Mock()
+
+        target.get_detection_callback("decode_detection_response", handler, {"type": "new_message"})
+
+        detect.respond_to_detection_response.assert_not_called()
+        sender.write_busy_message.assert_called_once_with(handler, "new_message")
+
 
 class get_context_callback(TestCase):
     def test_regular(self):
@@ -116,10 +149,68 @@ class get_context_callback(TestCase):
         suggest = Mock()
         target = Target(sender, detect, context, suggest)
 
-        target.post_context_message_callback("response_value", "handler_value", "message_value")
+        response = Mock(error=None)
+        response.headers = {"_rev": "new_rev_value"}
+        handler = Mock()
+        target.post_context_message_callback(response, handler, "message_value")
 
         self.assertEqual(1, context.get_context.call_count)
-        self.assertEqual("handler_value", context.get_context.call_args_list[0][0][0])
+        self.assertEqual(handler, context.get_context.call_args_list[0][0][0])
+        self.assertEqual("new_rev_value", handler.context_rev)
+
+    def test_context_returned(self):
+        sender = MagicMock()
+        detect = MagicMock()
+        context = MagicMock()
+        suggest = Mock()
+        target = Target(sender, detect, context, suggest)
+        target.return_context = True
+        target.get_context_callback = Mock()
+        target.json_decode = MagicMock(return_value={"_rev": "context_revision_value"})
+
+        response = Mock(error=None)
+        response.body = "response_body_value"
+        handler = Mock()
+        handler.context_id = "context_id_value"
+        target.post_context_message_callback(response, handler, "message_value")
+
+        target.json_decode.assert_called_once_with("response_body_value")
+        context.get_context.assert_not_called()
+        context.put_context.assert_called_once_with("context_id_value", {"_rev": "context_revision_value"})
+        target.get_context_callback.assert_called_once_with(
+            {"_rev": "context_revision_value"}, handler, "message_value", None
+        )
+
+    def test_context_not_returned(self):
+        sender = MagicMock()
+        detect = MagicMock()
+        context = MagicMock()
+        suggest = Mock()
+        target = Target(sender, detect, context, suggest)
+        target.return_context = True
+        target.get_context_callback = Mock()
+
+        response = Mock(error=None)
+        response.body = b""
+        response.headers = {}
+        target.post_context_message_callback(response, Mock(), "message_value")
+
+        self.assertEqual(1, context.get_context.call_count)
+        target.get_context_callback.assert_not_called()
+
+    def test_error(self):
+        context = MagicMock()
+        target = Target(MagicMock(), MagicMock(), context, Mock())
+        target.return_context = True
+        target.get_context_callback = Mock()
+
+        response = Mock(error="HTTP 500", body=b'{"status": "error"}', headers={"_rev": "rev_value"})
+        handler = Mock()
+        target.post_context_message_callback(response, handler, "message_value")
+
+        context.put_context.assert_not_called()
+        self.assertEqual(1, context.get_context.call_count)
+        self.assertIsNone(handler.context_rev)
 
 
 class post_context_message_user_callback(TestCase):
@@ -129,21 +220,15 @@ class post_context_message_user_callback(TestCase):
         context = MagicMock()
         suggest = Mock()
         target = Target(sender, detect, context, suggest)
-        target.json_decode = MagicMock(return_value={"_rev": "context_revision_value"})
         target.context_responder.unsupported_entities = MagicMock()
 
-        response = Mock()
-        response.body = "response_body_value"
-
         handler = MagicMock()
         handler.user_id = "user_id_value"
         handler.application_id = "application_id_value"
         handler.session_id = "session_id_value"
         handler.locale = "locale_value"
 
-        target.get_context_callback(response, handler, "message_value")
-
-        target.json_decode.assert_called_once_with("response_body_value")
+        target.get_context_callback({"_rev": "context_revision_value"}, handler, "message_value")
 
         target.context_responder.unsupported_entities.assert_called_once_with(handler,
                                                                               {'_rev': 'context_revision_value'})
@@ -155,6 +240,19 @@ class post_context_message_user_callback(TestCase):
         self.assertEqual("locale_value", suggest.post_suggest.call_args_list[0][0][3])
         self.assertDictEqual({'_rev': 'context_revision_value'}, suggest.post_suggest.call_args_list[0][0][4])
 
+    def test_no_context(self):
+        sender = MagicMock()
+        detect = MagicMock()
+        context = MagicMock()
+        suggest = Mock()
+        target = Target(sender, detect, context, suggest)
+
+        handler = MagicMock()
+        target.get_context_callback(None, handler, {"type": "new_message"})
+
+        suggest.post_suggest.assert_not_called()
+        sender.write_error_message.assert_called_once_with(handler, "new_message")
+
 
 class post_suggest_callback(TestCase):
     def test_regular(self):
@@ -165,10 +263,46 @@ class post_suggest_callback(TestCase):
         target = Target(sender, detect, context, suggest)
         target.json_decode = MagicMock(return_value={"_rev": "context_revision_value"})
 
-        response = Mock()
+        response = Mock(error=None)
         response.headers = {"_id": "suggest_id_value"}
         handler = MagicMock()
         target.post_suggest_callback(response, handler, "message_value")
 
-        suggest.write_new_suggestion.assert_called_once_with(handler)
+        suggest.write_new_suggestion.assert_called_once_with(handler, items_pushed=False)
         self.assertEqual("suggest_id_value", handler.suggest_id)
+
+    def test_push_first_page(self):
+        sender = MagicMock()
+        detect = MagicMock()
+        context = MagicMock()
+        suggest = MagicMock()
+        next_page = MagicMock()
+        target = Target(sender, detect, context, suggest, next_page)
+        target.push_first_page = True
+
+        response = Mock(error=None)
+        response.headers = {"_id": "suggest_id_value"}
+        handler = MagicMock()
+        target.post_suggest_callback(response, handler, "message_value")
+
+        suggest.write_new_suggestion.assert_called_once_with(handler, items_pushed=True)
+        next_page.on_next_page_message.assert_called_once_with(
+            handler,
+            {"type": "next_page", "suggest_id": "suggest_id_value", "offset": 0},
+            None
+        )
+
+    def test_error(self):
+        sender = MagicMock()
+        suggest = MagicMock()
+        target = Target(sender, MagicMock(), MagicMock(), suggest)
+
+        response = Mock(error="HTTP 500: Internal Server Error", headers={})
+        handler = MagicMock()
+        handler.suggest_id = "old_suggest_id"
+        target.post_suggest_callback(response, handler, {"type": "new_message"})
+
+        suggest.write_new_suggestion.assert_not_called()
+        suggest.remove_pages.assert_not_called()
+        self.assertEqual("old_suggest_id", handler.suggest_id)
+        sender.write_error_message.assert_called_once_with(handler, "new_message")
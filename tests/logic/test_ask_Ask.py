@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from mock import Mock
+from mock import Mock, patch
+from tornado.httpclient import HTTPError
 
 from api.logic.ask import Ask as Target
 
@@ -246,3 +247,54 @@ class build_header_link_Tests(TestCase):
             actual,
             '<href_value>; rel="relationship_value"'
         )
+
+
+class get_suggestion(TestCase):
+    @patch("api.logic.ask.HTTPClient")
+    def test_inline(self, http_client):
+        http_client.return_value.fetch.return_value = Mock(
+            body='{"items": [{"_id": {"$oid": "5654b2ab0d9a9b1c0d7c0f7a"}, "score": 1}]}'
+        )
+        target = Target(Mock())
+
+        actual = target.get_suggestion("user_id", "application_id", "session_id", "en", 0, 10, {}, False)
+
+        self.assertEqual(1, http_client.return_value.fetch.call_count)
+        request = http_client.return_value.fetch.call_args_list[0][0][0]
+        self.assertEqual("return=representation", request.headers["Prefer"])
+        self.assertIn("offset=0&page_size=10", request.url)
+        self.assertDictEqual({"suggestions": [{"_id": "5654b2ab0d9a9b1c0d7c0f7a", "score": 1}]}, actual)
+
+    @patch("api.logic.ask.HTTPClient")
+    def test_location_only(self, http_client):
+        http_client.return_value.fetch.side_effect = [
+            Mock(body=b"", headers={"_id": "suggest_id"}),
+            Mock(body='{"items": [{"_id": "product_id", "score": 1}]}')
+        ]
+        target = Target(Mock())
+
+        actual = target.get_suggestion("user_id", "application_id", "session_id", "en", 0, 10, {}, False)
+
+        self.assertIn("/suggest_id/items?", http_client.return_value.fetch.call_args_list[1][0][0].url)
+        self.assertDictEqual({"suggestions": [{"_id": "product_id", "score": 1}]}, actual)
+
+
+class get_wit_detection(TestCase):
+    def test_cached(self):
+        target = Target(Mock())
+        target.fetch_wit_detection = Mock(return_value={"outcomes": []})
+
+        first = target.get_wit_detection("user_id", "application_id", "session_id", "en", "black boots", None)
+        second = target.get_wit_detection("user_id", "application_id", "session_id", "en", " Black  Boots", None)
+
+        self.assertDictEqual({"outcomes": []}, first)
+        self.assertDictEqual({"outcomes": []}, second)
+        self.assertEqual(1, target.fetch_wit_detection.call_count)
+
+    def test_error(self):
+        target = Target(Mock())
+        target.fetch_wit_detection = Mock(side_effect=HTTPError(500))
+
+        with self.assertRaises(HTTPError):
+            target.get_wit_detection("user_id", "application_id", "session_id", "en", "black boots", None)
+        self.assertIsNone(target.detection_cache.peek(target.detection_cache.key("en", "black boots", "wit")))
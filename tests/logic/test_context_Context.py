@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from mock import Mock
+
+from api.logic.context import Context as Target
+
+
+class get_context(TestCase):
+    def handler(self, context_rev):
+        handler = Mock()
+        handler.context_id = "context_id_value"
+        handler.context_rev = context_rev
+        handler.context = None
+        return handler
+
+    def test_current(self):
+        target = Target()
+        target.fetch_context = Mock()
+        handler = self.handler("rev_value")
+        handler.context = {"_rev": "rev_value"}
+        callback = Mock()
+
+        target.get_context(handler, callback)
+
+        target.fetch_context.assert_not_called()
+        callback.assert_called_once_with({"_rev": "rev_value"})
+
+    def test_shared_between_handlers(self):
+        target = Target()
+        target.fetch_context = Mock()
+        callback_1 = Mock()
+        callback_2 = Mock()
+
+        target.get_context(self.handler("rev_value"), callback_1)
+        target.get_context(self.handler("rev_value"), callback_2)
+        self.assertEqual(1, target.fetch_context.call_count)
+        self.assertEqual("context_id_value", target.fetch_context.call_args_list[0][0][0])
+        self.assertEqual("rev_value", target.fetch_context.call_args_list[0][0][1])
+
+        target.fetch_context.call_args_list[0][0][2]({"_rev": "rev_value"})
+        target.get_context(self.handler("rev_value"), callback_1)
+
+        self.assertEqual(1, target.fetch_context.call_count)
+        self.assertEqual(2, callback_1.call_count)
+        callback_2.assert_called_once_with({"_rev": "rev_value"})
+
+    def test_latest(self):
+        target = Target()
+        target.fetch_context = Mock(side_effect=lambda context_id, context_rev, callback, deadline: callback(
+            {"_rev": "latest_rev_value"}
+        ))
+
+        target.get_context(self.handler(None), Mock())
+        target.get_context(self.handler(None), Mock())
+        target.get_context(self.handler("latest_rev_value"), Mock())
+
+        self.assertEqual(2, target.fetch_context.call_count)
@@ -0,0 +1,119 @@
+from datetime import datetime
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from api.logic.context_messages import ContextMessages as Target
+from api.metrics import metrics
+
+
+class put(TestCase):
+    def test_in_order(self):
+        context = Mock()
+        target = Target(context)
+        now = datetime(2015, 1, 1)
+
+        target.put("context_id", 0, "first", now=now)
+        target.put("context_id", 0, "second", now=now)
+        target.put("other_context_id", 0, "other", now=now)
+
+        self.assertListEqual(
+            ["first", "other"],
+            [x[0][2] for x in context.post_context_message.call_args_list]
+        )
+        self.assertEqual(now, context.post_context_message.call_args_list[0][1]["now"])
+
+        target.send_callback(Mock(error=None), "context_id")
+
+        self.assertListEqual(
+            ["first", "other", "second"],
+            [x[0][2] for x in context.post_context_message.call_args_list]
+        )
+        target.send_callback(Mock(error=None), "context_id")
+        self.assertListEqual(["other_context_id"], list(target._queues))
+
+    def test_full(self):
+        target = Target(Mock(), max_size=1)
+
+        self.assertTrue(target.put("context_id", 0, "first"))
+        self.assertFalse(target.put("context_id", 0, "second"))
+        self.assertEqual(1, len(target))
+
+
+class send_callback(TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_callback(self):
+        context = Mock()
+        target = Target(context)
+        callback = Mock()
+        target.put("context_id", 1, "user", callback=callback, return_context=True)
+        target.put("context_id", 0, "reply")
+
+        self.assertTrue(context.post_context_message.call_args_list[0][1]["return_context"])
+        response = Mock(error=None)
+        target.send_callback(response, "context_id")
+
+        callback.assert_called_once_with(response)
+        self.assertEqual("reply", context.post_context_message.call_args_list[1][0][2])
+        self.assertFalse(context.post_context_message.call_args_list[1][1]["return_context"])
+
+    def test_retry_before_next(self):
+        context = Mock()
+        target = Target(context, max_attempts=2, retry_delay=0.5)
+        target.put("context_id", 0, "first")
+        target.put("context_id", 0, "second")
+        io_loop = Mock()
+
+        with patch("api.logic.context_messages.IOLoop.current", Mock(return_value=io_loop)):
+            target.send_callback(Mock(error="HTTP 500"), "context_id")
+
+        io_loop.call_later.assert_called_once_with(0.5, target.retry, "context_id")
+        self.assertEqual(1, context.post_context_message.call_count)
+        self.assertEqual(2, len(target))
+        self.assertEqual(1, metrics.counters["context_messages.retried"])
+
+        target.send_callback(Mock(error="HTTP 500"), "context_id")
+
+        self.assertEqual(1, metrics.counters["context_messages.dropped"])
+        self.assertEqual(2, context.post_context_message.call_count)
+        self.assertEqual("second", context.post_context_message.call_args_list[1][0][2])
+
+
+class stop(TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_sends_retries_now(self):
+        context = Mock()
+        target = Target(context, max_attempts=3)
+        target.put("context_id", 0, "first")
+        target.put("context_id", 0, "second")
+        io_loop = Mock()
+        with patch("api.logic.context_messages.IOLoop.current", Mock(return_value=io_loop)):
+            target.send_callback(Mock(error="HTTP 500"), "context_id")
+            callback = Mock()
+
+            target.stop(callback)
+
+        io_loop.remove_timeout.assert_called_once_with(io_loop.call_later.return_value)
+        self.assertEqual(2, context.post_context_message.call_count)
+        callback.assert_not_called()
+
+        target.send_callback(Mock(error="HTTP 500"), "context_id")
+        self.assertEqual(1, metrics.counters["context_messages.dropped"])
+        self.assertEqual("second", context.post_context_message.call_args_list[2][0][2])
+        callback.assert_not_called()
+
+        target.send_callback(Mock(error=None), "context_id")
+        callback.assert_called_once_with()
+        self.assertEqual(0, len(target))
+
+    def test_empty(self):
+        target = Target(Mock())
+        callback = Mock()
+
+        target.stop(callback)
+
+        callback.assert_called_once_with()
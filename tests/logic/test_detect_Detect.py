@@ -0,0 +1,96 @@
+from unittest import TestCase
+
+from mock import Mock
+from tornado.escape import json_encode
+from tornado import gen, testing
+from tornado.testing import gen_test
+from tornado.web import Application, RequestHandler
+
+from api.logic.detect import Detect as Target
+from api.upstream import Upstream
+
+DETECTION = {"outcomes": [{"entities": []}], "non_detections": []}
+
+
+class StandInDetect(RequestHandler):
+    def initialize(self, calls, inline_capable):
+        self.calls = calls
+        self.inline_capable = inline_capable
+
+    def post(self):
+        self.calls.append("POST")
+        self.set_status(201)
+        self.set_header("Location", "/detection_id")
+        if self.inline_capable and self.request.headers.get("Prefer") == "return=representation":
+            self.finish(json_encode(DETECTION))
+        else:
+            self.finish()
+
+
+class StandInDetection(RequestHandler):
+    def initialize(self, calls):
+        self.calls = calls
+
+    def get(self):
+        self.calls.append("GET")
+        self.finish(json_encode(DETECTION))
+
+
+class get_detection(testing.AsyncHTTPTestCase):
+    inline_capable = True
+
+    def get_app(self):
+        self.calls = []
+        return Application([
+            (r"/", StandInDetect, dict(calls=self.calls, inline_capable=self.inline_capable)),
+            (r"/detection_id", StandInDetection, dict(calls=self.calls))
+        ])
+
+    @gen.coroutine
+    def detect(self, inline_response):
+        target = Target(Mock())
+        target.inline_response = inline_response
+        target.upstream = Upstream("detect", [self.get_url("")])
+        detection = yield gen.Task(
+            target.get_detection, "user_id", "application_id", "session_id", "en_GB", "black boots"
+        )
+        return detection
+
+    @gen_test
+    def test_inline(self):
+        detection = yield self.detect(True)
+
+        self.assertDictEqual(DETECTION, detection)
+        self.assertListEqual(["POST"], self.calls)
+
+    @gen_test
+    def test_location(self):
+        detection = yield self.detect(False)
+
+        self.assertDictEqual(DETECTION, detection)
+        self.assertListEqual(["POST", "GET"], self.calls)
+
+
+class get_detection_empty_body(get_detection):
+    inline_capable = False
+
+    @gen_test
+    def test_inline(self):
+        detection = yield self.detect(True)
+
+        self.assertDictEqual(DETECTION, detection)
+        self.assertListEqual(["POST", "GET"], self.calls)
+
+
+class post_detect_callback(TestCase):
+    def test_error(self):
+        target = Target(Mock())
+        target.get_detect = Mock()
+        callback = Mock()
+        response = Mock()
+        response.error = "error_value"
+
+        target.post_detect_callback(response, callback)
+
+        callback.assert_called_once_with(None)
+        target.get_detect.assert_not_called()
@@ -0,0 +1,176 @@
+import json
+from unittest import TestCase
+
+from mock import Mock
+
+from api.logic.feedback import FeedbackQueue as Target
+from api.metrics import metrics
+
+
+class put(TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_coalesce(self):
+        target = Target(max_size=10, batch_size=10, bulk=True)
+
+        self.assertTrue(target.put("/context_id/feedback/", {"product_id": "1", "user_id": None}, {"a": 1}))
+        self.assertTrue(target.put("/context_id/feedback/", {"product_id": "1"}, {"a": 1}))
+        self.assertTrue(target.put("/context_id/feedback/", {"product_id": "2"}, {"a": 1}))
+
+        self.assertEqual(2, len(target))
+        self.assertListEqual([2, 1], [x["count"] for x in target._pending.values()])
+        self.assertEqual(1, metrics.counters["feedback.coalesced"])
+
+    def test_not_coalesced_without_bulk(self):
+        target = Target(max_size=10, batch_size=10, bulk=False)
+
+        target.put("/context_id/feedback/", {"product_id": "1"})
+        target.put("/context_id/feedback/", {"product_id": "1"})
+
+        self.assertListEqual([1, 1], [x["count"] for x in target._pending.values()])
+
+    def test_full(self):
+        target = Target(max_size=1, batch_size=10)
+
+        self.assertTrue(target.put("/feedback", {"product_id": "1"}))
+        self.assertFalse(target.put("/feedback", {"product_id": "2"}))
+
+        self.assertEqual(1, len(target))
+        self.assertEqual(1, metrics.counters["feedback.dropped"])
+
+    def test_flush_on_batch_size(self):
+        target = Target(max_size=10, batch_size=2, bulk=True)
+        target.send = Mock()
+
+        target.put("/feedback", {"product_id": "1"})
+        target.send.assert_not_called()
+        target.put("/feedback", {"product_id": "2"})
+
+        self.assertEqual(1, target.send.call_count)
+        self.assertEqual(2, len(target.send.call_args[0][0]))
+        self.assertEqual(0, len(target))
+
+
+class request(TestCase):
+    def test_bulk(self):
+        target = Target(bulk=True)
+        target.put("/feedback", {"product_id": "1"}, {"meta_data": {"a": 1}})
+        target.put("/feedback", {"product_id": "1"}, {"meta_data": {"a": 1}})
+
+        path, body = target.request(list(target._pending.items()))
+
+        self.assertEqual("/feedback/bulk", path)
+        self.assertDictEqual(
+            {
+                "feedback": [
+                    {"path": "/feedback", "params": {"product_id": "1"}, "body": {"meta_data": {"a": 1}}, "count": 2}
+                ]
+            },
+            json.loads(body)
+        )
+
+    def test_single(self):
+        target = Target(bulk=False)
+        target.put("/context_id/feedback/", {"type": "view", "product_id": "1", "user_id": None})
+
+        path, body = target.request(list(target._pending.items()))
+
+        self.assertEqual("/context_id/feedback/?product_id=1&type=view", path)
+        self.assertEqual("{}", body)
+
+
+class send_callback(TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_sent(self):
+        target = Target(bulk=True)
+        target.put("/feedback", {"product_id": "1"})
+        target.put("/feedback", {"product_id": "1"})
+        batch = list(target._pending.items())
+        target._pending.clear()
+        target._in_flight = 1
+
+        target.send_callback(Mock(error=None, request_time=0.01), batch)
+
+        self.assertEqual(2, metrics.counters["feedback.sent"])
+        self.assertEqual(0, target._in_flight)
+
+    def test_retry(self):
+        target = Target(max_attempts=2)
+        target.put("/feedback", {"product_id": "1"})
+        batch = list(target._pending.items())
+        target._pending.clear()
+        target._in_flight = 2
+
+        target.send_callback(Mock(error="HTTP 500", request_time=0.01), batch)
+        self.assertEqual(1, len(target))
+
+        target._pending.clear()
+        target.send_callback(Mock(error="HTTP 500", request_time=0.01), batch)
+        self.assertEqual(0, len(target))
+        self.assertEqual(1, metrics.counters["feedback.dropped"])
+
+
+class flush(TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_one_at_a_time(self):
+        target = Target(bulk=False)
+        target.upstream = Mock()
+        callback = Mock()
+        target.put("/context_id/feedback/", {"product_id": "1"}, None, callback)
+        target.put("/context_id/feedback/", {"product_id": "2"})
+
+        target.flush()
+        target.flush()
+
+        self.assertEqual(1, target.upstream.fetch.call_count)
+        self.assertEqual(1, len(target))
+
+        response = Mock(error=None, request_time=0.01, headers={"_rev": "rev_value"})
+        target.upstream.fetch.call_args[0][1](response)
+
+        callback.assert_called_once_with(response)
+        self.assertEqual(2, target.upstream.fetch.call_count)
+        self.assertEqual("/context_id/feedback/?product_id=2", target.upstream.fetch.call_args[0][0])
+        self.assertEqual(0, len(target))
+
+    def test_failure_waits(self):
+        target = Target(bulk=False, max_attempts=2)
+        target.upstream = Mock()
+        callback = Mock()
+        target.put("/context_id/feedback/", {"product_id": "1"}, None, callback)
+        target.flush()
+
+        target.upstream.fetch.call_args[0][1](Mock(error="HTTP 500", request_time=0.01))
+
+        callback.assert_not_called()
+        self.assertEqual(1, target.upstream.fetch.call_count)
+        self.assertEqual(1, len(target))
+
+
+class stop(TestCase):
+    def test_waits_for_in_flight(self):
+        target = Target()
+        target.send = Mock(side_effect=lambda batch: setattr(target, "_in_flight", target._in_flight + 1))
+        target.put("/feedback", {"product_id": "1"})
+        callback = Mock()
+
+        target.stop(callback)
+
+        self.assertEqual(1, target.send.call_count)
+        callback.assert_not_called()
+        target.send_callback(Mock(error="HTTP 500", request_time=0.01), target.send.call_args[0][0])
+        callback.assert_called_once_with()
+        self.assertEqual(0, len(target))
+
+    def test_empty(self):
+        target = Target()
+        callback = Mock()
+
+        target.stop(callback)
+
+        callback.assert_called_once_with()
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from api.logic.health import Health as Target
+
+
+class poll_callback(TestCase):
+    def test_ok(self):
+        target = Target(services={"detect": "detect_url"})
+        target._polling.add("detect")
+        now = datetime(2015, 1, 1)
+
+        target.poll_callback(Mock(error=None, body='{"status": "OK"}', request_time=0.012), "detect", now=now)
+
+        self.assertDictEqual(
+            {"key": "detect", "status": "OK", "checked": now, "latency": 0.012},
+            target.checks["detect"]
+        )
+        self.assertSetEqual(set(), target._polling)
+
+    def test_timeout(self):
+        target = Target(services={"detect": "detect_url"})
+        target._polling.add("detect")
+        now = datetime(2015, 1, 1)
+
+        target.poll_callback(
+            Mock(error="HTTP 599: Timeout", code=599, reason="Unknown", request_time=2.0), "detect", now=now
+        )
+
+        self.assertDictEqual(
+            {"key": "detect", "status": "TIMEOUT", "checked": now, "latency": 2.0, "error": "HTTP 599: Timeout"},
+            target.checks["detect"]
+        )
+        self.assertSetEqual(set(), target._polling)
+
+
+class services_status(TestCase):
+    def test_not_checked(self):
+        target = Target(services={"detect": "detect_url"})
+
+        actual = target.services_status(now=datetime(2015, 1, 1))
+
+        self.assertListEqual([{"key": "detect", "status": "UNKNOWN"}], actual)
+
+    def test_age(self):
+        target = Target(services={"detect": "detect_url"}, interval=5, timeout=2)
+        checked = datetime(2015, 1, 1)
+        target.checks["detect"] = {"key": "detect", "status": "OK", "checked": checked, "latency": 0.0123}
+
+        actual = target.services_status(now=checked + timedelta(seconds=3))
+
+        self.assertListEqual([{"key": "detect", "status": "OK", "age": 3.0, "latency": 0.012}], actual)
+
+    def test_stale(self):
+        target = Target(services={"detect": "detect_url"}, interval=5, timeout=2)
+        checked = datetime(2015, 1, 1)
+        target.checks["detect"] = {"key": "detect", "status": "OK", "checked": checked, "latency": 0.01}
+
+        actual = target.services_status(now=checked + timedelta(seconds=60))
+
+        self.assertEqual("STALE", actual[0]["status"])
+
+
+class poll(TestCase):
+    def test_skip_in_flight(self):
+        target = Target(services={"detect": "detect_url", "suggest": "suggest_url"})
+        target._polling.add("detect")
+        fetch = Mock()
+
+        with patch("api.logic.health.AsyncHTTPClient", Mock(return_value=Mock(fetch=fetch))):
+            target.poll()
+
+        self.assertEqual(1, fetch.call_count)
+        self.assertEqual("suggest_url/status", fetch.call_args[0][0].url)
+        self.assertSetEqual({"detect", "suggest"}, target._polling)
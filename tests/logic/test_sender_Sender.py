@@ -1,7 +1,8 @@
 from unittest import TestCase
 
-from mock import Mock
+from mock import ANY, Mock, patch
 
+from api.connections import Connections
 from api.logic.sender import Sender as Target
 
 __author__ = 'robdefeo'
@@ -47,9 +48,9 @@ class write_thinking_message(TestCase):
 class write_jemboo_response_message(TestCase):
     def test_regular(self):
         target = Target("client_handlers_value")
-        target.post_suggest_callback = Mock()
+        target.write_to_context_handlers = Mock()
 
-        target.context = Mock()
+        target.context_messages = Mock()
         handler = Mock()
         handler.context_id = "context_id_value"
 
@@ -62,9 +63,62 @@ class write_jemboo_response_message(TestCase):
             }
         )
 
-        self.assertEqual(1, target.context.post_context_message.call_count)
-        self.assertEqual("context_id_value", target.context.post_context_message.call_args_list[0][0][0])
-        self.assertEqual(0, target.context.post_context_message.call_args_list[0][0][1])
-        self.assertEqual("display_text_value", target.context.post_context_message.call_args_list[0][0][2])
+        self.assertEqual(1, target.write_to_context_handlers.call_count)
+        self.assertEqual(handler, target.write_to_context_handlers.call_args_list[0][0][0])
+        self.assertDictEqual(
+            {"type": "jemboo_chat_response", "direction": 0, "display_text": "display_text_value"},
+            target.write_to_context_handlers.call_args_list[0][0][1]
+        )
+        target.context_messages.put.assert_called_once_with("context_id_value", 0, "display_text_value")
+
 
-        # self.assertEqual(1, target.post_suggest_callback.call_count)
+class write_to_context_handlers(TestCase):
+    def test_encoded_once(self):
+        first = Mock(id="first")
+        second = Mock(id="second")
+        client_handlers = Connections()
+        client_handlers.add("context_id_value", first)
+        client_handlers.add("context_id_value", second)
+        target = Target(client_handlers)
+        handler = Mock()
+        handler.context_id = "context_id_value"
+
+        with patch("api.logic.sender.codec.dumps", Mock(return_value='{"type": "start_thinking"}')) as dumps:
+            target.write_to_context_handlers(handler, {"type": "start_thinking"})
+
+        dumps.assert_called_once_with({"type": "start_thinking"})
+        first.write_message.assert_called_once_with(
+            '{"type": "start_thinking"}', message_type="start_thinking", suggest_id=None
+        )
+        second.write_message.assert_called_once_with(
+            '{"type": "start_thinking"}', message_type="start_thinking", suggest_id=None
+        )
+
+    def test_published(self):
+        bus = Mock()
+        target = Target(Connections(), bus)
+        handler = Mock()
+        handler.context_id = "context_id_value"
+
+        target.write_to_context_handlers(handler, {"type": "new_suggestion", "suggest_id": "suggest_id_value"})
+
+        bus.publish.assert_called_once_with(
+            "context_id_value", ANY, "new_suggestion", "suggest_id_value"
+        )
+        self.assertEqual(0, len(target._client_handlers))
+
+
+class on_bus_messages(TestCase):
+    def test(self):
+        first = Mock(id="first")
+        client_handlers = Connections()
+        client_handlers.add("context_id_value", first)
+        target = Target(client_handlers)
+
+        target.on_bus_messages("context_id_value", [['{"type": "start_thinking"}', "start_thinking", None]])
+        target.on_bus_messages("other_context_id", [['{"type": "start_thinking"}', "start_thinking", None]])
+
+        first.write_message.assert_called_once_with(
+            '{"type": "start_thinking"}', message_type="start_thinking", suggest_id=None
+        )
+        self.assertNotIn("other_context_id", target._client_handlers)
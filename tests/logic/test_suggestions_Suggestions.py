@@ -161,3 +161,73 @@ class fill_suggestions(TestCase):
         self.assertEqual('_id_value_2', content.get.call_args_list[1][0][0])
 
         self.assertEqual(0, favorite_cache.get.call_count)
+
+
+class get_page(TestCase):
+    def handler(self):
+        handler = Mock()
+        handler.context_id = "context_id_value"
+        handler.page_size = 20
+        return handler
+
+    def test_cached_after_fetch(self):
+        target = Target(Mock(), Mock(), None)
+        target.fetch_page = Mock(side_effect=lambda handler, suggest_id, offset, callback, deadline: callback(
+            ("items_response", "20")
+        ))
+        callback = Mock()
+
+        target.get_page(self.handler(), "suggest_id_value", 0, callback)
+        target.get_page(self.handler(), "suggest_id_value", 0, callback)
+
+        self.assertEqual(1, target.fetch_page.call_count)
+        self.assertEqual(2, callback.call_count)
+        callback.assert_called_with("items_response", "20")
+
+    def test_failed(self):
+        target = Target(Mock(), Mock(), None)
+        target.fetch_page = Mock(side_effect=lambda handler, suggest_id, offset, callback, deadline: callback(None))
+        callback = Mock()
+
+        target.get_page(self.handler(), "suggest_id_value", 0, callback)
+
+        callback.assert_called_once_with(None, None)
+
+    def test_remove_context_pages(self):
+        target = Target(Mock(), Mock(), None)
+        target.fetch_page = Mock(side_effect=lambda handler, suggest_id, offset, callback, deadline: callback(
+            ("items_response", "20")
+        ))
+
+        target.get_page(self.handler(), "suggest_id_value", 0, Mock())
+        target.remove_context_pages("context_id_value")
+        target.get_page(self.handler(), "suggest_id_value", 0, Mock())
+
+        self.assertEqual(2, target.fetch_page.call_count)
+
+
+class prefetch_page(TestCase):
+    def test_regular(self):
+        product_content = Mock()
+        target = Target(product_content, Mock(), None)
+        target.prefetch_next_page = True
+        target.fetch_page = Mock(side_effect=lambda handler, suggest_id, offset, callback, deadline: callback(
+            ({"items": [{"_id": "product_id_1"}, {"_id": "product_id_2"}]}, "40")
+        ))
+        handler = Mock()
+        handler.page_size = 20
+
+        target.prefetch_page(handler, "suggest_id_value", 0, "20")
+
+        self.assertEqual("20", target.fetch_page.call_args_list[0][0][2])
+        product_content.prefetch.assert_called_once_with(["product_id_1", "product_id_2"])
+
+    def test_last_page(self):
+        target = Target(Mock(), Mock(), None)
+        target.prefetch_next_page = True
+        target.fetch_page = Mock()
+
+        target.prefetch_page(Mock(), "suggest_id_value", 20, "20")
+        target.prefetch_page(Mock(), "suggest_id_value", 20, None)
+
+        target.fetch_page.assert_not_called()
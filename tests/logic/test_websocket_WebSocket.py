@@ -1,7 +1,9 @@
+import json
 from unittest import TestCase
 
-from mock import Mock, MagicMock
+from mock import Mock, MagicMock, ANY
 
+from api.connections import Connections
 from api.logic.websocket import WebSocket as Target
 
 
@@ -22,7 +24,7 @@ class on_view_product_details_message(TestCase):
         favorites_cache = Mock()
         target = Target(product_content=product_content, client_handlers=client_handlers, user_info_cache=user_info_cache, favorites_cache=favorites_cache)
         target.post_context_feedback = Mock(
-            return_value="new_rev"
+            return_value=True
         )
 
         target.on_view_product_details_message(
@@ -44,8 +46,29 @@ class on_view_product_details_message(TestCase):
 
         self.assertEqual("context_id_value", handler.context_id)
         self.assertEqual("suggest_id_value", handler.suggest_id)
+        self.assertEqual("old_rev", handler.context_rev)
+
+        target.post_context_feedback.call_args_list[0][0][7](Mock(error=None, headers={"_rev": "new_rev"}))
         self.assertEqual("new_rev", handler.context_rev)
 
+    def test_failed(self):
+        handler = Mock(name="handler_value")
+        handler.context_rev = "old_rev"
+        target = Target(product_content=Mock(), client_handlers=Mock(), user_info_cache=Mock(), favorites_cache=Mock())
+
+        target.post_context_feedback_callback(handler, Mock(error="HTTP 500", headers={}))
+
+        self.assertEqual("old_rev", handler.context_rev)
+
+    def test_no_rev(self):
+        handler = Mock(name="handler_value")
+        handler.context_rev = "old_rev"
+        target = Target(product_content=Mock(), client_handlers=Mock(), user_info_cache=Mock(), favorites_cache=Mock())
+
+        target.post_context_feedback_callback(handler, Mock(error=None, headers={}))
+
+        self.assertIsNone(handler.context_rev)
+
 
 class on_message(TestCase):
     def test_no_message_type(self):
@@ -107,7 +130,7 @@ class on_message(TestCase):
             }
         )
 
-        target.new_message_handler.on_new_message.assert_called_once_with('handler_value', {'type': 'home_page_message'}, new_conversation=True)
+        target.new_message_handler.on_new_message.assert_called_once_with('handler_value', {'type': 'home_page_message'}, new_conversation=True, deadline=ANY)
 
         self.assertEqual(0, target.on_next_page_message.call_count)
         self.assertEqual(0, target.on_view_product_details_message.call_count)
@@ -129,7 +152,7 @@ class on_message(TestCase):
             }
         )
 
-        target.new_message_handler.on_new_message.assert_called_once_with('handler_value', {'type': 'new_message'}, new_conversation=False)
+        target.new_message_handler.on_new_message.assert_called_once_with('handler_value', {'type': 'new_message'}, new_conversation=False, deadline=ANY)
 
         self.assertEqual(0, target.on_next_page_message.call_count)
         self.assertEqual(0, target.on_view_product_details_message.call_count)
@@ -192,68 +215,82 @@ class on_message(TestCase):
             target.on_view_product_details_message.call_args_list[0][0][1]
         )
 
+    def test_busy(self):
+        target = Target(product_content=Mock(), client_handlers=Mock(), user_info_cache=Mock(), favorites_cache=Mock())
+        target.next_page_message_handler = Mock()
+        target.sender = Mock()
+        target.message_upstreams = {"next_page": [Mock(busy=Mock(return_value=True))]}
+
+        target.on_message("handler_value", {"type": "next_page"})
+
+        self.assertEqual(0, target.next_page_message_handler.on_next_page_message.call_count)
+        target.sender.write_busy_message.assert_called_once_with("handler_value", "next_page")
+
 
 class on_close(TestCase):
     def test_found(self):
-        client_handlers = {
-            "existing_context_id": {
-                "existing_handler_id": "existing_handler"
-            },
-            "random_context_id": {
-                "random_handler_id": "random_handler"
-            }
-        }
-        product_content = Mock()
-        user_info_cache = Mock()
-        favorites_cache = Mock()
-        target = Target(
-            client_handlers=client_handlers,
-            product_content=product_content,
-            user_info_cache=user_info_cache,
-            favorites_cache=favorites_cache
-
-        )
         handler = Mock(name="new_client_handler")
         handler.context_id = "existing_context_id"
         handler.id = "existing_handler_id"
+        random_handler = Mock(id="random_handler_id")
+        client_handlers = Connections()
+        client_handlers.add("existing_context_id", handler)
+        client_handlers.add("random_context_id", random_handler)
+        target = Target(
+            client_handlers=client_handlers,
+            product_content=Mock(),
+            user_info_cache=Mock(),
+            favorites_cache=Mock()
+        )
+        target.suggestions = Mock()
+
         target.on_close(handler)
 
-        self.assertDictEqual(
-            {
-                'existing_context_id': {},
-                'random_context_id': {'random_handler_id': 'random_handler'}
-            },
-            client_handlers
+        self.assertNotIn("existing_context_id", client_handlers)
+        self.assertListEqual([random_handler], client_handlers.handlers("random_context_id"))
+        target.suggestions.remove_context_pages.assert_called_once_with("existing_context_id")
+
+    def test_other_handlers_left(self):
+        handler = Mock(id="existing_handler_id", context_id="context_id")
+        other_handler = Mock(id="other_handler_id")
+        client_handlers = Connections()
+        client_handlers.add("context_id", handler)
+        client_handlers.add("context_id", other_handler)
+        target = Target(
+            client_handlers=client_handlers,
+            product_content=Mock(),
+            user_info_cache=Mock(),
+            favorites_cache=Mock()
         )
+        target.suggestions = Mock()
+
+        target.on_close(handler)
+
+        self.assertListEqual([other_handler], client_handlers.handlers("context_id"))
+        self.assertEqual(0, target.suggestions.remove_context_pages.call_count)
 
     def test_not_found(self):
-        client_handlers = {
-            "random_id": "other_handler"
-        }
-        product_content = Mock()
-        user_info_cache = Mock()
-        favorites_cache = Mock()
+        other_handler = Mock(id="other_handler_id")
+        client_handlers = Connections()
+        client_handlers.add("random_id", other_handler)
         target = Target(
             client_handlers=client_handlers,
-            product_content=product_content,
-            user_info_cache=user_info_cache,
-            favorites_cache=favorites_cache
-
+            product_content=Mock(),
+            user_info_cache=Mock(),
+            favorites_cache=Mock()
         )
         handler = Mock(name="new_client_handler")
         handler.id = "existing_id"
         target.on_close(handler)
 
-        self.assertDictEqual(
-            {'random_id': 'other_handler'},
-            client_handlers
-        )
+        self.assertListEqual([other_handler], client_handlers.handlers("random_id"))
+        self.assertEqual(1, len(client_handlers))
 
 
 class open_Tests(TestCase):
     def test_context_id_not_None(self):
         product_content = Mock()
-        client_handlers = {}
+        client_handlers = Connections()
         user_info_cache = Mock()
         favorites_cache = Mock()
         target = Target(product_content=product_content, client_handlers=client_handlers, user_info_cache=user_info_cache, favorites_cache=favorites_cache)
@@ -274,12 +311,12 @@ class open_Tests(TestCase):
         self.assertEqual(1, handler.write_message.call_count)
         self.assertDictEqual(
             {'context_id': 'context_id_value', 'type': 'connection_opened'},
-            handler.write_message.call_args_list[0][0][0]
+            json.loads(handler.write_message.call_args_list[0][0][0])
         )
 
     def test_context_id_None(self):
         product_content = Mock()
-        client_handlers = {}
+        client_handlers = Connections()
         user_info_cache = Mock()
         favorites_cache = Mock()
         target = Target(product_content=product_content, client_handlers=client_handlers, user_info_cache=user_info_cache, favorites_cache=favorites_cache)
@@ -311,13 +348,13 @@ class open_Tests(TestCase):
         self.assertEqual(1, handler.write_message.call_count)
         self.assertDictEqual(
             {'context_id': 'context_id_value', 'type': 'connection_opened'},
-            handler.write_message.call_args_list[0][0][0]
+            json.loads(handler.write_message.call_args_list[0][0][0])
         )
 
     def test_new_id(self):
-        client_handlers = {
-            "different_id": "existing_handler"
-        }
+        existing_handler = Mock(id="existing_handler_id")
+        client_handlers = Connections()
+        client_handlers.add("different_id", existing_handler)
         product_content = Mock()
         user_info_cache = Mock()
         favorites_cache = Mock()
@@ -333,10 +370,8 @@ class open_Tests(TestCase):
 
         target.open(handler)
 
-        self.assertTrue("context_id" in client_handlers)
-        self.assertTrue("new_id" in client_handlers["context_id"])
-        self.assertEqual("new_id", client_handlers["context_id"]["new_id"].id)
-        self.assertEqual("existing_handler", client_handlers["different_id"])
+        self.assertListEqual([handler], client_handlers.handlers("context_id"))
+        self.assertListEqual([existing_handler], client_handlers.handlers("different_id"))
 
         self.assertEqual("context_id", handler.context_id)
         self.assertIsNone(handler._context)
@@ -346,13 +381,11 @@ class open_Tests(TestCase):
         self.assertEqual(1, handler.write_message.call_count)
         self.assertDictEqual(
             {'context_id': 'context_id', 'type': 'connection_opened'},
-            handler.write_message.call_args_list[0][0][0]
+            json.loads(handler.write_message.call_args_list[0][0][0])
         )
 
     def test_existing_id(self):
-        client_handlers = {
-            "existing_id": "existing_handler"
-        }
+        client_handlers = Connections()
         product_content = Mock()
         user_info_cache = Mock()
         favorites_cache = Mock()
@@ -368,10 +401,12 @@ class open_Tests(TestCase):
         handler.context_id = "context_id"
         handler._context = None
 
+        client_handlers.add("context_id", handler)
+
         target.open(handler)
 
-        self.assertTrue("existing_id" in client_handlers)
-        self.assertEqual("existing_handler", client_handlers["existing_id"])
+        self.assertListEqual([handler], client_handlers.handlers("context_id"))
+        self.assertEqual(1, client_handlers.sockets)
         self.assertEqual("context_id", handler.context_id)
         self.assertIsNone(handler._context)
 
@@ -379,5 +414,13 @@ class open_Tests(TestCase):
 
         self.assertEqual(1, handler.write_message.call_count)
         self.assertDictEqual(
-            {'context_id': 'context_id', 'type': 'connection_opened'}, handler.write_message.call_args_list[0][0][0]
+            {'context_id': 'context_id', 'type': 'connection_opened'}, json.loads(handler.write_message.call_args_list[0][0][0])
         )
+
+
+class init(TestCase):
+    def test_shared_context(self):
+        target = Target(product_content=Mock(), client_handlers=Mock(), user_info_cache=Mock(), favorites_cache=Mock())
+
+        self.assertIs(target.context, target.sender.context)
+        self.assertIs(target.context, target.sender.context_messages.context)
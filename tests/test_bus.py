@@ -0,0 +1,86 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+from tornado import gen, testing
+
+from api.bus import Broker, InMemoryBus as Target, SocketBus
+
+
+class publish(TestCase):
+    @patch("api.bus.IOLoop")
+    def test_batched(self, io_loop):
+        hub = []
+        target = Target(hub)
+        other = Target(hub)
+        subscriber = Mock()
+        own_subscriber = Mock()
+        other.subscribe(subscriber)
+        target.subscribe(own_subscriber)
+
+        target.publish("context_id", '{"type":"a"}', "a")
+        target.publish("other_context_id", '{"type":"b"}', "b")
+        target.publish("context_id", '{"type":"c"}', "c", "suggest_id")
+
+        self.assertEqual(1, io_loop.current.return_value.add_callback.call_count)
+        subscriber.assert_not_called()
+
+        target.flush()
+
+        self.assertListEqual(
+            [
+                (("context_id", [['{"type":"a"}', "a", None], ['{"type":"c"}', "c", "suggest_id"]]),),
+                (("other_context_id", [['{"type":"b"}', "b", None]]),)
+            ],
+            subscriber.call_args_list
+        )
+        own_subscriber.assert_not_called()
+
+    @patch("api.bus.IOLoop")
+    def test_subscriber_error(self, io_loop):
+        hub = []
+        target = Target(hub)
+        other = Target(hub)
+        subscriber = Mock()
+        other.subscribe(Mock(side_effect=Exception()))
+        other.subscribe(subscriber)
+
+        target.publish("context_id", "{}", "a")
+        target.flush()
+
+        self.assertEqual(1, subscriber.call_count)
+
+    @patch("api.bus.IOLoop")
+    def test_no_peers(self, io_loop):
+        target = Target()
+
+        target.publish("context_id", "{}", "a")
+
+        io_loop.current.return_value.add_callback.assert_not_called()
+        self.assertEqual(0, len(target._pending))
+
+
+class SocketBus_broker(testing.AsyncTestCase):
+    @testing.gen_test
+    def test(self):
+        broker = Broker()
+        sock, port = testing.bind_unused_port()
+        broker.add_socket(sock)
+        first = SocketBus("127.0.0.1:%s" % port)
+        second = SocketBus("127.0.0.1:%s" % port)
+        received = []
+        second.subscribe(lambda context_id, messages: received.append((context_id, messages)))
+        first.start()
+        second.start()
+        while len(broker.streams) < 2:
+            yield gen.sleep(0.01)
+
+        # a batch that cannot be read is skipped, the connection stays up
+        first.send("not json")
+        first.publish("context_id", '{"type":"a"}', "a")
+        while not received:
+            yield gen.sleep(0.01)
+
+        self.assertListEqual([("context_id", [['{"type":"a"}', "a", None]])], received)
+        first.stream.close()
+        second.stream.close()
+        broker.stop()
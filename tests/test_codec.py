@@ -0,0 +1,44 @@
+from datetime import datetime
+from unittest import TestCase
+
+from bson import ObjectId, json_util
+
+from api import codec
+
+
+class bson_loads(TestCase):
+    def test_same_as_json_util(self):
+        body = '{"items": [{"_id": {"$oid": "5626a0c1e4b0f1b5b4d7a1c3"}, "index": 0, "score": 1.5}], ' \
+               '"created": {"$date": 1420113600123}, "count": {"$numberLong": "5"}, "text": "black boots"}'
+
+        self.assertEqual(json_util.loads(body), codec.bson_loads(body.encode("utf-8")))
+
+    def test_object_id(self):
+        actual = codec.bson_loads(b'{"_id": {"$oid": "5626a0c1e4b0f1b5b4d7a1c3"}}')
+
+        self.assertEqual(ObjectId("5626a0c1e4b0f1b5b4d7a1c3"), actual["_id"])
+
+
+class bson_dumps(TestCase):
+    def test_same_as_json_util(self):
+        value = {
+            "_id": ObjectId("5626a0c1e4b0f1b5b4d7a1c3"),
+            "created": datetime(2015, 1, 1, 12, 0, 0, 123000),
+            "favorites": [ObjectId("5626a0c1e4b0f1b5b4d7a1c4")],
+            "text": "black boots"
+        }
+
+        self.assertEqual(json_util.loads(json_util.dumps(value)), json_util.loads(codec.bson_dumps(value)))
+        self.assertEqual(json_util.loads(codec.bson_dumps(value)), codec.bson_loads(codec.bson_dumps(value)))
+
+
+class loads(TestCase):
+    def test_bytes_and_str(self):
+        self.assertDictEqual({"type": "next_page", "offset": 20}, codec.loads(b'{"type": "next_page", "offset": 20}'))
+        self.assertDictEqual({"type": "next_page", "offset": 20}, codec.loads('{"type": "next_page", "offset": 20}'))
+
+    def test_round_trip(self):
+        value = {"type": "suggestion_items", "items": [{"title": "café", "score": 1.5}], "next_offset": None}
+
+        self.assertDictEqual(value, codec.loads(codec.dumps(value)))
+        self.assertIsInstance(codec.dumps(value), str)
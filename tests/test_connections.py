@@ -0,0 +1,89 @@
+import gc
+from unittest import TestCase
+
+from mock import Mock
+
+from api.connections import Connections as Target, IdleReaper
+from api.metrics import metrics
+
+
+class Handler:
+    def __init__(self, _id):
+        self.id = _id
+
+
+class add(TestCase):
+    def test(self):
+        target = Target()
+        first = Handler("first")
+        second = Handler("second")
+
+        self.assertTrue(target.add("context_id", first))
+        self.assertTrue(target.add("context_id", second))
+        self.assertFalse(target.add("context_id", first))
+
+        self.assertListEqual([first, second], target.handlers("context_id"))
+        self.assertEqual(2, target.sockets)
+        self.assertEqual(1, len(target))
+        self.assertEqual(2, metrics.gauges["websocket.sockets"])
+        self.assertEqual(1, metrics.gauges["websocket.contexts"])
+
+
+class remove(TestCase):
+    def test_last_removes_context(self):
+        target = Target()
+        first = Handler("first")
+        second = Handler("second")
+        target.add("context_id", first)
+        target.add("context_id", second)
+
+        self.assertTrue(target.remove("context_id", first))
+        self.assertIn("context_id", target)
+        self.assertTrue(target.remove("context_id", second))
+
+        self.assertNotIn("context_id", target)
+        self.assertEqual(0, target.sockets)
+        self.assertListEqual([], target.handlers("context_id"))
+
+    def test_not_found(self):
+        target = Target()
+        handler = Handler("first")
+        target.add("context_id", handler)
+
+        self.assertFalse(target.remove("context_id", Handler("first")))
+        self.assertFalse(target.remove("other_context_id", Handler("first")))
+        self.assertEqual(1, target.sockets)
+
+    def test_collected(self):
+        target = Target()
+        target.add("context_id", Handler("first"))
+        gc.collect()
+
+        self.assertNotIn("context_id", target)
+        self.assertEqual(0, target.sockets)
+
+    def test_flat(self):
+        target = Target()
+        for x in range(1000):
+            handler = Mock(id=x)
+            target.add("context_%s" % x, handler)
+            target.remove("context_%s" % x, handler)
+
+        self.assertEqual(0, len(target._contexts))
+        self.assertEqual(0, target.sockets)
+
+
+class IdleReaper_reap(TestCase):
+    def test(self):
+        connections = Target()
+        idle = Mock(id="idle", last_message=100.0)
+        active = Mock(id="active", last_message=1000.0)
+        connections.add("context_id", idle)
+        connections.add("context_id", active)
+        reaped = metrics.counters["websocket.reaped.idle"]
+
+        IdleReaper(connections, timeout=600).reap(now=1100.0)
+
+        idle.close.assert_called_once_with(1001, "idle")
+        self.assertEqual(0, active.close.call_count)
+        self.assertEqual(reaped + 1, metrics.counters["websocket.reaped.idle"])
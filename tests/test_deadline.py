@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from api.deadline import Deadline as Target
+
+
+class remaining(TestCase):
+    def test_regular(self):
+        target = Target(2.0, now=10.0)
+
+        self.assertEqual(1.5, target.remaining(10.5))
+        self.assertFalse(target.expired(10.5))
+        self.assertEqual(0.0, target.remaining(13.0))
+        self.assertTrue(target.expired(12.0))
+
+
+class request_kwargs(TestCase):
+    def test_regular(self):
+        target = Target(2.0, now=10.0)
+
+        actual = target.request_kwargs({"method": "GET", "headers": {"Prefer": "return=representation"}}, now=10.5)
+
+        self.assertDictEqual(
+            {
+                "method": "GET",
+                "connect_timeout": 1.5,
+                "request_timeout": 1.5,
+                "headers": {"Prefer": "return=representation", "X-Deadline-Remaining-Ms": "1500"}
+            },
+            actual
+        )
+
+    def test_shorter_timeout(self):
+        target = Target(2.0, now=10.0)
+
+        actual = target.request_kwargs({"request_timeout": 0.5, "headers": None}, now=10.0)
+
+        self.assertEqual(0.5, actual["request_timeout"])
+        self.assertEqual(2.0, actual["connect_timeout"])
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from api.metrics import Metrics as Target
+
+
+class snapshot(TestCase):
+    def test_regular(self):
+        target = Target()
+        target.incr("sent")
+        target.incr("sent", 2)
+        target.gauge("pending", 5)
+        target.observe("flush", 1.0)
+        target.observe("flush", 3.0)
+
+        self.assertDictEqual(
+            {
+                "counters": {"sent": 3},
+                "gauges": {"pending": 5},
+                "observations": {"flush": {"count": 2, "sum": 4.0, "max": 3.0, "mean": 2.0}}
+            },
+            target.snapshot()
+        )
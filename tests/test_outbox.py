@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from mock import Mock
+from tornado.websocket import WebSocketClosedError
+
+from api.outbox import Outbox as Target
+
+
+class put(TestCase):
+    def setUp(self):
+        self.futures = []
+        self.write = Mock(side_effect=self.future)
+        self.close = Mock()
+
+    def future(self, message, binary):
+        future = Mock()
+        self.futures.append(future)
+        return future
+
+    def flush(self, future):
+        future.add_done_callback.call_args[0][0](future)
+
+    def written(self):
+        return [x[0][0] for x in self.write.call_args_list]
+
+    def test_queued_until_flushed(self):
+        target = Target(self.write, self.close)
+
+        target.put("first")
+        target.put("second")
+        target.put("third")
+
+        self.assertListEqual(["first"], self.written())
+        self.assertEqual(2, len(target))
+
+        self.flush(self.futures[0])
+
+        self.assertListEqual(["first", "second", "third"], self.written())
+        self.assertEqual(0, len(target))
+        self.assertEqual(0, target.queued_bytes)
+
+    def test_coalesce_start_thinking(self):
+        target = Target(self.write, self.close)
+
+        target.put("first")
+        target.put("thinking", message_type="start_thinking")
+        target.put("thinking", message_type="start_thinking")
+
+        self.assertEqual(1, len(target))
+
+    def test_coalesce_suggestion_items(self):
+        target = Target(self.write, self.close)
+
+        target.put("first")
+        target.put("old items", message_type="suggestion_items", suggest_id="old")
+        target.put("new", message_type="new_suggestion", suggest_id="new")
+        target.put("new items", message_type="suggestion_items", suggest_id="new")
+        self.flush(self.futures[0])
+
+        self.assertListEqual(["first", "new", "new items"], self.written())
+
+    def test_slow_consumer_drops_items(self):
+        target = Target(self.write, self.close, max_bytes=10)
+
+        target.put("first")
+        target.put("items", message_type="suggestion_items", suggest_id="id")
+        target.put("chat")
+
+        self.assertListEqual(["chat"], [x["message"] for x in target._queue])
+        self.close.assert_not_called()
+
+    def test_slow_consumer_closed(self):
+        target = Target(self.write, self.close, max_bytes=10)
+
+        target.put("first")
+        target.put("second chat")
+
+        self.close.assert_called_once_with(1013, "slow consumer")
+        self.assertEqual(0, len(target))
+        target.put("third")
+        self.assertListEqual(["first"], self.written())
+
+    def test_closed(self):
+        self.write.side_effect = WebSocketClosedError()
+        target = Target(self.write, self.close)
+
+        target.put("first")
+        target.put("second")
+
+        self.assertEqual(1, self.write.call_count)
+        self.assertTrue(target.closed)
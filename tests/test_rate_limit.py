@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from mock import Mock
+
+from api.metrics import metrics
+from api.rate_limit import RateLimiter as Target
+
+
+class take(TestCase):
+    def handler(self, session_id="session_id_value") -> Mock:
+        return Mock(session_id=session_id, rate_buckets=None)
+
+    def test_burst_then_rate(self):
+        target = Target({"new_message": (1, 2)}, {})
+        handler = self.handler()
+
+        self.assertEqual(0, target.take(handler, "new_message", now=0.0))
+        self.assertEqual(0, target.take(handler, "new_message", now=0.0))
+        self.assertAlmostEqual(1.0, target.take(handler, "new_message", now=0.0))
+        self.assertAlmostEqual(0.5, target.take(handler, "new_message", now=0.5))
+        self.assertEqual(0, target.take(handler, "new_message", now=1.0))
+
+    def test_per_connection(self):
+        target = Target({"new_message": (1, 1)}, {})
+        first = self.handler()
+        second = self.handler()
+
+        self.assertEqual(0, target.take(first, "new_message", now=0.0))
+        self.assertEqual(0, target.take(second, "new_message", now=0.0))
+        self.assertGreater(target.take(first, "new_message", now=0.0), 0)
+
+    def test_per_session(self):
+        target = Target({"new_message": (1, 5)}, {"new_message": (1, 1)})
+        first = self.handler()
+        second = self.handler()
+        other_session = self.handler("other_session_id")
+
+        self.assertEqual(0, target.take(first, "new_message", now=0.0))
+        self.assertGreater(target.take(second, "new_message", now=0.0), 0)
+        self.assertEqual(0, target.take(other_session, "new_message", now=0.0))
+        # the connection's token is not taken when the session has none
+        self.assertEqual(5, second.rate_buckets["new_message"].tokens)
+
+    def test_unlimited_type(self):
+        target = Target({"new_message": (1, 1)}, {})
+        handler = self.handler()
+
+        for x in range(10):
+            self.assertEqual(0, target.take(handler, "view_product_details", now=0.0))
+        self.assertIsNone(handler.rate_buckets)
+
+    def test_counted(self):
+        target = Target({"next_page": (1, 1)}, {})
+        handler = self.handler()
+        rate_limited = metrics.counters["websocket.rate_limited.next_page"]
+
+        target.take(handler, "next_page", now=0.0)
+        target.take(handler, "next_page", now=0.0)
+
+        self.assertEqual(rate_limited + 1, metrics.counters["websocket.rate_limited.next_page"])
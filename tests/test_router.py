@@ -0,0 +1,229 @@
+from unittest import TestCase
+
+from tornado import gen, testing
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.tcpserver import TCPServer
+
+from api.router import HashRing as Target, Router, context_id, forwarded, session_id, status
+
+
+class node(TestCase):
+    def test_consistent(self):
+        target = Target(["a", "b", "c"])
+
+        self.assertEqual(target.node("context_id"), Target(["c", "a", "b"]).node("context_id"))
+        self.assertIsNone(Target().node("context_id"))
+
+    def test_balanced(self):
+        target = Target(["a", "b", "c", "d"])
+
+        counts = {}
+        for x in range(4000):
+            node = target.node("context_%s" % x)
+            counts[node] = counts.get(node, 0) + 1
+
+        self.assertTrue(all(800 < x < 1200 for x in counts.values()), counts)
+
+    def test_add_moves_keys_to_new_node_only(self):
+        keys = ["context_%s" % x for x in range(1000)]
+        target = Target(["a", "b", "c"])
+        before = {x: target.node(x) for x in keys}
+
+        target.add("d")
+
+        moved = [x for x in keys if target.node(x) != before[x]]
+        self.assertTrue(all(target.node(x) == "d" for x in moved))
+        self.assertTrue(150 < len(moved) < 350, len(moved))
+
+    def test_remove_falls_back_to_ranking(self):
+        target = Target(["a", "b", "c"])
+        ranked = target.ranked("context_id")
+
+        target.remove(ranked[0])
+
+        self.assertEqual(ranked[1], target.node("context_id"))
+
+
+class context_id_(TestCase):
+    def test(self):
+        self.assertEqual(
+            "5654b2ab0d9a9b1c0d7c0f7a",
+            context_id(b"GET /websocket?locale=en&context_id=5654b2ab0d9a9b1c0d7c0f7a HTTP/1.1\r\n")
+        )
+        self.assertIsNone(context_id(b"GET /websocket?locale=en HTTP/1.1\r\n"))
+        self.assertIsNone(context_id(b"\r\n"))
+
+
+class session_id_(TestCase):
+    def test(self):
+        self.assertEqual(
+            "5654b2ab0d9a9b1c0d7c0f7b",
+            session_id(
+                b"GET /websocket HTTP/1.1\r\nHost: a\r\n"
+                b"Cookie: application_id=1; session_id=5654b2ab0d9a9b1c0d7c0f7b\r\n\r\n"
+            )
+        )
+        self.assertIsNone(session_id(b"GET /websocket HTTP/1.1\r\nCookie: user_id=1\r\n\r\n"))
+        self.assertIsNone(session_id(b"GET /websocket HTTP/1.1\r\nnot a header\r\n\r\n"))
+
+
+class forwarded_(TestCase):
+    def test_added(self):
+        self.assertEqual(
+            b"GET / HTTP/1.1\r\nHost: a\r\nX-Forwarded-For: 10.0.0.1\r\nX-Real-Ip: 10.0.0.1\r\n"
+            b"Connection: close\r\n\r\n",
+            forwarded(b"GET / HTTP/1.1\r\nHost: a\r\n\r\n", "10.0.0.1")
+        )
+
+    def test_replaced(self):
+        self.assertEqual(
+            b"GET / HTTP/1.1\r\nHost: a\r\nX-Forwarded-For: 10.0.0.1\r\nX-Real-Ip: 10.0.0.1\r\n"
+            b"Connection: close\r\n\r\n",
+            forwarded(
+                b"GET / HTTP/1.1\r\nx-forwarded-for: 1.2.3.4\r\nHost: a\r\nX-Real-IP: 1.2.3.4\r\n"
+                b"Connection: keep-alive\r\n\r\n",
+                "10.0.0.1"
+            )
+        )
+
+    def test_upgrade(self):
+        self.assertEqual(
+            b"GET /websocket HTTP/1.1\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n"
+            b"X-Forwarded-For: 10.0.0.1\r\nX-Real-Ip: 10.0.0.1\r\n\r\n",
+            forwarded(
+                b"GET /websocket HTTP/1.1\r\nConnection: Upgrade\r\nX-Real-Ip: 1.2.3.4\r\nUpgrade: websocket\r\n\r\n",
+                "10.0.0.1"
+            )
+        )
+
+
+class status_(TestCase):
+    def test(self):
+        self.assertEqual(101, status(b"HTTP/1.1 101 Switching Protocols\r\n\r\n"))
+        self.assertIsNone(status(b"\r\n\r\n"))
+
+
+class Worker(TCPServer):
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        head = yield stream.read_until(b"\r\n\r\n")
+        yield stream.write(self.name.encode() + b" " + head)
+        stream.close()
+
+
+class Refusing(TCPServer):
+    """
+    refuses the upgrade and keeps the connection open for more requests
+    """
+    def __init__(self):
+        super().__init__()
+        self.heads = []
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        try:
+            while True:
+                head = yield stream.read_until(b"\r\n\r\n")
+                self.heads.append(head)
+                yield stream.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 3\r\n\r\nbad")
+        except StreamClosedError:
+            pass
+
+
+class Router_handle_stream(testing.AsyncTestCase):
+    def listen(self, server) -> str:
+        sock, port = testing.bind_unused_port()
+        server.add_socket(sock)
+        return "127.0.0.1:%s" % port
+
+    @gen.coroutine
+    def request(self, address: str, request_line: bytes) -> bytes:
+        host, port = address.split(":")
+        stream = yield TCPClient().connect(host, int(port))
+        yield stream.write(request_line)
+        response = yield stream.read_until_close()
+        return response
+
+    @testing.gen_test
+    def test(self):
+        workers = {}
+        for name in ["first", "second"]:
+            workers[self.listen(Worker(name))] = name
+        target = Router(list(workers))
+        address = self.listen(target)
+        request_line = b"GET /websocket?context_id=context_id_value HTTP/1.1\r\n"
+
+        response = yield self.request(address, request_line + b"\r\n")
+
+        self.assertEqual(
+            workers[target.ring.node("context_id_value")].encode() + b" " + request_line +
+            b"X-Forwarded-For: 127.0.0.1\r\nX-Real-Ip: 127.0.0.1\r\nConnection: close\r\n\r\n",
+            response
+        )
+
+    @testing.gen_test
+    def test_context_over_session(self):
+        workers = {}
+        for name in ["first", "second", "third"]:
+            workers[self.listen(Worker(name))] = name
+        target = Router(list(workers))
+        address = self.listen(target)
+        key = next(
+            x for x in ("session_%s" % i for i in range(100))
+            if target.ring.node(x) != target.ring.node("context_id_value")
+        )
+
+        response = yield self.request(
+            address,
+            b"GET /websocket?context_id=context_id_value HTTP/1.1\r\nCookie: session_id=%s\r\n\r\n" % key.encode()
+        )
+
+        self.assertTrue(response.startswith(workers[target.ring.node("context_id_value")].encode() + b" "), response)
+
+    @testing.gen_test
+    def test_session(self):
+        workers = {}
+        for name in ["first", "second", "third"]:
+            workers[self.listen(Worker(name))] = name
+        target = Router(list(workers))
+        address = self.listen(target)
+
+        response = yield self.request(
+            address, b"GET /websocket HTTP/1.1\r\nCookie: session_id=session_id_value\r\n\r\n"
+        )
+
+        self.assertTrue(response.startswith(workers[target.ring.node("session_id_value")].encode() + b" "), response)
+
+    @testing.gen_test
+    def test_upgrade_refused(self):
+        worker = Refusing()
+        target = Router([self.listen(worker)])
+        address = self.listen(target)
+
+        response = yield self.request(
+            address,
+            b"GET /websocket HTTP/1.1\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n\r\n"
+            b"GET / HTTP/1.1\r\nX-Real-Ip: 1.2.3.4\r\n\r\n"
+        )
+
+        self.assertEqual(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 3\r\n\r\nbad", response)
+        self.assertEqual(1, len(worker.heads))
+
+    @testing.gen_test
+    def test_worker_down(self):
+        sock, port = testing.bind_unused_port()
+        sock.close()
+        down = "127.0.0.1:%s" % port
+        up = self.listen(Worker("up"))
+        target = Router([down, up])
+        address = self.listen(target)
+        key = next(x for x in ("context_%s" % i for i in range(100)) if target.ring.node(x) == down)
+
+        response = yield self.request(address, b"GET /websocket?context_id=%s HTTP/1.1\r\n\r\n" % key.encode())
+
+        self.assertTrue(response.startswith(b"up "))
@@ -0,0 +1,257 @@
+import gzip
+from unittest import TestCase
+
+from datetime import datetime, timedelta
+
+from mock import Mock, patch
+
+from api.deadline import Deadline
+from api.upstream import body_request, Upstream, Limiter
+
+
+class body_request_Tests(TestCase):
+    def test_below_threshold(self):
+        with patch("api.upstream.UPSTREAM_GZIP_MIN_SIZE", 1024):
+            actual = body_request("http://suggest/", '{"context": {}}')
+
+        self.assertEqual("POST", actual.method)
+        self.assertEqual(b'{"context": {}}', actual.body)
+        self.assertNotIn("Content-Encoding", actual.headers)
+
+    def test_above_threshold(self):
+        body = '{"context": {"entities": [%s]}}' % ", ".join(['{"key": "boots"}'] * 100)
+        with patch("api.upstream.UPSTREAM_GZIP_MIN_SIZE", 1024):
+            actual = body_request("http://suggest/", body)
+
+        self.assertEqual("gzip", actual.headers["Content-Encoding"])
+        self.assertEqual(body.encode("utf-8"), gzip.decompress(actual.body))
+        self.assertLess(len(actual.body), len(body))
+
+    def test_disabled(self):
+        body = "x" * 4096
+        with patch("api.upstream.UPSTREAM_GZIP_MIN_SIZE", 0):
+            actual = body_request("http://suggest/", body)
+
+        self.assertNotIn("Content-Encoding", actual.headers)
+
+
+class choose(TestCase):
+    def test_least_outstanding(self):
+        target = Upstream("suggest", ["http://a", "http://b", "http://c"])
+        target.replicas[0].outstanding = 2
+        target.replicas[1].outstanding = 1
+        target.replicas[2].outstanding = 3
+
+        self.assertEqual("http://b", target.choose().url)
+
+    def test_ejected(self):
+        now = datetime(2015, 1, 1)
+        target = Upstream("suggest", ["http://a", "http://b"])
+        target.replicas[1].outstanding = 5
+        target.replicas[0].ejected_until = now + timedelta(seconds=1)
+
+        self.assertEqual("http://b", target.choose(now).url)
+        self.assertEqual("http://a", target.choose(now + timedelta(seconds=1)).url)
+
+    def test_all_ejected(self):
+        now = datetime(2015, 1, 1)
+        target = Upstream("suggest", ["http://a", "http://b"])
+        target.replicas[0].outstanding = 1
+        for replica in target.replicas:
+            replica.ejected_until = now + timedelta(seconds=1)
+
+        self.assertEqual("http://b", target.choose(now).url)
+
+
+class fetch(TestCase):
+    def test_outstanding(self):
+        target = Upstream("suggest", ["http://a"])
+        fetch = Mock()
+        callback = Mock()
+
+        with patch("api.upstream.AsyncHTTPClient", Mock(return_value=Mock(fetch=fetch))):
+            target.fetch("/cache?x=1", callback, method="DELETE")
+
+        self.assertEqual("http://a/cache?x=1", fetch.call_args[0][0].url)
+        self.assertEqual("DELETE", fetch.call_args[0][0].method)
+        self.assertEqual(1, target.replicas[0].outstanding)
+
+        response = Mock(code=200)
+        fetch.call_args[1]["callback"](response)
+
+        self.assertEqual(0, target.replicas[0].outstanding)
+        callback.assert_called_once_with(response)
+
+    def test_body(self):
+        target = Upstream("suggest", ["http://a"])
+        fetch = Mock()
+
+        with patch("api.upstream.AsyncHTTPClient", Mock(return_value=Mock(fetch=fetch))):
+            target.fetch("?x=1", Mock(), body="{}")
+
+        self.assertEqual("POST", fetch.call_args[0][0].method)
+        self.assertEqual(b"{}", fetch.call_args[0][0].body)
+
+
+class fetch_callback(TestCase):
+    def test_eject(self):
+        now = datetime(2015, 1, 1)
+        target = Upstream("suggest", ["http://a", "http://b"], eject_failures=2, eject_time=30)
+        replica = target.replicas[0]
+        replica.outstanding = 4
+
+        target.fetch_callback(Mock(code=599), replica, Mock(), now)
+        self.assertIsNone(replica.ejected_until)
+        target.fetch_callback(Mock(code=404), replica, Mock(), now)
+        target.fetch_callback(Mock(code=503), replica, Mock(), now)
+        self.assertIsNone(replica.ejected_until)
+        target.fetch_callback(Mock(code=500), replica, Mock(), now)
+
+        self.assertEqual(now + timedelta(seconds=30), replica.ejected_until)
+        self.assertEqual(0, replica.failures)
+        self.assertEqual(0, replica.outstanding)
+
+    def test_deadline_timeout(self):
+        limiter = Limiter("suggest", initial=10)
+        limiter.in_flight = 1
+        target = Upstream("suggest", ["http://a"], eject_failures=1, limiter=limiter)
+        replica = target.replicas[0]
+        replica.outstanding = 1
+        callback = Mock()
+
+        target.fetch_callback(Mock(code=599, request_time=5.0), replica, callback, deadline=Deadline(0))
+
+        self.assertIsNone(replica.ejected_until)
+        self.assertEqual(0, replica.failures)
+        self.assertEqual(10, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(1, callback.call_count)
+
+    def test_timeout_within_deadline(self):
+        limiter = Limiter("suggest", initial=10)
+        limiter.in_flight = 1
+        target = Upstream("suggest", ["http://a"], eject_failures=1, limiter=limiter)
+        replica = target.replicas[0]
+        replica.outstanding = 1
+
+        target.fetch_callback(Mock(code=599, request_time=1.0), replica, Mock(), deadline=Deadline(5))
+
+        self.assertIsNotNone(replica.ejected_until)
+        self.assertEqual(9, limiter.limit)
+
+
+class replica(TestCase):
+    def test_regular(self):
+        target = Upstream("detect", ["http://a:1", "http://b:1"])
+
+        self.assertEqual(target.replicas[1], target.replica("http://b:1/detection_id"))
+        self.assertIsNone(target.replica("http://c:1/detection_id"))
+
+
+class Limiter_acquire(TestCase):
+    def test_queue(self):
+        target = Limiter("suggest", initial=1, queue_size=1, queue_timeout=2)
+        first, second, third = Mock(), Mock(), Mock()
+        reject = Mock()
+        io_loop = Mock(time=Mock(return_value=10.0))
+
+        with patch("api.upstream.IOLoop.current", Mock(return_value=io_loop)):
+            self.assertTrue(target.acquire(first, reject))
+            self.assertTrue(target.acquire(second, reject))
+            self.assertTrue(target.full())
+            self.assertFalse(target.acquire(third, reject))
+
+            first.assert_called_once_with()
+            second.assert_not_called()
+            reject.assert_called_once_with()
+
+            target.release(0.1, True)
+
+        second.assert_called_once_with()
+        io_loop.remove_timeout.assert_called_once_with(io_loop.call_later.return_value)
+        self.assertEqual(1, target.in_flight)
+        self.assertFalse(target.full())
+
+    def test_expire(self):
+        target = Limiter("suggest", initial=1, queue_size=1, queue_timeout=2)
+        start, reject = Mock(), Mock()
+        io_loop = Mock(time=Mock(return_value=10.0))
+
+        with patch("api.upstream.IOLoop.current", Mock(return_value=io_loop)):
+            target.acquire(Mock(), Mock())
+            target.acquire(start, reject)
+
+        io_loop.call_later.assert_called_once_with(2, target.expire, target._queue[0])
+        target.expire(target._queue[0])
+
+        reject.assert_called_once_with()
+        start.assert_not_called()
+        self.assertEqual(0, len(target._queue))
+
+
+class Limiter_release(TestCase):
+    def test_increase(self):
+        target = Limiter("suggest", initial=4, maximum=5, latency=1)
+        target.in_flight = 4
+
+        target.release(0.1, True)
+
+        self.assertEqual(4.25, target.limit)
+
+    def test_idle(self):
+        target = Limiter("suggest", initial=4, maximum=5, latency=1)
+        target.in_flight = 1
+
+        target.release(0.1, True)
+
+        self.assertEqual(4, target.limit)
+
+    def test_decrease(self):
+        target = Limiter("suggest", initial=10, minimum=9, latency=1)
+        target.in_flight = 10
+
+        target.release(0.1, False)
+        self.assertEqual(9, target.limit)
+        target.in_flight = 10
+        target.release(2.0, True)
+        self.assertEqual(9, target.limit)
+
+
+class error_response(TestCase):
+    def test_limited(self):
+        target = Upstream("suggest", ["http://a"], limiter=Limiter("suggest", initial=0, queue_size=0))
+        callback = Mock()
+
+        deadline = Deadline(5)
+
+        target.fetch("/items", callback, deadline=deadline)
+
+        self.assertEqual(599, callback.call_args[0][0].code)
+        self.assertIsNotNone(callback.call_args[0][0].error)
+        self.assertEqual(0, target.replicas[0].outstanding)
+        self.assertTrue(deadline.rejected)
+
+    def test_deadline_gone(self):
+        target = Upstream("suggest", ["http://a"])
+        callback = Mock()
+        fetch = Mock()
+
+        with patch("api.upstream.AsyncHTTPClient", Mock(return_value=Mock(fetch=fetch))):
+            target.fetch("/items", callback, deadline=Deadline(0))
+
+        fetch.assert_not_called()
+        self.assertEqual(599, callback.call_args[0][0].code)
+
+
+class fetch_deadline(TestCase):
+    def test_timeouts(self):
+        target = Upstream("suggest", ["http://a"])
+        fetch = Mock()
+
+        with patch("api.upstream.AsyncHTTPClient", Mock(return_value=Mock(fetch=fetch))):
+            target.fetch("/items", Mock(), deadline=Deadline(5))
+
+        request = fetch.call_args[0][0]
+        self.assertLessEqual(request.request_timeout, 5)
+        self.assertGreater(request.request_timeout, 4)
+        self.assertIn("X-Deadline-Remaining-Ms", request.headers)
@@ -0,0 +1,74 @@
+import signal
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from api.workers import Workers as Target
+
+
+class exited(TestCase):
+    @patch("api.workers.os")
+    def test_replaced(self, os):
+        os.fork.side_effect = [101, 102]
+        target = Target(1, Mock())
+        target.spawn(0)
+
+        target.exited(101, 256, now=float("inf"))
+
+        self.assertDictEqual({102: 0}, {pid: x[0] for pid, x in target.children.items()})
+
+    @patch("api.workers.os")
+    def test_stopping(self, os):
+        os.fork.side_effect = [101, 102]
+        target = Target(1, Mock())
+        target.spawn(0)
+
+        target.stop()
+        target.exited(101, 0, now=float("inf"))
+
+        os.kill.assert_called_once_with(101, signal.SIGTERM)
+        self.assertDictEqual({}, target.children)
+
+
+class restart(TestCase):
+    @patch("api.workers.os")
+    def test(self, os):
+        os.fork.side_effect = [101, 102, 201, 202]
+        target = Target(2, Mock())
+        target.spawn(0)
+        target.spawn(1)
+
+        target.restart()
+
+        self.assertListEqual([((101, signal.SIGTERM),), ((102, signal.SIGTERM),)], os.kill.call_args_list)
+        self.assertSetEqual({101, 102}, target.retiring)
+
+        target.exited(101, 0)
+        target.exited(102, 0)
+
+        self.assertDictEqual({201: 0, 202: 1}, {pid: x[0] for pid, x in target.children.items()})
+        self.assertEqual(4, os.fork.call_count)
+
+
+class clear_caches(TestCase):
+    @patch("api.workers.os")
+    def test_relayed(self, os):
+        os.fork.side_effect = [101, 102]
+        target = Target(2, Mock())
+        target.spawn(0)
+        target.spawn(1)
+
+        target.clear_caches()
+
+        self.assertListEqual(
+            [((101, signal.SIGUSR1),), ((102, signal.SIGUSR1),)], os.kill.call_args_list
+        )
+
+    @patch("api.workers.os")
+    def test_from_worker(self, os):
+        self.assertFalse(Target.clear_all_caches())
+        os.kill.assert_not_called()
+
+        with patch.object(Target, "supervisor", 100):
+            self.assertTrue(Target.clear_all_caches())
+        os.kill.assert_called_once_with(100, signal.SIGUSR1)